@@ -0,0 +1,46 @@
+import json
+import time
+from collections import OrderedDict
+from salesforce_prototype_app.utilities.json_encoders import encode_row_stdlib, encode_row_orjson, orjson
+
+# Micro-benchmark of the ways of serialising rows for staging in S3, reporting rows/sec and CPU seconds per MB of
+# output for each.  "double" is the original approach, json.dump(json.dumps(row)), which writes each row as a quoted
+# JSON string.  Example:
+#
+#   python -m salesforce_prototype_app.helper_functions.benchmark_json_encoders
+
+BENCHMARK_ROW_COUNT = 500000
+
+
+def encode_row_double(row: dict) -> bytes:
+    return (json.dumps(json.dumps(row, default=str)) + '\n').encode('utf-8')
+
+
+def generate_rows(row_count: int) -> list:
+    # simple_salesforce returns each row as an OrderedDict
+    return [OrderedDict([('Id', f'003{n:015d}'), ('AccountId', f'001{n // 10:015d}'), ('Salutation', 'Dr.'),
+                         ('FirstName', f'First{n}'), ('LastName', f'Last{n * 7919 % 100003}'),
+                         ('NumberOfEmployees', n % 5000), ('AnnualRevenue', n * 1.5), ('IsDeleted', False),
+                         ('SystemModstamp', '2023-01-31T17:45:12.000+0000'), ('Description', None)])
+            for n in range(row_count)]
+
+
+if __name__ == '__main__':
+    rows = generate_rows(BENCHMARK_ROW_COUNT)
+    encoders = [('double', encode_row_double), ('stdlib', encode_row_stdlib)]
+    if orjson is not None:
+        encoders.append(('orjson', encode_row_orjson))
+    else:
+        print('orjson is not installed, skipping')
+
+    for name, encode_row in encoders:
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        byte_count = 0
+        for row in rows:
+            byte_count += len(encode_row(row))
+        wall_seconds = time.perf_counter() - wall_start
+        cpu_seconds = time.process_time() - cpu_start
+        megabytes = byte_count / (1024 * 1024)
+        print(f'{name:<8} {len(rows) / wall_seconds:>10,.0f} rows/sec  {cpu_seconds / megabytes:.4f} CPU sec/MB  '
+              f'{megabytes:.1f} MB')
@@ -0,0 +1,64 @@
+import argparse
+import gzip
+import io
+import json
+import os
+import time
+from salesforce_prototype_app.utilities.get_connections import get_aws_client
+from salesforce_prototype_app.utilities.s3_multipart_writer import S3MultipartWriter
+
+# Compares the time to first byte and total wall time of the two ways of staging rows in S3:
+#
+#   local-file - the original approach: write the whole gzip file to local disk, then upload it with upload_file
+#   streaming  - compress rows straight into an S3 multipart upload (S3MultipartWriter)
+#
+# Synthetic rows are generated with a delay per page to mimic waiting on Salesforce.  Example:
+#
+#   python -m salesforce_prototype_app.helper_functions.benchmark_s3_upload --bucket ageorge-dev-salesforce-prototype
+
+
+def generate_rows(row_count: int, page_size: int, page_delay_seconds: float):
+    for n in range(row_count):
+        if n % page_size == 0:
+            time.sleep(page_delay_seconds)
+        yield {'Id': f'003{n:015d}', 'AccountId': f'001{n // 10:015d}', 'Salutation': 'Dr.',
+               'FirstName': f'First{n}', 'LastName': f'Last{n * 7919 % 100003}'}
+
+
+def upload_local_file(s3, bucket: str, key: str, rows) -> tuple[float, float]:
+    start_time = time.perf_counter()
+    filename = os.path.basename(key)
+    with gzip.open(filename, mode='wt', encoding='UTF8', newline='') as f:
+        for row in rows:
+            f.write(json.dumps(row, default=str))
+            f.write('\n')
+    first_byte_time = time.perf_counter()
+    s3.upload_file(Filename=filename, Bucket=bucket, Key=key)
+    os.remove(filename)
+    return first_byte_time - start_time, time.perf_counter() - start_time
+
+
+def upload_streaming(s3, bucket: str, key: str, rows) -> tuple[float, float]:
+    with S3MultipartWriter(s3, bucket, key) as s3_file:
+        with io.TextIOWrapper(gzip.GzipFile(fileobj=s3_file, mode='wb'), encoding='UTF8', newline='') as f:
+            for row in rows:
+                f.write(json.dumps(row, default=str))
+                f.write('\n')
+    return s3_file.time_to_first_byte, time.perf_counter() - s3_file.start_time
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark staging rows in S3')
+    parser.add_argument('--bucket', required=True)
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--page-size', type=int, default=2000)
+    parser.add_argument('--page-delay', type=float, default=0.05, help='seconds to wait per page of rows')
+    args = parser.parse_args()
+
+    s3_client = get_aws_client('s3')
+    for name, upload in (('local-file', upload_local_file), ('streaming', upload_streaming)):
+        benchmark_key = f'benchmark/{name}.json.gz'
+        ttfb, total = upload(s3_client, args.bucket, benchmark_key,
+                             generate_rows(args.rows, args.page_size, args.page_delay))
+        s3_client.delete_object(Bucket=args.bucket, Key=benchmark_key)
+        print(f'{name:<12} time to first byte {ttfb:6.1f} sec, total {total:6.1f} sec')
@@ -0,0 +1,93 @@
+import csv
+import io
+import json
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from salesforce_prototype_app.utilities.salesforce_bulk import query_bulk_api
+
+# A local stand-in for the Salesforce Bulk API 2.0 query endpoints, so that the BULK extract engine can be exercised
+# without a Salesforce org.  Run this file directly to start the fake endpoint and extract from it:
+#
+#   python -m salesforce_prototype_app.helper_functions.fake_bulk_api
+
+FAKE_API_PATH = '/services/data/v52.0/'
+FAKE_ROW_COUNT = 120000
+FAKE_POLLS_BEFORE_COMPLETE = 2
+
+
+class FakeBulkApiHandler(BaseHTTPRequestHandler):
+    """
+    Handles the create job, get job and get job results requests of the Bulk API 2.0 query endpoints.
+    """
+    jobs = {}
+
+    def do_POST(self):
+        if self.path != FAKE_API_PATH + 'jobs/query':
+            return self.send_json(404, {'errorCode': 'NOT_FOUND'})
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        job_id = f'750FAKE{len(self.jobs):011d}'
+        self.jobs[job_id] = {'query': body['query'], 'polls': 0}
+        self.send_json(200, {'id': job_id, 'operation': 'query', 'state': 'UploadComplete'})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path[len(FAKE_API_PATH):].split('/')
+        if len(parts) < 3 or parts[:2] != ['jobs', 'query'] or parts[2] not in self.jobs:
+            return self.send_json(404, {'errorCode': 'NOT_FOUND'})
+        job_id = parts[2]
+        job = self.jobs[job_id]
+        if len(parts) == 3:
+            job['polls'] += 1
+            state = 'JobComplete' if job['polls'] > FAKE_POLLS_BEFORE_COMPLETE else 'InProgress'
+            return self.send_json(200, {'id': job_id, 'state': state, 'numberRecordsProcessed': FAKE_ROW_COUNT})
+        params = parse_qs(url.query)
+        max_records = int(params['maxRecords'][0])
+        offset = int(params['locator'][0]) if 'locator' in params else 0
+        end = min(offset + max_records, FAKE_ROW_COUNT)
+        page = io.StringIO()
+        writer = csv.writer(page, lineterminator='\n')
+        writer.writerow(['Id', 'FirstName', 'LastName', 'Salutation'])
+        for n in range(offset, end):
+            writer.writerow([f'003FAKE{n:011d}', f'First{n}', f'Last{n}', 'Dr.' if n % 3 == 0 else ''])
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Sforce-Locator', str(end) if end < FAKE_ROW_COUNT else 'null')
+        self.end_headers()
+        self.wfile.write(page.getvalue().encode('utf-8'))
+
+    def send_json(self, status: int, body: dict):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(body).encode('utf-8'))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_bulk_api() -> ThreadingHTTPServer:
+    """
+    Start the fake Bulk API on a free local port, on a background thread.
+
+    Returns
+    -------
+    ThreadingHTTPServer
+        The running server; call shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBulkApiHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    fake_server = start_fake_bulk_api()
+    fake_base_url = f'http://127.0.0.1:{fake_server.server_port}{FAKE_API_PATH}'
+    rows = list(query_bulk_api(requests.Session(), fake_base_url, 'fake-session-id',
+                               'SELECT Id, FirstName, LastName, Salutation FROM Contact'))
+    fake_server.shutdown()
+    assert len(rows) == FAKE_ROW_COUNT, f'expected {FAKE_ROW_COUNT} rows, got {len(rows)}'
+    assert rows[0] == {'Id': '003FAKE00000000000', 'FirstName': 'First0', 'LastName': 'Last0', 'Salutation': 'Dr.'}
+    assert rows[1]['Salutation'] is None
+    print(f'Fake Bulk API extract complete: {len(rows)} rows')
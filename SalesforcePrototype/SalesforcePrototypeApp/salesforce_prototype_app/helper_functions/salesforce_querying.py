@@ -1,5 +1,5 @@
 from salesforce_prototype_app.utilities.get_connections import get_salesforce
-from simple_salesforce import SFType
+from salesforce_prototype_app.utilities.salesforce_describe_cache import get_sobject_describe
 from tabulate import tabulate
 import salesforce_prototype_app.utilities.app_environment as app_env
 
@@ -26,8 +26,7 @@ def salesforce_query():
 def get_salesforce_fields_from_entity():
     sf = get_salesforce()
     object_name = input('Specify object name: ')
-    sf_type = SFType(object_name, session_id=sf.session_id, sf_instance=sf.sf_instance)
-    description = sf_type.describe()
+    description = get_sobject_describe(object_name, sf)
     fields = description['fields']
     table_data = list(map(lambda x: [x['name'], x['label'], x['type']], fields))
     print(tabulate(table_data, headers=['Name', 'Label', 'SF Data Type']))
@@ -1,35 +1,95 @@
 import posixpath
 
-from salesforce_prototype_app.utilities.get_connections import  get_user_secret_arn_from_aws, get_user_secret_from_aws
-from salesforce_prototype_app.utilities.app_environment import is_running_in_container
+from salesforce_prototype_app.utilities.get_connections import  get_user_secret_from_aws
+from salesforce_prototype_app.utilities.app_environment import is_running_in_container, is_running_in_aws
 from salesforce_prototype_app.utilities.salesforce_poc import salesforce_poc, pull_salesforce_entity, write_target_rows_yield_json_s3
 from salesforce_prototype_app.utilities.copyinto_snowflake import copyinto_snowflake, truncate_snowflaketable
-from salesforce_prototype_app.utilities.snowflake_config import get_valid_salesforce_entities
+from salesforce_prototype_app.utilities.snowflake_config import get_valid_salesforce_entities, get_salesforce_entity_configs
 from salesforce_prototype_app.utilities.snowflake_merge import mergeinto_snowflake
 from salesforce_prototype_app.helper_functions.testing2 import do_something
 from enum import Enum
+import argparse
 import os
 from multiprocessing import Process
 import multiprocessing
-from salesforce_prototype_app.utilities.main_multip_wrapper import main_multip_wrapper
+from salesforce_prototype_app.utilities.main_multip_wrapper import main_multip_wrapper, main_pipeline, init_pool_worker
+from salesforce_prototype_app.utilities.async_engine import main_asyncio
+from salesforce_prototype_app.utilities.entity_scheduler import load_run_history, save_run_history, \
+    order_entities_longest_first, get_worker_count, run_entities_in_pool, format_entity_run_results
+from salesforce_prototype_app.utilities.run_metrics import new_run_id, take_stage_metrics, write_run_metrics
+from salesforce_prototype_app.utilities.run_checkpoints import set_checkpoint_run
+from salesforce_prototype_app.utilities.secrets_provider import prefetch_secrets
+from salesforce_prototype_app.utilities.tracing import set_trace_id
+from salesforce_prototype_app.utilities.get_connections import get_salesforce_secret_names, get_salesforce, \
+    init_salesforce_session
+from salesforce_prototype_app.utilities.rsa_tools import AWS_SECRET_NAME
 
 if __name__ == '__main__':
     print('Starting Salesforce ELT process...')
     print(f"It is {is_running_in_container()} that the code is running in a container")
-    # print(get_user_secret_arn_from_aws("ageorge-dev-salesforce-prototype"))
     # print(get_user_secret_from_aws("ageorge-dev-salesforce-prototype"))
 
-    valid_salesforce_entities = get_valid_salesforce_entities()
-
-    new_list = []
-    for sf_entity_name in valid_salesforce_entities:
-        new_list.append(sf_entity_name[0])
-
-    no_of_processes = 4
-
-
-    pool = multiprocessing.Pool(processes=no_of_processes)
-    pool.map(main_multip_wrapper, new_list)
+    parser = argparse.ArgumentParser(description='Salesforce ELT process')
+    parser.add_argument('--full-refresh', action='store_true',
+                        help='extract every row of incremental entities, ignoring their high water marks')
+    parser.add_argument('--mode', choices=['pool', 'pipeline', 'asyncio'], default='pool',
+                        help='pool: process each entity from start to finish in a worker process, longest first; '
+                             'pipeline: overlap the extract, COPY and MERGE stages of different entities on threads; '
+                             'asyncio: extract every entity at once on an event loop, with Snowflake on threads')
+    parser.add_argument('--resume', metavar='RUN_ID',
+                        help='continue an interrupted run from its checkpoints, skipping the stages it completed')
+    args = parser.parse_args()
+
+    # read every secret the app needs at once, rather than one at a time as each login needs it - they are passed to
+    # the pool workers, so the workers do not read them again
+    secrets = prefetch_secrets([AWS_SECRET_NAME] + (get_salesforce_secret_names() if is_running_in_aws() else []))
+
+    # each entity's config (e.g. its extract engine) is passed to the worker processing it
+    entity_configs = get_salesforce_entity_configs()
+    for entity_config in entity_configs:
+        entity_config.full_refresh = args.full_refresh
+
+    # the entities that took longest last time start first, on as many workers as the CPU quota can keep busy
+    run_history = load_run_history()
+    entity_configs = order_entities_longest_first(entity_configs, run_history)
+    no_of_processes = get_worker_count(len(entity_configs), run_history)
+
+
+    # log in to Salesforce once and share the session with every worker, rather than each entity logging in
+    sf = get_salesforce()
+
+    # every stage of every entity is recorded in RUN_METRICS under this id, even if the run fails - a resumed run
+    # keeps the id of the run it continues
+    run_id = args.resume if args.resume is not None else new_run_id()
+    print(f'{"Resuming run" if args.resume is not None else "Run"} {run_id} ({args.mode} mode)')
+    # each entity's progress is checkpointed under the run id, inherited by the pool workers
+    set_checkpoint_run(run_id, resume=args.resume is not None)
+    # the spans of every worker are recorded under the run id, so one run can be picked out of the traces
+    set_trace_id(run_id)
+    stage_metrics = []
+    try:
+        if args.mode == 'pipeline':
+            init_salesforce_session(sf.session_id, sf.sf_instance)
+            main_pipeline(entity_configs, no_of_processes)
+        elif args.mode == 'asyncio':
+            init_salesforce_session(sf.session_id, sf.sf_instance)
+            main_asyncio(entity_configs)
+        else:
+            results = run_entities_in_pool(entity_configs, main_multip_wrapper, no_of_processes,
+                                           initializer=init_pool_worker,
+                                           initargs=(sf.session_id, sf.sf_instance, secrets))
+            stage_metrics = [metrics for result in results for metrics in result.stage_metrics]
+            print(format_entity_run_results(results))
+            save_run_history(run_history, results)
+            failed_entities = [result.entity_name for result in results if not result.succeeded]
+            if len(failed_entities) > 0:
+                raise RuntimeError(f'Processing failed for {", ".join(failed_entities)}')
+    except Exception:
+        print(f'Run {run_id} failed - run again with --resume {run_id} to skip the work it completed')
+        raise
+    finally:
+        # the pipeline and asyncio modes run every stage in this process
+        write_run_metrics(run_id, stage_metrics + take_stage_metrics())
 
 
 
@@ -0,0 +1,87 @@
+import asyncio
+import time
+import zlib
+import salesforce_prototype_app.utilities.async_engine as async_engine
+from simple_salesforce.exceptions import SalesforceExpiredSession
+
+
+class FakeS3File:
+    def __init__(self, key: str, aborted: list[str]):
+        self.key = key
+        self.bytes_written = 0
+        self.start_time = time.perf_counter()
+        self.time_to_first_byte = None
+        self._aborted = aborted
+
+    async def write(self, data: bytes):
+        self.bytes_written += len(data)
+
+    def tell(self) -> int:
+        return self.bytes_written
+
+    async def close(self):
+        pass
+
+    async def abort(self):
+        self._aborted.append(self.key)
+
+
+def get_fake_engine(monkeypatch, aborted: list[str], released: list[str]) -> async_engine.AsyncEngine:
+    engine = async_engine.AsyncEngine(max_in_flight_requests=4, snowflake_workers=1, max_concurrent_entities=1)
+
+    async def start_file(s3, bucket, key):
+        return FakeS3File(key, aborted), zlib.compressobj(9, zlib.DEFLATED, 31)
+
+    async def query_salesforce_pages(sf, soql):
+        # 'fast' finishes, 'slow' is still running when 'expired' fails
+        if soql == 'expired':
+            await asyncio.sleep(0.05)
+            raise SalesforceExpiredSession('url', 401, 'query', b'')
+        yield [{'Id': soql}]
+        if soql == 'slow':
+            await asyncio.sleep(10)
+            yield [{'Id': soql}]
+
+    monkeypatch.setattr(engine, 'start_file', start_file)
+    monkeypatch.setattr(engine, 'query_salesforce_pages', query_salesforce_pages)
+    monkeypatch.setattr(async_engine, 'get_aws_client', lambda client_name: None)
+    monkeypatch.setattr(async_engine, 'release_staged_files', lambda entity_name, keys: released.extend(keys))
+    return engine
+
+
+def test_write_chunks_to_s3(monkeypatch):
+    aborted = []
+    released = []
+    engine = get_fake_engine(monkeypatch, aborted, released)
+
+    async def write_chunks():
+        return await engine.write_chunks_to_s3('Account', [
+            engine.write_query_to_s3(None, 'Account', 'fast', '_chunk0001'),
+            engine.write_query_to_s3(None, 'Account', 'fast', '_chunk0002')])
+
+    filenames = asyncio.run(write_chunks())
+    assert len(filenames) == 2
+    assert '_chunk0001_0001' in filenames[0] and '_chunk0002_0001' in filenames[1]
+    assert aborted == [] and released == []
+
+
+def test_write_chunks_to_s3_cancels_sibling_chunks(monkeypatch):
+    aborted = []
+    released = []
+    engine = get_fake_engine(monkeypatch, aborted, released)
+
+    async def write_chunks():
+        chunk_writes = [engine.write_query_to_s3(None, 'Account', soql, f'_chunk{chunk_number:04d}')
+                        for chunk_number, soql in enumerate(['fast', 'slow', 'expired'], start=1)]
+        try:
+            await engine.write_chunks_to_s3('Account', chunk_writes)
+        except SalesforceExpiredSession:
+            # every chunk has stopped by the time the failure is raised
+            return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        raise AssertionError('SalesforceExpiredSession was not raised')
+
+    pending_tasks = asyncio.run(write_chunks())
+    assert pending_tasks == []
+    # the slow chunk was cancelled and its upload aborted, and the finished chunk's file released
+    assert len(aborted) == 1 and '_chunk0002_0001' in aborted[0]
+    assert len(released) == 1 and '_chunk0001_0001' in released[0]
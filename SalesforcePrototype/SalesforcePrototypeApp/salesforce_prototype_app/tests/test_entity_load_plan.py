@@ -0,0 +1,27 @@
+import pytest
+from salesforce_prototype_app.utilities.entity_load_plan import EntityLoadPlan
+from salesforce_prototype_app.utilities.snowflake_config import SalesforceEntityConfig
+
+ACCOUNT_DESCRIBE = {'fields': [{'name': 'Id', 'type': 'id'},
+                               {'name': 'AccountId', 'type': 'reference'},
+                               {'name': 'AnnualRevenue', 'type': 'currency'},
+                               {'name': 'SystemModstamp', 'type': 'datetime'}]}
+
+
+def test_configured_names_are_spelt_as_described():
+    entity_config = SalesforceEntityConfig('Account', load_type='INCREMENTAL', watermark_column='systemmodstamp',
+                                           select_columns=['id', 'accountid', 'AnnualRevenue'])
+    load_plan = EntityLoadPlan(entity_config, ACCOUNT_DESCRIBE)
+    assert load_plan.column_names == ['Id', 'AccountId', 'AnnualRevenue']
+    assert load_plan.watermark_column == 'SystemModstamp'
+    assert load_plan.soql == 'SELECT Id, AccountId, AnnualRevenue, SystemModstamp FROM Account'
+    assert load_plan.field_types == {'Id': 'id', 'AccountId': 'reference', 'AnnualRevenue': 'currency',
+                                     'SystemModstamp': 'datetime'}
+    assert load_plan.copy_select_list == '$1:Id::VARCHAR as Id, $1:AccountId::VARCHAR as AccountId, ' \
+                                         '$1:AnnualRevenue::FLOAT as AnnualRevenue'
+
+
+def test_unknown_field_is_rejected():
+    entity_config = SalesforceEntityConfig('Account', select_columns=['Id', 'Name'])
+    with pytest.raises(ValueError, match='Account has no field\\(s\\) named Name'):
+        EntityLoadPlan(entity_config, ACCOUNT_DESCRIBE)
@@ -0,0 +1,19 @@
+import pytest
+import salesforce_prototype_app.utilities.run_metrics as run_metrics
+
+
+def test_discard_failed_stage_metrics():
+    run_metrics.take_stage_metrics()
+    with run_metrics.StageMetrics('Account', 'extract'):
+        pass
+    with pytest.raises(RuntimeError):
+        with run_metrics.StageMetrics('Account', 'copy'):
+            raise RuntimeError('expired')
+    with pytest.raises(RuntimeError):
+        with run_metrics.StageMetrics('Contact', 'extract'):
+            raise RuntimeError('expired')
+
+    run_metrics.discard_failed_stage_metrics('Account')
+    # the stage that succeeded is kept, as the retry skips it, and other entities are not affected
+    assert [(metrics.entity_name, metrics.stage_name) for metrics in run_metrics.take_stage_metrics()] == \
+           [('Account', 'extract'), ('Contact', 'extract')]
@@ -48,6 +48,9 @@ class EnvironmentVariableNames(Enum):
     AWS_PROFILE_NAME = 11,  # for debug use outside of AWS only
     AWS_S3_BUCKET_NAME = 12
     AWS_SNS_TOPIC_ARN = 14,
+    AWS_S3_UPLOAD_PART_SIZE_MB = 15,
+    AWS_S3_UPLOAD_MAX_CONCURRENCY = 16,
+    AWS_S3_STAGING_FILE_MAX_SIZE_MB = 17,
     DATA_SOURCE_GAS_ROOT_URL = 21,
     DATA_SOURCE_GAS_FILENAMES = 22,
     DATA_SOURCE_ELECTRICITY_ROOT_URL = 23,
@@ -58,6 +61,20 @@ class EnvironmentVariableNames(Enum):
     SNOWFLAKE_ROLE_NAME = 34,
     SNOWFLAKE_WH_NAME = 35,
     SNOWFLAKE_DB_NAME = 36
+    JSON_ENCODER = 37,
+    SECRETS_CACHE_TTL_SECONDS = 38,
+    SCHEDULER_MAX_WORKERS = 39,
+    SALESFORCE_AUTH_METHOD = 51,
+    SALESFORCE_TOKEN_STORE = 52,
+    SALESFORCE_TOKEN_STORE_NAME = 53,
+    SALESFORCE_TOKEN_MAX_AGE_SECONDS = 54,
+    SALESFORCE_MAX_IN_FLIGHT_REQUESTS = 55,
+    ASYNC_MAX_CONCURRENT_ENTITIES = 56,
+    TRACING_EXPORTER = 61,
+    TRACING_FILE_PATH = 62,
+    # the following are set from Systems Manager parameters, so are named after them, e.g. CRUK_EXTRACTMAXCONCURRENCY
+    EXTRACTMAXCONCURRENCY = 41,
+    SNOWFLAKEMAXCONCURRENCY = 42,
     DELETE_DATA_FILES = 90
 
 def get_env_var_value(env_var: EnvironmentVariableNames) -> str:
@@ -78,3 +95,23 @@ def get_env_var_value(env_var: EnvironmentVariableNames) -> str:
         The value of the environment variable.
     """
     return os.getenv('CRUK_' + env_var.name, '')
+
+
+def get_int_env_var_value(env_var: EnvironmentVariableNames, default_value: int) -> int:
+    """
+    Get the value of an environment variable as a positive integer.
+
+    Parameters
+    ----------
+    env_var : EnvironmentVariableNames
+        The environment variable to retrieve the value of.
+    default_value : int
+        The value to return if the environment variable is not set or is not a positive integer.
+
+    Returns
+    -------
+    int
+        The value of the environment variable.
+    """
+    value = get_env_var_value(env_var)
+    return int(value) if value.isdigit() and int(value) > 0 else default_value
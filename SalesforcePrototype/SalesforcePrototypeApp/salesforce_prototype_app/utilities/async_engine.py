@@ -0,0 +1,341 @@
+import asyncio
+import functools
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urljoin
+import aiohttp
+from simple_salesforce.exceptions import SalesforceExpiredSession
+import salesforce_prototype_app.utilities.app_environment as app_env
+from salesforce_prototype_app.utilities.get_connections import get_salesforce, get_aws_client, \
+    renew_salesforce_session
+from salesforce_prototype_app.utilities.entity_load_plan import get_entity_load_plan
+from salesforce_prototype_app.utilities.json_encoders import get_row_encoder
+from salesforce_prototype_app.utilities.main_multip_wrapper import ExtractedEntity, extract_salesforce_entity, \
+    copy_salesforce_entity, merge_salesforce_entity, get_snowflake_max_concurrency
+from salesforce_prototype_app.utilities.performance_stats import format_extract_stats
+from salesforce_prototype_app.utilities.run_metrics import StageMetrics, discard_failed_stage_metrics
+from salesforce_prototype_app.utilities.run_checkpoints import get_entity_checkpoint
+from salesforce_prototype_app.utilities.salesforce_pk_chunking import get_pk_chunk_ranges, get_pk_chunk_where_clause
+from salesforce_prototype_app.utilities.salesforce_poc import get_watermark_where_clause, \
+    STAGING_FILE_DEFAULT_MAX_SIZE_MB
+from salesforce_prototype_app.utilities.s3_async_multipart_writer import AsyncS3MultipartWriter
+from salesforce_prototype_app.utilities.staging_files import STAGING_BUCKET_NAME, get_staging_key, \
+    release_staged_files
+from salesforce_prototype_app.utilities.snowflake_config import SalesforceEntityConfig, ExtractEngines, StagingFormats
+from salesforce_prototype_app.utilities.snowflake_connection_pool import format_connection_pool_stats
+from salesforce_prototype_app.utilities.snowflake_query_coordinator import get_query_coordinator
+from salesforce_prototype_app.utilities.snowflake_watermark import WatermarkTracker, get_high_water_mark
+
+SALESFORCE_DEFAULT_MAX_IN_FLIGHT_REQUESTS = 16
+ASYNC_DEFAULT_MAX_CONCURRENT_ENTITIES = 8
+S3_DEFAULT_MAX_IN_FLIGHT_PARTS = 16  # across every file being written, so at most 16 parts (128 MiB) are buffered
+
+
+class AsyncEngine:
+    """
+    Processes every entity on one asyncio event loop, so that a single small task can keep many Salesforce queries
+    and S3 part uploads in flight at once - the extraction is almost entirely waiting on the network, so it needs
+    concurrency rather than CPUs.
+
+    Salesforce REST paging and S3 part uploads are made with aiohttp.  Snowflake has no asyncio driver, so its
+    statements run on a small thread pool, as do the few other blocking calls (describe, PK chunk boundaries).
+    Entities extracted with the Bulk API, or staged as Parquet, are extracted by the blocking code on a thread.
+    """
+
+    def __init__(self, max_in_flight_requests: int = None, snowflake_workers: int = None,
+                 max_concurrent_entities: int = None):
+        """
+        Parameters
+        ----------
+        max_in_flight_requests : int
+            The maximum number of Salesforce requests in flight at once, across every entity.  Defaults to
+            CRUK_SALESFORCE_MAX_IN_FLIGHT_REQUESTS, or 16 if not set.
+        snowflake_workers : int
+            The number of threads running Snowflake statements.  Defaults to the SnowflakeMaxConcurrency parameter.
+        max_concurrent_entities : int
+            The maximum number of entities processed at once, so their describes, checkpoints and staged files are
+            not all started together.  Defaults to CRUK_ASYNC_MAX_CONCURRENT_ENTITIES, or 8 if not set.
+        """
+        if max_in_flight_requests is None:
+            max_in_flight_requests = app_env.get_int_env_var_value(
+                app_env.EnvironmentVariableNames.SALESFORCE_MAX_IN_FLIGHT_REQUESTS,
+                SALESFORCE_DEFAULT_MAX_IN_FLIGHT_REQUESTS)
+        self.max_in_flight_requests = max_in_flight_requests
+        if max_concurrent_entities is None:
+            max_concurrent_entities = app_env.get_int_env_var_value(
+                app_env.EnvironmentVariableNames.ASYNC_MAX_CONCURRENT_ENTITIES, ASYNC_DEFAULT_MAX_CONCURRENT_ENTITIES)
+        self.max_concurrent_entities = max_concurrent_entities
+        self.snowflake_workers = snowflake_workers if snowflake_workers is not None \
+            else get_snowflake_max_concurrency()
+        self.max_file_bytes = app_env.get_int_env_var_value(
+            app_env.EnvironmentVariableNames.AWS_S3_STAGING_FILE_MAX_SIZE_MB, STAGING_FILE_DEFAULT_MAX_SIZE_MB) \
+            * 1024 * 1024
+        self.failures = []  # (entity config, exception)
+        self.http_session = None
+        self.request_slots = None
+        self.upload_slots = None
+        self.entity_slots = None
+        self.snowflake_executor = None
+
+    def run(self, entity_configs: list[SalesforceEntityConfig]):
+        """
+        Process every entity, returning once they have all finished or failed.
+        """
+        asyncio.run(self.run_async(entity_configs))
+
+    async def run_async(self, entity_configs: list[SalesforceEntityConfig]):
+        # semaphores must be created on the loop that uses them
+        self.request_slots = asyncio.Semaphore(self.max_in_flight_requests)
+        self.upload_slots = asyncio.Semaphore(S3_DEFAULT_MAX_IN_FLIGHT_PARTS)
+        self.entity_slots = asyncio.Semaphore(self.max_concurrent_entities)
+        self.snowflake_executor = ThreadPoolExecutor(max_workers=self.snowflake_workers,
+                                                     thread_name_prefix='snowflake')
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight_requests + S3_DEFAULT_MAX_IN_FLIGHT_PARTS)
+        try:
+            async with aiohttp.ClientSession(connector=connector) as self.http_session:
+                results = await asyncio.gather(*(self.process_salesforce_entity(entity_config)
+                                                 for entity_config in entity_configs), return_exceptions=True)
+        finally:
+            self.snowflake_executor.shutdown()
+        for entity_config, result in zip(entity_configs, results):
+            if isinstance(result, BaseException):
+                print(f'Processing {entity_config.entity_name} failed: {result!r}')
+                self.failures.append((entity_config, result))
+
+    async def process_salesforce_entity(self, entity_config: SalesforceEntityConfig):
+        loop = asyncio.get_running_loop()
+        async with self.entity_slots:
+            try:
+                extracted_entity = await self.extract_salesforce_entity(entity_config)
+            except SalesforceExpiredSession:
+                print(f'Salesforce session expired while extracting {entity_config.entity_name}, logging in again')
+                await loop.run_in_executor(None, renew_salesforce_session)
+                discard_failed_stage_metrics(entity_config.entity_name)
+                extracted_entity = await self.extract_salesforce_entity(entity_config)
+            await loop.run_in_executor(self.snowflake_executor, copy_salesforce_entity, extracted_entity)
+            await loop.run_in_executor(self.snowflake_executor, merge_salesforce_entity, extracted_entity)
+
+    async def extract_salesforce_entity(self, entity_config: SalesforceEntityConfig) -> ExtractedEntity:
+        loop = asyncio.get_running_loop()
+        salesforce_entity_name = entity_config.entity_name
+        checkpoint = await loop.run_in_executor(None, get_entity_checkpoint, salesforce_entity_name)
+        # an entity extracted (or partly extracted) by an interrupted run is picked up from its checkpoint by the
+        # synchronous extraction, which records the page and chunks it has got to
+        if entity_config.extract_engine == ExtractEngines.BULK or \
+                entity_config.staging_format == StagingFormats.PARQUET or checkpoint.extracted or \
+                len(checkpoint.filenames) > 0 or len(checkpoint.chunk_filenames) > 0:
+            return await loop.run_in_executor(None, extract_salesforce_entity, entity_config)
+
+        with StageMetrics(salesforce_entity_name, 'extract') as stage_metrics:
+            print(f'Currently processing {salesforce_entity_name} (asyncio)')
+            sf = get_salesforce()
+            load_plan = await loop.run_in_executor(None, get_entity_load_plan, entity_config, sf)
+
+            watermark_where_clause = None
+            watermark_tracker = None
+            if entity_config.is_incremental:
+                if entity_config.full_refresh:
+                    print(f'Full refresh of {salesforce_entity_name} requested, ignoring its high water mark')
+                else:
+                    high_water_mark = await loop.run_in_executor(self.snowflake_executor, get_high_water_mark,
+                                                                 salesforce_entity_name)
+                    watermark_where_clause = get_watermark_where_clause(load_plan.watermark_column, high_water_mark)
+                    print(f'Extracting {salesforce_entity_name} rows with {watermark_where_clause}')
+                watermark_tracker = WatermarkTracker(load_plan.watermark_column)
+
+            if entity_config.pk_chunk_size is not None:
+                id_ranges = await loop.run_in_executor(None, get_pk_chunk_ranges, sf, salesforce_entity_name,
+                                                       entity_config.pk_chunk_size, watermark_where_clause)
+            else:
+                id_ranges = [(None, None)]
+
+            # every ID range is queried at once - the number of requests in flight is limited across all entities
+            chunk_writes = []
+            for chunk_number, id_range in enumerate(id_ranges, start=1):
+                where_clauses = [clause for clause in (watermark_where_clause, get_pk_chunk_where_clause(id_range))
+                                 if clause is not None]
+                soql = load_plan.soql + (' WHERE ' + ' AND '.join(where_clauses) if len(where_clauses) > 0 else '')
+                file_suffix = f'_chunk{chunk_number:04d}' if len(id_ranges) > 1 else ''
+                chunk_writes.append(self.write_query_to_s3(sf, salesforce_entity_name, soql, file_suffix,
+                                                           watermark_tracker, stage_metrics))
+            filenames = await self.write_chunks_to_s3(salesforce_entity_name, chunk_writes)
+            extracted_entity = ExtractedEntity(entity_config, load_plan, filenames, watermark_tracker)
+            extracted_entity.byte_count = stage_metrics.bytes_compressed
+            # saved on a thread, as it writes to S3
+            await loop.run_in_executor(None, functools.partial(
+                checkpoint.update, extracted=True, filenames=filenames, byte_count=extracted_entity.byte_count,
+                watermark_max_value=watermark_tracker.max_value if watermark_tracker is not None else None))
+            return extracted_entity
+
+    @staticmethod
+    async def write_chunks_to_s3(salesforce_entity_name: str, chunk_writes: list) -> list[str]:
+        """
+        Run the writes of an entity's chunks at once.  If one fails, the others are cancelled, which aborts their
+        uploads, and waited for, so nothing is left running when the extraction is retried - and the files of the
+        chunks that had finished are released, as the whole entity is extracted again.
+
+        Parameters
+        ----------
+        salesforce_entity_name : str
+            The name of the Salesforce entity.
+        chunk_writes : list
+            The write_query_to_s3() coroutine of each chunk.
+
+        Returns
+        -------
+        list[str]
+            The keys of the files written to S3, in chunk order.
+
+        Raises
+        ------
+        Exception
+            The first failure of a chunk, e.g. SalesforceExpiredSession so that the caller can log in and retry.
+        """
+        chunk_tasks = [asyncio.ensure_future(chunk_write) for chunk_write in chunk_writes]
+        try:
+            chunk_filenames = await asyncio.gather(*chunk_tasks)
+        except BaseException:
+            for task in chunk_tasks:
+                task.cancel()
+            await asyncio.gather(*chunk_tasks, return_exceptions=True)
+            finished_filenames = [filename for task in chunk_tasks
+                                  if not task.cancelled() and task.exception() is None
+                                  for filename in task.result()]
+            if len(finished_filenames) > 0:
+                await asyncio.get_running_loop().run_in_executor(None, release_staged_files, salesforce_entity_name,
+                                                                 finished_filenames)
+            raise
+        return [filename for filenames in chunk_filenames for filename in filenames]
+
+    async def query_salesforce_pages(self, sf, soql: str):
+        """
+        Run a SOQL query and yield each page of rows, without the Salesforce 'attributes' entries.  The next page is
+        requested while the current one is being written, so Salesforce and S3 are busy at the same time.
+        """
+        headers = {'Authorization': 'Bearer ' + sf.session_id}
+        next_page = asyncio.create_task(self.get_salesforce_json(f'{sf.base_url}query/', headers, {'q': soql}))
+        try:
+            while next_page is not None:
+                results = await next_page
+                next_page = None
+                if not results['done']:
+                    next_page = asyncio.create_task(
+                        self.get_salesforce_json(urljoin(sf.base_url, results['nextRecordsUrl']), headers))
+                rows = results['records']
+                for row in rows:
+                    del row['attributes']
+                yield rows
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+
+    async def get_salesforce_json(self, url: str, headers: dict, params: dict = None) -> dict:
+        async with self.request_slots:
+            async with self.http_session.get(url, headers=headers, params=params) as response:
+                # raise an invalid session (INVALID_SESSION_ID) as simple_salesforce does, so it is handled the same
+                if response.status == 401:
+                    raise SalesforceExpiredSession(url, response.status, 'query', await response.read())
+                response.raise_for_status()
+                return await response.json()
+
+    async def write_query_to_s3(self, sf, salesforce_entity_name: str, soql: str, file_suffix: str,
+                                watermark_tracker: WatermarkTracker = None,
+                                stage_metrics: StageMetrics = None) -> list[str]:
+        """
+        Write the rows of a SOQL query to one or more gzip-compressed NDJSON files in S3, starting a new file when the
+        current one reaches the maximum staging file size.  Files are only split between pages of rows.
+
+        Returns
+        -------
+        list[str]
+            The keys of the files written to S3, in the order they were written.  At least one file is always
+            written, even if there are no rows.
+        """
+        s3 = get_aws_client('s3')
+        bucket = STAGING_BUCKET_NAME
+        formatted_date = datetime.strftime(datetime.now(), '%Y%m%d%H%M%S')
+        encode_row = get_row_encoder()
+        start_time = time.perf_counter()
+        row_count = 0
+        bytes_raw = 0
+        bytes_compressed = 0
+        filenames = []
+        s3_file = None
+        compressor = None
+        try:
+            async for rows in self.query_salesforce_pages(sf, soql):
+                if watermark_tracker is not None:
+                    rows = list(watermark_tracker.track(rows))
+                if s3_file is None:
+                    filenames.append(get_staging_key(salesforce_entity_name,
+                                                     f'{salesforce_entity_name}_{formatted_date}{file_suffix}_'
+                                                     f'{len(filenames) + 1:04d}.json.gz'))
+                    s3_file, compressor = await self.start_file(s3, bucket, filenames[-1])
+                page = b''.join(encode_row(row) for row in rows)
+                await s3_file.write(compressor.compress(page))
+                row_count += len(rows)
+                bytes_raw += len(page)
+                # the compressed size is checked, as that is what Snowflake splits its loading work by
+                if s3_file.tell() >= self.max_file_bytes:
+                    await self.finish_file(s3_file, compressor, filenames[-1])
+                    bytes_compressed += s3_file.bytes_written
+                    s3_file = None
+            if len(filenames) == 0:
+                filenames.append(get_staging_key(
+                    salesforce_entity_name, f'{salesforce_entity_name}_{formatted_date}{file_suffix}_0001.json.gz'))
+                s3_file, compressor = await self.start_file(s3, bucket, filenames[-1])
+            if s3_file is not None:
+                await self.finish_file(s3_file, compressor, filenames[-1])
+                bytes_compressed += s3_file.bytes_written
+                s3_file = None
+        except BaseException:
+            # including being cancelled because another chunk of the entity failed
+            if s3_file is not None:
+                await s3_file.abort()
+                filenames.pop()
+            # the files this query finished are of no use without the rest of its rows
+            if len(filenames) > 0:
+                await asyncio.get_running_loop().run_in_executor(None, release_staged_files, salesforce_entity_name,
+                                                                 filenames)
+            raise
+
+        if stage_metrics is not None:
+            stage_metrics.add_rows(row_count, bytes_raw, bytes_compressed)
+        print(format_extract_stats(salesforce_entity_name + file_suffix, row_count, start_time))
+        return filenames
+
+    async def start_file(self, s3, bucket: str, key: str):
+        s3_file = AsyncS3MultipartWriter(s3, self.http_session, bucket, key, upload_slots=self.upload_slots)
+        await s3_file.start()
+        # rows are compressed on the event loop, in the gzip format written by gzip.GzipFile in the other modes
+        return s3_file, zlib.compressobj(9, zlib.DEFLATED, 31)
+
+    @staticmethod
+    async def finish_file(s3_file: AsyncS3MultipartWriter, compressor, filename: str):
+        await s3_file.write(compressor.flush())
+        await s3_file.close()
+        ttfb_text = f'{s3_file.time_to_first_byte:.1f} sec' if s3_file.time_to_first_byte is not None else 'n/a'
+        print(f'{filename} uploaded ({s3_file.bytes_written} bytes, time to first byte {ttfb_text}, '
+              f'total {time.perf_counter() - s3_file.start_time:.1f} sec)')
+
+
+def main_asyncio(entity_configs: list[SalesforceEntityConfig]):
+    """
+    Process every entity with the asyncio engine.
+
+    Raises
+    ------
+    RuntimeError
+        If any entity failed, once every other entity has been processed.
+    """
+    engine = AsyncEngine()
+    start_time = time.perf_counter()
+    engine.run(entity_configs)
+    print(f'asyncio engine completed in {time.perf_counter() - start_time:.1f} sec')
+    print(format_connection_pool_stats())
+    print(get_query_coordinator().format_stats())
+    if len(engine.failures) > 0:
+        failed_entities = [entity_config.entity_name for entity_config, _ in engine.failures]
+        raise RuntimeError(f'Processing failed for {", ".join(failed_entities)}')
@@ -1,58 +1,91 @@
 from salesforce_prototype_app.utilities.rsa_tools import get_user_secret_from_aws, get_snowflake_rsa_keys_connection
-from salesforce_prototype_app.utilities.get_fieldnames import dict_of_lists
+from salesforce_prototype_app.utilities.snowflake_connection_pool import get_snowflake_connection
+from salesforce_prototype_app.utilities.snowflake_query_coordinator import get_query_coordinator
+from salesforce_prototype_app.utilities.entity_load_plan import EntityLoadPlan
+from salesforce_prototype_app.utilities.snowflake_config import StagingFormats
+from salesforce_prototype_app.utilities.run_metrics import StageMetrics
+from salesforce_prototype_app.utilities.tracing import span
+import time
 
+COPY_INTO_MAX_FILES = 1000
 
 
-def copyinto_snowflake(salesforce_entity_name, filename):
-    secret_dict = get_user_secret_from_aws()
-    # connect to snowflake as service user and read Snowflake version
-    con = get_snowflake_rsa_keys_connection(secret_dict)
-    cursor = con.cursor()
+def copyinto_snowflake(load_plan: EntityLoadPlan, filenames, staging_format=StagingFormats.JSON,
+                       stage_metrics: StageMetrics = None) -> int:
+    salesforce_entity_name = load_plan.entity_name
+    coordinator = get_query_coordinator()
 
-    print(f'Copying {salesforce_entity_name} into Snowflake')
+    # the files of the entity (e.g. one per PK chunk) are listed by key, so Snowflake reads exactly those files rather
+    # than listing and pattern matching everything in the stage - one COPY INTO per 1000 files, the most FILES allows
+    print(f'Copying {len(filenames)} file(s) of {salesforce_entity_name} into Snowflake')
     # cursor.execute("SELECT CURRENT_VERSION()")
     # value = cursor.fetchone()[0]
     # print('Snowflake version: ' + value)
 
-
-    column_names = dict_of_lists(salesforce_entity_name)
-    snowflake_query_select = ''
-    snowflake_query_final_select = ''
-    for x, col_name in enumerate(column_names):
-        #sf_datatype = get_snowflake_datatype(destination_table_name, x)
-
-        # below - replace "VARIANT" with something dynamic for datatype.
-        # perhaps this could come from the Source? check with CB
-        snowflake_query_select += f'parse_json($1):{col_name}::VARIANT as {col_name}, '
-        snowflake_query_final_select  += f's.{col_name}, '
-
-    snowflake_query_select = snowflake_query_select[:-2]
-
-    sql = f"COPY INTO DEV_AG_SALESFORCE.SALESFORCE_LOAD.SALESFORCE_{salesforce_entity_name}" \
-                      f" FROM (" \
-                      f"SELECT " \
-                      f"{snowflake_query_select} " \
-                      f"from @DEV_AG_SALESFORCE.SALESFORCE_LOAD.S3_STAGE)" \
-                      f" FILE_FORMAT = (FORMAT_NAME = 'DEV_AG_SALESFORCE.SALESFORCE_LOAD.BASIC_JSON')" \
-                      f" PATTERN = '.*{filename}.*';"
-
-    #f" FILE_FORMAT = (FORMAT_NAME = 'DEV_AG_SALESFORCE.SALESFORCE_LOAD.BASIC_CSV')" \
-
-
-    cursor.execute(sql)
-
-    print(f'{salesforce_entity_name} has been copied into Snowflake')
-
-
-def truncate_snowflaketable(salesforce_entity_name):
-    secret_dict = get_user_secret_from_aws()
-    # connect to snowflake as service user and read Snowflake version
-    con = get_snowflake_rsa_keys_connection(secret_dict)
-    cursor = con.cursor()
-
+    # FORCE = TRUE loads the files even if Snowflake's load metadata says they have been loaded - e.g. by a COPY that
+    # finished after its run was interrupted, which a resumed run would otherwise skip, merging nothing.  The loading
+    # table is always truncated first, so forcing cannot load a file twice.
+    start_time = time.perf_counter()
+    rows_loaded = 0
+    for start in range(0, len(filenames), COPY_INTO_MAX_FILES):
+        files_list = ', '.join(f"'{filename}'" for filename in filenames[start:start + COPY_INTO_MAX_FILES])
+        if staging_format == StagingFormats.PARQUET:
+            # Parquet columns are typed and named after the Salesforce fields, so they are matched to the table
+            # columns by name rather than parsed from a JSON document per row
+            sql = f"COPY INTO {load_plan.loading_table_name}" \
+                  f" FROM @DEV_AG_SALESFORCE.SALESFORCE_LOAD.S3_STAGE" \
+                  f" FILES = ({files_list})" \
+                  f" FILE_FORMAT = (FORMAT_NAME = 'DEV_AG_SALESFORCE.SALESFORCE_LOAD.BASIC_PARQUET')" \
+                  f" MATCH_BY_COLUMN_NAME = CASE_INSENSITIVE" \
+                  f" FORCE = TRUE;"
+        else:
+            sql = f"COPY INTO {load_plan.loading_table_name}" \
+                          f" FROM (" \
+                          f"SELECT " \
+                          f"{load_plan.copy_select_list} " \
+                          f"from @DEV_AG_SALESFORCE.SALESFORCE_LOAD.S3_STAGE)" \
+                          f" FILES = ({files_list})" \
+                          f" FILE_FORMAT = (FORMAT_NAME = 'DEV_AG_SALESFORCE.SALESFORCE_LOAD.BASIC_JSON')" \
+                          f" FORCE = TRUE;"
+
+        #f" FILE_FORMAT = (FORMAT_NAME = 'DEV_AG_SALESFORCE.SALESFORCE_LOAD.BASIC_CSV')" \
+
+        with span('copyinto_snowflake', entity=salesforce_entity_name,
+                  files=len(filenames[start:start + COPY_INTO_MAX_FILES])) as trace:
+            # submitted asynchronously, so other entities' statements share the session while this one runs
+            query = coordinator.execute(sql, entity_name=salesforce_entity_name, stage_name='copy')
+            batch_rows_loaded = get_copy_rows_loaded(query.cursor)
+            trace.set_attribute('query_id', query.query_id)
+            trace.set_attribute('rows', batch_rows_loaded)
+        rows_loaded += batch_rows_loaded
+        if stage_metrics is not None:
+            stage_metrics.add_query_id(query.query_id)
+            stage_metrics.add_rows(batch_rows_loaded)
+
+    print(f'{salesforce_entity_name} has been copied into Snowflake from {staging_format.name} files '
+          f'in {time.perf_counter() - start_time:.1f} sec ({rows_loaded} rows)')
+    return rows_loaded
+
+
+def get_copy_rows_loaded(cursor) -> int:
+    """
+    Get the total number of rows loaded by a COPY INTO, from its result (one row per file loaded).
+    """
+    # the rows are fetched first, as a cursor opened on a query id only has a description once its results are fetched
+    rows = cursor.fetchall()
+    column_names = [column[0].lower() for column in cursor.description]
+    if 'rows_loaded' not in column_names:
+        return 0  # no files were loaded, so the result is a single status message
+    rows_loaded_index = column_names.index('rows_loaded')
+    return sum(row[rows_loaded_index] or 0 for row in rows)
+
+
+def truncate_snowflaketable(salesforce_entity_name, stage_metrics: StageMetrics = None):
     print(f'Preparing to truncate DEV_AG_SALESFORCE.SALESFORCE_LOAD.SALESFORCE_{salesforce_entity_name}')
     sql = f"TRUNCATE DEV_AG_SALESFORCE.SALESFORCE_LOAD.SALESFORCE_{salesforce_entity_name};"
-    cursor.execute(sql)
+    query = get_query_coordinator().execute(sql, entity_name=salesforce_entity_name, stage_name='truncate')
+    if stage_metrics is not None:
+        stage_metrics.add_query_id(query.query_id)
     print(f'DEV_AG_SALESFORCE.SALESFORCE_LOAD.SALESFORCE_{salesforce_entity_name} has been truncated')
 
 def test_snowflake_service_user_authentication():
@@ -77,9 +110,7 @@ def lookup_snowflake_datatype(datatype: int):
 
 def get_snowflake_datatype(destination_table_name, position_in_iteration):
 
-    secret_dict = get_user_secret_from_aws()
-    # connect to snowflake as service user and read Snowflake version
-    con = get_snowflake_rsa_keys_connection(secret_dict)
+    con = get_snowflake_connection()
     csr = con.cursor()
     metadata = csr.describe(f"SELECT * FROM DEV_AG_SALESFORCE.SALESFORCE_LOAD.{destination_table_name}")
     snowflake_column_metadata = metadata[(position_in_iteration)]
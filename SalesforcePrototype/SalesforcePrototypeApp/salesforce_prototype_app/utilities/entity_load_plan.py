@@ -0,0 +1,221 @@
+import threading
+from salesforce_prototype_app.utilities.get_fieldnames import dict_of_lists
+from salesforce_prototype_app.utilities.salesforce_describe_cache import get_sobject_describe
+from salesforce_prototype_app.utilities.snowflake_config import SalesforceEntityConfig, StagingFormats
+
+SNOWFLAKE_LOAD_SCHEMA = 'DEV_AG_SALESFORCE.SALESFORCE_LOAD'
+SNOWFLAKE_MODEL_SCHEMA = 'DEV_AG_SALESFORCE.SALESFORCE_MODEL'
+SNOWFLAKE_STAGE_NAME = f'{SNOWFLAKE_LOAD_SCHEMA}.S3_STAGE'
+SNOWFLAKE_FILE_FORMAT_NAMES = {
+    StagingFormats.JSON: f'{SNOWFLAKE_LOAD_SCHEMA}.BASIC_JSON',
+    StagingFormats.PARQUET: f'{SNOWFLAKE_LOAD_SCHEMA}.BASIC_PARQUET'
+}
+
+# Salesforce field types (from describe) and the Snowflake types their staged values are cast to by COPY INTO - every
+# other type (id, string, picklist, reference, etc.) is loaded as VARCHAR
+SALESFORCE_SNOWFLAKE_TYPE_NAMES = {
+    'boolean': 'BOOLEAN',
+    'int': 'NUMBER',
+    'long': 'NUMBER',
+    'double': 'FLOAT',
+    'currency': 'FLOAT',
+    'percent': 'FLOAT',
+    'date': 'DATE',
+    'datetime': 'TIMESTAMP_TZ',
+    'time': 'TIME'
+}
+
+_load_plans = {}  # entity name -> EntityLoadPlan, built once per process
+_load_plans_lock = threading.Lock()
+
+
+class EntityLoadPlan:
+    """
+    Everything needed to extract and load one Salesforce entity - its SOQL, the COPY INTO select list and the MERGE
+    statement - worked out once per run from the entity's config and its (cached) describe metadata, and shared by
+    every stage.
+    """
+
+    def __init__(self, entity_config: SalesforceEntityConfig, describe: dict):
+        """
+        Build the load plan of an entity.
+
+        Parameters
+        ----------
+        entity_config : SalesforceEntityConfig
+            The configuration of the entity.
+        describe : dict
+            The describe metadata of the entity.
+
+        Raises
+        ------
+        ValueError
+            If a configured field does not exist in Salesforce.
+        """
+        self.entity_name = entity_config.entity_name
+        column_names = entity_config.select_columns if entity_config.select_columns is not None \
+            else dict_of_lists(self.entity_name)
+        watermark_column = entity_config.watermark_column
+
+        # configured names are matched to the described fields ignoring case, but are then spelt as described - the
+        # staged rows are keyed by the described names, and Snowflake reads them by case-sensitive JSON paths ($1:Name)
+        described_fields = {field['name'].lower(): field for field in describe['fields']}
+        configured_field_names = column_names + ([watermark_column] if entity_config.is_incremental else [])
+        missing_field_names = [name for name in configured_field_names if name.lower() not in described_fields]
+        if len(missing_field_names) > 0:
+            raise ValueError(f'{self.entity_name} has no field(s) named {", ".join(missing_field_names)}.')
+        self.column_names = [described_fields[name.lower()]['name'] for name in column_names]
+        self.primary_key_column = described_fields[entity_config.primary_key_column.lower()]['name'] \
+            if entity_config.primary_key_column.lower() in described_fields else entity_config.primary_key_column
+        if watermark_column is not None and watermark_column.lower() in described_fields:
+            watermark_column = described_fields[watermark_column.lower()]['name']
+        self.loading_table_name = f'{SNOWFLAKE_LOAD_SCHEMA}.SALESFORCE_{self.entity_name}'
+        self.model_table_name = f'{SNOWFLAKE_MODEL_SCHEMA}.SALESFORCE_{self.entity_name}'
+
+        # the watermark column is needed to work out the next high water mark, even if it is not loaded into Snowflake
+        self.extract_field_names = list(self.column_names)
+        if entity_config.is_incremental and watermark_column not in self.extract_field_names:
+            self.extract_field_names.append(watermark_column)
+        self.field_types = {name: described_fields[name.lower()]['type'] for name in self.extract_field_names}
+
+        self.soql = f'SELECT {", ".join(self.extract_field_names)} FROM {self.entity_name}'
+        # each staged JSON row is an object, so its fields are read directly and cast to their Snowflake types
+        self.copy_select_list = ', '.join(
+            f'$1:{name}::{SALESFORCE_SNOWFLAKE_TYPE_NAMES.get(self.field_types[name], "VARCHAR")} as {name}'
+            for name in self.column_names)
+        # duplicate rows of a primary key (e.g. a row modified while the entity was being paged through) are resolved
+        # by keeping the latest, by the watermark column if the source has it, otherwise an arbitrary one
+        self.watermark_column = watermark_column if watermark_column in self.extract_field_names else None
+        self.capture_deletes = entity_config.capture_deletes
+        self.merge_sql = self.get_merge_sql()
+
+    def get_merge_sql(self, source: str = None, order_column: str = None) -> str:
+        """
+        Get the MERGE of a source into the model table, matching on the primary key.
+
+        The source is deduplicated by primary key, and a hash of each row is stored in the model table's ROW_HASH
+        column, so only the rows that have changed are updated - on mostly unchanged data, most matched rows (and the
+        micro-partitions holding them) are then not rewritten.
+
+        Parameters
+        ----------
+        source : str
+            The table or subquery to merge from.  If None, the loading table.
+        order_column : str
+            The column of the source to keep the latest row of each primary key by.  If None, the watermark column if
+            it is loaded, otherwise an arbitrary row is kept.
+        """
+        if order_column is None:
+            order_column = self.watermark_column if self.watermark_column in self.column_names else None
+        select_list = ', '.join(f's.{name}' for name in self.column_names)
+        # HASH() is 64 bits, so a change is missed only if the old and new values of a row collide
+        deduplicated_source = f"(SELECT {select_list}, HASH({select_list}) AS ROW_HASH" \
+                              f" FROM {source if source is not None else self.loading_table_name} s" \
+                              f" QUALIFY ROW_NUMBER() OVER (PARTITION BY s.{self.primary_key_column}" \
+                              f" ORDER BY s.{order_column if order_column is not None else self.primary_key_column}" \
+                              f" DESC) = 1)"
+        update_set_list = ', '.join(f'd.{name} = s.{name}' for name in self.column_names + ['ROW_HASH'])
+        insert_list = ', '.join(self.column_names + ['ROW_HASH'])
+        values_list = ', '.join(f's.{name}' for name in self.column_names + ['ROW_HASH'])
+        matched_condition = 'd.ROW_HASH IS DISTINCT FROM s.ROW_HASH'
+        if self.capture_deletes:
+            # a row extracted again has been undeleted in Salesforce (deleted rows are not returned by a query)
+            matched_condition = f'({matched_condition} OR d.IS_DELETED)'
+            update_set_list += ', d.IS_DELETED = FALSE, d.DELETED_AT = NULL'
+        return f"MERGE INTO {self.model_table_name} d" \
+               f" USING {deduplicated_source} s" \
+               f" ON d.{self.primary_key_column} = s.{self.primary_key_column} " \
+               f"WHEN MATCHED AND {matched_condition} THEN UPDATE SET {update_set_list} " \
+               f"WHEN NOT MATCHED THEN INSERT ({insert_list}) " \
+               f"VALUES ({values_list});"
+
+    def get_stage_merge_sql(self, filenames: list[str], staging_format: StagingFormats) -> str:
+        """
+        Get a MERGE that reads the given staged files directly, through a select from the stage with the same casts as
+        the COPY INTO, so the entity is loaded without the TRUNCATE and COPY INTO of the loading table.
+
+        Parameters
+        ----------
+        filenames : list[str]
+            The keys of the staged files, relative to the stage.
+        staging_format : StagingFormats
+            The format of the staged files.
+
+        Raises
+        ------
+        ValueError
+            If there are no files, as the pattern would then match every file in the entity's prefix.
+        """
+        select_list = self.copy_select_list
+        if self.watermark_column is not None and self.watermark_column not in self.column_names:
+            # the watermark of an incremental entity is staged even if it is not loaded, so it can order the duplicates
+            watermark_type_name = SALESFORCE_SNOWFLAKE_TYPE_NAMES.get(self.field_types[self.watermark_column],
+                                                                      'VARCHAR')
+            select_list += f', $1:{self.watermark_column}::{watermark_type_name} as {self.watermark_column}'
+        return self.get_merge_sql(self.get_stage_source(select_list, filenames, staging_format), self.watermark_column)
+
+    def get_soft_delete_sql(self, filenames: list[str]) -> str:
+        """
+        Get an UPDATE that marks the rows of the model table listed in the given staged files as deleted, in one
+        set-based statement.  The files are JSON, each row holding the Id and DeletedDate of a deleted record.
+
+        Parameters
+        ----------
+        filenames : list[str]
+            The keys of the staged files, relative to the stage.
+
+        Raises
+        ------
+        ValueError
+            If there are no files, as the pattern would then match every file in the entity's prefix.
+        """
+        deleted_source = self.get_stage_source('$1:Id::VARCHAR as Id, $1:DeletedDate::TIMESTAMP_TZ as DeletedDate',
+                                               filenames, StagingFormats.JSON)
+        return f"UPDATE {self.model_table_name} d" \
+               f" SET d.IS_DELETED = TRUE, d.DELETED_AT = s.DeletedDate" \
+               f" FROM (SELECT Id, MAX(DeletedDate) AS DeletedDate FROM {deleted_source} GROUP BY Id) s" \
+               f" WHERE d.{self.primary_key_column} = s.Id AND NOT COALESCE(d.IS_DELETED, FALSE);"
+
+    def get_stage_source(self, select_list: str, filenames: list[str], staging_format: StagingFormats) -> str:
+        """
+        Get a subquery that selects from the given staged files of the entity.
+
+        Raises
+        ------
+        ValueError
+            If there are no files, as the pattern would then match every file in the entity's prefix.
+        """
+        if len(filenames) == 0:
+            raise ValueError(f'There are no staged files of {self.entity_name} to select from.')
+        # a stage select cannot list files like COPY INTO ... FILES, so it reads the entity's prefix and matches the
+        # keys exactly - the prefix only holds files that have not been loaded, so the listing is small.  The keys are
+        # made of letters, digits, _ and / (see get_staging_key) apart from the dots, which are matched literally
+        # with [.] rather than a backslash, which a Snowflake string literal would consume.
+        files_pattern = '|'.join(filename.replace('.', '[.]') for filename in filenames)
+        return f"(SELECT {select_list}" \
+               f" FROM @{SNOWFLAKE_STAGE_NAME}/{self.entity_name}/" \
+               f" (FILE_FORMAT => '{SNOWFLAKE_FILE_FORMAT_NAMES[staging_format]}', PATTERN => '.*({files_pattern})'))"
+
+
+def get_entity_load_plan(entity_config: SalesforceEntityConfig, sf=None) -> EntityLoadPlan:
+    """
+    Get the load plan of an entity, building it the first time it is needed in this process.
+
+    Parameters
+    ----------
+    entity_config : SalesforceEntityConfig
+        The configuration of the entity.
+    sf : Salesforce
+        A connection to Salesforce, used if the entity's describe metadata is not already cached.
+
+    Returns
+    -------
+    EntityLoadPlan
+        The load plan.
+    """
+    with _load_plans_lock:
+        load_plan = _load_plans.get(entity_config.entity_name)
+        if load_plan is None:
+            load_plan = EntityLoadPlan(entity_config, get_sobject_describe(entity_config.entity_name, sf))
+            _load_plans[entity_config.entity_name] = load_plan
+        return load_plan
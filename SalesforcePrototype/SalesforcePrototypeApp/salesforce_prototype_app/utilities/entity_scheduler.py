@@ -0,0 +1,236 @@
+import json
+import math
+import multiprocessing
+import os
+import time
+import urllib.request
+import salesforce_prototype_app.utilities.app_environment as app_env
+from salesforce_prototype_app.utilities.get_connections import get_aws_client
+from salesforce_prototype_app.utilities.snowflake_config import SalesforceEntityConfig
+
+# alongside the local_only/config.ini used outside AWS
+LOCAL_RUN_HISTORY_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'local_only/run_history.json')
+S3_RUN_HISTORY_KEY = 'run_history/entity_runs.json'
+SCHEDULER_DEFAULT_MAX_WORKERS = 8
+# the share of an entity's time spent waiting on Salesforce, S3 and Snowflake, assumed until there is some history
+DEFAULT_IO_WAIT_FRACTION = 0.75
+MAX_IO_WAIT_FRACTION = 0.9  # so a run of almost entirely idle entities cannot ask for an unlimited number of workers
+
+
+class EntityRunResult:
+    """
+    The outcome of processing one entity, returned by the pool worker that processed it.
+    """
+
+    def __init__(self, entity_name: str, succeeded: bool, row_count: int = None, byte_count: int = None,
+                 seconds: float = None, cpu_seconds: float = None, error: str = None, stage_metrics: list = None):
+        """
+        Parameters
+        ----------
+        entity_name : str
+            The name of the Salesforce entity.
+        succeeded : bool
+            True if the entity was extracted, copied and merged, False if any step failed.
+        row_count : int
+            The number of rows loaded into Snowflake.
+        byte_count : int
+            The total size of the files staged in S3.
+        seconds : float
+            The elapsed time taken to process the entity.
+        cpu_seconds : float
+            The CPU time used by the worker process while processing the entity.
+        error : str
+            If the entity failed, a description of the exception.
+        stage_metrics : list[StageMetrics]
+            The metrics of each stage of the entity that was run, to write to the RUN_METRICS table.
+        """
+        self.entity_name = entity_name
+        self.succeeded = succeeded
+        self.row_count = row_count
+        self.byte_count = byte_count
+        self.seconds = seconds
+        self.cpu_seconds = cpu_seconds
+        self.error = error
+        self.stage_metrics = stage_metrics if stage_metrics is not None else []
+
+    def __repr__(self) -> str:
+        return f'EntityRunResult({self.entity_name!r}, succeeded={self.succeeded}, rows={self.row_count}, ' \
+               f'bytes={self.byte_count}, seconds={self.seconds})'
+
+
+def get_run_history_bucket_name() -> str:
+    return app_env.get_env_var_value(app_env.EnvironmentVariableNames.AWS_S3_BUCKET_NAME)
+
+
+def load_run_history() -> dict:
+    """
+    Load the statistics of the last successful run of each entity, persisted in S3 when CRUK_AWS_S3_BUCKET_NAME is
+    set and on local disk otherwise.
+
+    Returns
+    -------
+    dict
+        The entity name -> {'seconds', 'cpu_seconds', 'row_count', 'byte_count', 'run_at'}, or an empty dict if there
+        is no history yet.
+    """
+    bucket = get_run_history_bucket_name()
+    if len(bucket) > 0:
+        s3 = get_aws_client('s3')
+        try:
+            response = s3.get_object(Bucket=bucket, Key=S3_RUN_HISTORY_KEY)
+        except s3.exceptions.NoSuchKey:
+            return {}
+        return json.loads(response['Body'].read())
+
+    if not os.path.exists(LOCAL_RUN_HISTORY_PATH):
+        return {}
+    with open(LOCAL_RUN_HISTORY_PATH, encoding='UTF8') as f:
+        return json.load(f)
+
+
+def save_run_history(run_history: dict, results: list[EntityRunResult]):
+    """
+    Record the statistics of the entities that succeeded.  A failed entity keeps the statistics of its last
+    successful run, as a partial run says little about how long the next one will take.
+    """
+    for result in results:
+        if result.succeeded:
+            run_history[result.entity_name] = {'seconds': result.seconds, 'cpu_seconds': result.cpu_seconds,
+                                               'row_count': result.row_count, 'byte_count': result.byte_count,
+                                               'run_at': time.time()}
+
+    bucket = get_run_history_bucket_name()
+    if len(bucket) > 0:
+        get_aws_client('s3').put_object(Bucket=bucket, Key=S3_RUN_HISTORY_KEY,
+                                        Body=json.dumps(run_history).encode('utf-8'))
+        return
+
+    os.makedirs(os.path.dirname(LOCAL_RUN_HISTORY_PATH), exist_ok=True)
+    with open(LOCAL_RUN_HISTORY_PATH, 'w', encoding='UTF8') as f:
+        json.dump(run_history, f)
+
+
+def order_entities_longest_first(entity_configs: list[SalesforceEntityConfig],
+                                 run_history: dict) -> list[SalesforceEntityConfig]:
+    """
+    Order entities so the ones that took longest last time start first, and the short ones fill in around them at the
+    end of the run.  Entities with no history start first of all, in case they are large.  Ties (e.g. the whole run on
+    its first time) are broken by row count and then keep their config table order.
+    """
+    def sort_key(entity_config: SalesforceEntityConfig):
+        history = run_history.get(entity_config.entity_name)
+        if history is None:
+            return -math.inf, -math.inf
+        return -(history.get('seconds') or 0), -(history.get('row_count') or 0)
+
+    return sorted(entity_configs, key=sort_key)
+
+
+def get_cpu_quota() -> float:
+    """
+    Get the number of CPUs available to this container.
+
+    os.cpu_count() is the number of CPUs on the host, which can be far more than a container (e.g. a 0.5 vCPU Fargate
+    task) is allowed to use, so the cgroup CPU quota is read instead (v2, then v1), then the ECS task CPU limit.
+    """
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        if quota > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    if app_env.is_running_in_aws():
+        # https://docs.aws.amazon.com/AmazonECS/latest/userguide/task-metadata-endpoint-v4-fargate.html
+        try:
+            with urllib.request.urlopen(os.getenv('ECS_CONTAINER_METADATA_URI_V4') + '/task', timeout=2) as response:
+                cpu_limit = json.loads(response.read()).get('Limits', {}).get('CPU')
+            if cpu_limit is not None:
+                return float(cpu_limit)
+        except (OSError, ValueError):
+            pass
+    return float(os.cpu_count() or 1)
+
+
+def get_io_wait_fraction(run_history: dict) -> float:
+    """
+    Get the share of the elapsed time of the last runs that the workers spent waiting rather than using a CPU.
+    """
+    seconds = sum(history['seconds'] for history in run_history.values()
+                  if history.get('seconds') and history.get('cpu_seconds') is not None)
+    cpu_seconds = sum(history['cpu_seconds'] for history in run_history.values()
+                      if history.get('seconds') and history.get('cpu_seconds') is not None)
+    if seconds == 0:
+        return DEFAULT_IO_WAIT_FRACTION
+    return min(max(1 - cpu_seconds / seconds, 0.0), MAX_IO_WAIT_FRACTION)
+
+
+def get_worker_count(entity_count: int, run_history: dict) -> int:
+    """
+    Get the number of worker processes to run, enough to keep the available CPUs busy while the other workers wait on
+    I/O, i.e. CPU quota / (1 - I/O wait), but no more than there are entities or CRUK_SCHEDULER_MAX_WORKERS (default 8).
+    """
+    cpu_quota = get_cpu_quota()
+    io_wait_fraction = get_io_wait_fraction(run_history)
+    max_workers = app_env.get_int_env_var_value(app_env.EnvironmentVariableNames.SCHEDULER_MAX_WORKERS,
+                                                SCHEDULER_DEFAULT_MAX_WORKERS)
+    worker_count = max(1, min(math.ceil(cpu_quota / (1 - io_wait_fraction)), max_workers, entity_count))
+    print(f'Using {worker_count} workers for {entity_count} entities ({cpu_quota:.2f} CPUs, '
+          f'{io_wait_fraction:.0%} I/O wait)')
+    return worker_count
+
+
+def run_entities_in_pool(entity_configs: list[SalesforceEntityConfig], process_entity, processes: int,
+                         initializer=None, initargs=()) -> list[EntityRunResult]:
+    """
+    Process entities in a pool of worker processes, in the order given.
+
+    Each entity is handed to the next free worker (rather than the entities being split between the workers up
+    front), so a long entity does not hold up the entities queued behind it.
+
+    Parameters
+    ----------
+    entity_configs : list[SalesforceEntityConfig]
+        The entities to process, e.g. ordered by order_entities_longest_first().
+    process_entity : Callable[[SalesforceEntityConfig], EntityRunResult]
+        Processes one entity.  It should catch its own exceptions, so one failure does not affect the other entities.
+    processes : int
+        The number of worker processes.
+    initializer, initargs
+        Passed to multiprocessing.Pool.
+
+    Returns
+    -------
+    list[EntityRunResult]
+        The result of each entity, in the order they finished.
+    """
+    results = []
+    pool = multiprocessing.Pool(processes=processes, initializer=initializer, initargs=initargs)
+    for result in pool.imap_unordered(process_entity, entity_configs, chunksize=1):
+        print(f'{result.entity_name} {"succeeded" if result.succeeded else "FAILED"} in {result.seconds:.1f} sec')
+        results.append(result)
+    # let the worker processes exit normally (rather than being terminated) so they close their Snowflake connections
+    pool.close()
+    pool.join()
+    return results
+
+
+def format_entity_run_results(results: list[EntityRunResult]) -> str:
+    lines = [f'{len([r for r in results if r.succeeded])} of {len(results)} entities succeeded']
+    for result in sorted(results, key=lambda r: r.entity_name):
+        if result.succeeded:
+            lines.append(f'  {result.entity_name:<30} {result.row_count if result.row_count is not None else "?":>10} '
+                         f'rows {result.byte_count if result.byte_count is not None else "?":>12} bytes '
+                         f'{result.seconds:8.1f} sec')
+        else:
+            lines.append(f'  {result.entity_name:<30} FAILED after {result.seconds:.1f} sec: {result.error}')
+    return '\n'.join(lines)
@@ -1,7 +1,31 @@
 import boto3
+import time
+from enum import Enum
 from salesforce_prototype_app.config.config_values import get_config_value
 import salesforce_prototype_app.utilities.app_environment as app_env
+import salesforce_prototype_app.utilities.secrets_provider as secrets_provider
+import salesforce_prototype_app.utilities.salesforce_token_store as salesforce_token_store
 from simple_salesforce import Salesforce
+from simple_salesforce.exceptions import SalesforceAuthenticationFailed, SalesforceExpiredSession
+
+SALESFORCE_USERNAME_SECRET_NAME = "ageorge-dev-salesforce-prototype-username"
+SALESFORCE_PASSWORD_SECRET_NAME = "ageorge-dev-salesforce-prototype-password"
+SALESFORCE_SECURITY_TOKEN_SECRET_NAME = "ageorge-dev-salesforce-prototype-security_token"
+SALESFORCE_DOMAIN_SECRET_NAME = "ageorge-dev-salesforce-prototype-domain"
+SALESFORCE_CONSUMER_KEY_SECRET_NAME = "ageorge-dev-salesforce-prototype-consumer_key"
+SALESFORCE_PRIVATE_KEY_SECRET_NAME = "ageorge-dev-salesforce-prototype-private_key"
+SALESFORCE_SECRET_NAMES = [SALESFORCE_USERNAME_SECRET_NAME, SALESFORCE_PASSWORD_SECRET_NAME,
+                           SALESFORCE_SECURITY_TOKEN_SECRET_NAME, SALESFORCE_DOMAIN_SECRET_NAME]
+
+_shared_salesforce_session = None  # (session id, instance) of the session shared by the parent process, if any
+
+
+class SalesforceAuthMethods(Enum):
+    """
+    The supported ways of logging in to Salesforce.
+    """
+    PASSWORD = 1,  # username, password and security token (SOAP login)
+    JWT = 2  # OAuth 2.0 JWT bearer flow, signed with the connected app's certificate
 
 
 def get_boto3_session():
@@ -22,56 +46,130 @@ def get_aws_client(clientname):
 
 
 def get_salesforce():
+    """
+    Get a connection to Salesforce, using the session shared by the parent process if there is one, so that pool
+    worker processes do not each log in.
+    """
+    if _shared_salesforce_session is not None:
+        session_id, instance = _shared_salesforce_session
+        return Salesforce(session_id=session_id, instance=instance)
+    return login_salesforce()
+
+
+def init_salesforce_session(session_id: str, instance: str):
+    """
+    Use an existing Salesforce session for every connection made by this process.  This is the initializer of the
+    multiprocessing pool in main.py, which logs in once and shares the session with every worker.
+    """
+    global _shared_salesforce_session
+    _shared_salesforce_session = (session_id, instance)
+
+
+def renew_salesforce_session():
+    """
+    Log in to Salesforce again and use the new session for every later connection made by this process.  Call this
+    when Salesforce rejects the shared session (INVALID_SESSION_ID), e.g. because it has expired.
+    """
+    sf = login_salesforce(use_cached_token=False)
+    init_salesforce_session(sf.session_id, sf.sf_instance)
+    return sf
+
+
+def login_salesforce(use_cached_token: bool = True):
+    """
+    Get a connection to Salesforce, reusing the access token cached by an earlier run if it has not expired, so that
+    scheduled runs and reruns do not need to log in.  The cached token is checked once with a cheap limits call, and
+    if Salesforce rejects it we log in instead.  After a login, the new token is cached for later runs.
+
+    Parameters
+    ----------
+    use_cached_token : bool
+        If False, always log in, e.g. because Salesforce has rejected the cached token.
+
+    Returns
+    -------
+    Salesforce
+        A connection to Salesforce.
+    """
+    token_store = salesforce_token_store.get_salesforce_token_store()
+    if token_store is not None and use_cached_token:
+        token = token_store.load()
+        if token is not None and not token.is_expired(salesforce_token_store.get_salesforce_token_max_age_seconds()):
+            sf = Salesforce(session_id=token.session_id, instance=token.instance)
+            try:
+                sf.limits()
+                print('Using cached Salesforce access token')
+                return sf
+            except SalesforceExpiredSession:
+                print('Cached Salesforce access token has expired, logging in')
+
+    start_time = time.perf_counter()
     if app_env.is_running_in_aws():
+        try:
+            sf = get_salesforce_from_aws_secrets()
+        except SalesforceAuthenticationFailed:
+            # the credentials may have been rotated since they were cached, so read them again and retry once
+            sf = get_salesforce_from_aws_secrets(force_refresh=True)
+    elif get_salesforce_auth_method() == SalesforceAuthMethods.JWT:
         sf = Salesforce(
-            username=get_user_secret_from_aws("ageorge-dev-salesforce-prototype-username"),
-            password=get_user_secret_from_aws("ageorge-dev-salesforce-prototype-password"),
-            security_token=get_user_secret_from_aws("ageorge-dev-salesforce-prototype-security_token"),
-            domain=get_user_secret_from_aws("ageorge-dev-salesforce-prototype-domain"))
-        return sf
+            username=get_config_value('Salesforce', 'username'),
+            consumer_key=get_config_value('Salesforce', 'consumer_key'),
+            privatekey_file=get_config_value('Salesforce', 'private_key_file'),
+            domain=get_config_value('Salesforce', 'domain'))
     else:
         sf = Salesforce(
             username = get_config_value('Salesforce', 'username'),
             password = get_config_value('Salesforce', 'password'),
             security_token = get_config_value('Salesforce', 'security_token'),
             domain = get_config_value('Salesforce', 'domain'))
+    print(f'Logged in to Salesforce in {time.perf_counter() - start_time:.2f} sec')
+
+    if token_store is not None:
+        token_store.save(salesforce_token_store.SalesforceToken(sf.session_id, sf.sf_instance))
     return sf
 
 
-def get_user_secret_arn_from_aws(aws_secret_name: str) -> str:
-    client = get_aws_client('secretsmanager')
-
-    response = client.list_secrets(
-        MaxResults=10,
-        Filters=[
-            {
-                'Key': 'name',
-                'Values': [aws_secret_name]
-            },
-        ]
-    )
-
-    existing_secret_arn = None
-    if 'SecretList' in response:
-        matching_secrets = response['SecretList']
-        if matching_secrets is not None and len(matching_secrets) > 0:
-            existing_secret_arn = matching_secrets[0]['ARN']
-
-    return existing_secret_arn
-
-
-def get_user_secret_from_aws(aws_secret_name):
-
-    client = get_aws_client('secretsmanager')
-    existing_secret_arn = get_user_secret_arn_from_aws(aws_secret_name)
-    # Read secret
-    response = client.get_secret_value(SecretId=existing_secret_arn)
-    secret_json = response['SecretString']
-    ## user_secret = SnowflakeUserSecret(aws_secret_name=aws_secret_name, secret_json=secret_json)
-    ## print(len(secret_json))
-    user_secret = secret_json
-    x = len(user_secret)
-    y = (user_secret.find(":"))
-    z = user_secret[y + 2:-2]
-    return z
+def get_salesforce_auth_method() -> SalesforceAuthMethods:
+    """
+    Get the way of logging in to Salesforce from CRUK_SALESFORCE_AUTH_METHOD (PASSWORD, the default, or JWT).
+    """
+    auth_method = app_env.get_env_var_value(app_env.EnvironmentVariableNames.SALESFORCE_AUTH_METHOD).upper()
+    if len(auth_method) == 0:
+        return SalesforceAuthMethods.PASSWORD
+    auth_method_values = [e.name for e in SalesforceAuthMethods]
+    if auth_method not in auth_method_values:
+        raise ValueError(auth_method + ' is not a valid Salesforce authentication method.')
+    return SalesforceAuthMethods[auth_method]
+
+
+def get_salesforce_from_aws_secrets(force_refresh: bool = False):
+    if get_salesforce_auth_method() == SalesforceAuthMethods.JWT:
+        # the private key secret holds the PEM key of the certificate uploaded to the connected app
+        return Salesforce(
+            username=get_user_secret_from_aws(SALESFORCE_USERNAME_SECRET_NAME, force_refresh),
+            consumer_key=get_user_secret_from_aws(SALESFORCE_CONSUMER_KEY_SECRET_NAME),
+            privatekey=get_user_secret_from_aws(SALESFORCE_PRIVATE_KEY_SECRET_NAME),
+            domain=get_user_secret_from_aws(SALESFORCE_DOMAIN_SECRET_NAME))
+    return Salesforce(
+        username=get_user_secret_from_aws(SALESFORCE_USERNAME_SECRET_NAME, force_refresh),
+        password=get_user_secret_from_aws(SALESFORCE_PASSWORD_SECRET_NAME),
+        security_token=get_user_secret_from_aws(SALESFORCE_SECURITY_TOKEN_SECRET_NAME),
+        domain=get_user_secret_from_aws(SALESFORCE_DOMAIN_SECRET_NAME))
+
+
+def get_salesforce_secret_names() -> list[str]:
+    """
+    Get the names of the secrets needed to log in to Salesforce with the configured authentication method.
+    """
+    if get_salesforce_auth_method() == SalesforceAuthMethods.JWT:
+        return [SALESFORCE_USERNAME_SECRET_NAME, SALESFORCE_CONSUMER_KEY_SECRET_NAME,
+                SALESFORCE_PRIVATE_KEY_SECRET_NAME, SALESFORCE_DOMAIN_SECRET_NAME]
+    return SALESFORCE_SECRET_NAMES
+
+
+def get_user_secret_from_aws(aws_secret_name, force_refresh: bool = False):
+    # each of these secrets is a JSON object with a single key, e.g. {"username":"..."} - return its value
+    # (read by name from the in-process cache, rather than a list_secrets and get_secret_value on every call)
+    secret_dict = secrets_provider.get_secret_dict(aws_secret_name, force_refresh)
+    return next(iter(secret_dict.values()))
 
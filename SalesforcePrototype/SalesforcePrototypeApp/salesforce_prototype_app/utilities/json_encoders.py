@@ -0,0 +1,56 @@
+import json
+from enum import Enum
+import salesforce_prototype_app.utilities.app_environment as app_env
+
+try:
+    import orjson
+except ImportError:  # orjson is optional - the standard library encoder is used if it is not installed
+    orjson = None
+
+
+class JsonEncoders(Enum):
+    """
+    The supported encoders for writing rows as newline-delimited JSON (NDJSON).
+    """
+    STDLIB = 1,
+    ORJSON = 2
+
+
+def encode_row_stdlib(row: dict) -> bytes:
+    return (json.dumps(row, default=str, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def encode_row_orjson(row: dict) -> bytes:
+    return orjson.dumps(row, default=str, option=orjson.OPT_APPEND_NEWLINE)
+
+
+def get_row_encoder(encoder: JsonEncoders | str = None):
+    """
+    Get a function that serialises one row as a line of NDJSON.
+
+    Parameters
+    ----------
+    encoder : JsonEncoders
+        The encoder to use.  If None, the encoder is read from CRUK_JSON_ENCODER, and if that is not set then orjson
+        is used when it is installed, otherwise the standard library json module.
+
+    Returns
+    -------
+    Callable[[dict], bytes]
+        A function that takes a row and returns it as UTF-8 encoded JSON followed by a newline.
+    """
+    if encoder is None:
+        encoder = app_env.get_env_var_value(app_env.EnvironmentVariableNames.JSON_ENCODER).upper()
+        if len(encoder) == 0:
+            encoder = JsonEncoders.ORJSON if orjson is not None else JsonEncoders.STDLIB
+    if type(encoder) is str:
+        encoder_values = [e.name for e in JsonEncoders]
+        if encoder not in encoder_values:
+            raise ValueError(encoder + ' is not a valid JSON encoder.')
+        encoder = JsonEncoders[encoder]
+    if encoder == JsonEncoders.ORJSON:
+        if orjson is None:
+            print('orjson is not installed, using the standard library JSON encoder')
+            return encode_row_stdlib
+        return encode_row_orjson
+    return encode_row_stdlib
@@ -1,36 +1,384 @@
-from salesforce_prototype_app.utilities.get_connections import  get_user_secret_arn_from_aws, get_user_secret_from_aws
+from salesforce_prototype_app.utilities.get_connections import  get_user_secret_from_aws, \
+    get_salesforce, renew_salesforce_session, init_salesforce_session
 from salesforce_prototype_app.utilities.app_environment import is_running_in_container
-from salesforce_prototype_app.utilities.salesforce_poc import salesforce_poc, pull_salesforce_entity, write_target_rows_yield_json_s3
+import salesforce_prototype_app.utilities.app_environment as app_env
+from salesforce_prototype_app.utilities.salesforce_poc import salesforce_poc, pull_salesforce_entity, write_target_rows_s3, \
+    pull_salesforce_entity_chunks_to_s3, PagePosition
 from salesforce_prototype_app.utilities.copyinto_snowflake import copyinto_snowflake, truncate_snowflaketable
-from salesforce_prototype_app.utilities.snowflake_config import get_valid_salesforce_entities
+from salesforce_prototype_app.utilities.snowflake_config import get_valid_salesforce_entities, SalesforceEntityConfig, \
+    StagingFormats, LoadPaths, ExtractEngines
 from salesforce_prototype_app.utilities.snowflake_merge import mergeinto_snowflake
+from salesforce_prototype_app.utilities.salesforce_deletes import capture_salesforce_deletes
+from salesforce_prototype_app.utilities.staging_files import release_staged_files
+from salesforce_prototype_app.utilities.entity_scheduler import EntityRunResult
+from salesforce_prototype_app.utilities.run_metrics import StageMetrics, take_stage_metrics, \
+    discard_failed_stage_metrics
+from salesforce_prototype_app.utilities.run_checkpoints import EntityCheckpoint, get_entity_checkpoint
+from salesforce_prototype_app.utilities.secrets_provider import init_prefetched_secrets
+from salesforce_prototype_app.utilities.entity_load_plan import EntityLoadPlan, get_entity_load_plan
+from salesforce_prototype_app.utilities.pipeline_executor import Pipeline, PipelineStage
+from salesforce_prototype_app.utilities.snowflake_connection_pool import format_connection_pool_stats
+from salesforce_prototype_app.utilities.snowflake_query_coordinator import get_query_coordinator
+from salesforce_prototype_app.utilities.snowflake_watermark import WatermarkTracker, get_high_water_mark, \
+    set_high_water_mark
 from salesforce_prototype_app.helper_functions.testing2 import do_something
+from simple_salesforce.exceptions import SalesforceExpiredSession, SalesforceMalformedRequest, \
+    SalesforceResourceNotFound
 from enum import Enum
 import os
 import multiprocessing
+import multiprocessing.util
+import time
+import traceback
 
+_stats_finalizer_pids = set()
 
-def main_multip_wrapper(sf_entity_name):
+
+def init_pool_worker(session_id: str, instance: str, secrets: dict):
+    """
+    The initializer of the multiprocessing pool in main.py - each worker uses the Salesforce session and the secrets
+    read by the main process, rather than logging in and reading the secrets itself.
+    """
+    init_salesforce_session(session_id, instance)
+    init_prefetched_secrets(secrets)
+
+
+def main_multip_wrapper(entity_config: SalesforceEntityConfig) -> EntityRunResult:
+    """
+    Process one entity in a pool worker process.  Exceptions are caught and returned in the result, so a failed
+    entity does not stop the others.
+    """
+    if os.getpid() not in _stats_finalizer_pids:
+        # the worker's totals are printed once, when it exits - before its Snowflake connections are closed
+        multiprocessing.util.Finalize(None, print_worker_stats, exitpriority=20)
+        _stats_finalizer_pids.add(os.getpid())
+    start_time = time.perf_counter()
+    start_cpu_time = time.process_time()
+    try:
+        try:
+            extracted_entity = process_salesforce_entity(entity_config)
+        except SalesforceExpiredSession:
+            # the session shared by the parent process has expired (INVALID_SESSION_ID), so log in again and retry
+            # the entity - its checkpoint skips the stages already done and continues an interrupted extraction from
+            # the page and files it recorded
+            print(f'Salesforce session expired while processing {entity_config.entity_name}, logging in again')
+            renew_salesforce_session()
+            discard_failed_stage_metrics(entity_config.entity_name)
+            extracted_entity = process_salesforce_entity(entity_config)
+    except Exception as e:
+        traceback.print_exc()
+        return EntityRunResult(entity_config.entity_name, False, seconds=time.perf_counter() - start_time,
+                               cpu_seconds=time.process_time() - start_cpu_time, error=repr(e),
+                               stage_metrics=take_stage_metrics())
+    # the stage metrics are returned to the main process, which writes every entity's in one batch
+    return EntityRunResult(entity_config.entity_name, True, extracted_entity.rows_loaded, extracted_entity.byte_count,
+                           time.perf_counter() - start_time, time.process_time() - start_cpu_time,
+                           stage_metrics=take_stage_metrics())
+
+
+def process_salesforce_entity(entity_config: SalesforceEntityConfig) -> 'ExtractedEntity':
+    try:
+        extracted_entity = extract_salesforce_entity(entity_config)
+
+        # question for later - which is more efficient - should this be one loop or two (one at present)?
+        # Option 1. Pull Entity, Write Entity to S3, Write S3 file to Snowflake
+        # Option 2. Pull Entity, Write Entity to S3, Pull next Entity, Write Next Entity to S3 (then loop to Snowflake)
+        # (main_pipeline runs the stages of different entities at the same time)
+        copy_salesforce_entity(extracted_entity)
+        merge_salesforce_entity(extracted_entity)
+    finally:
+        # only this entity's statements are printed, and then forgotten, so a worker does not keep (and print again)
+        # every statement of the entities it processed before
+        coordinator = get_query_coordinator()
+        print(coordinator.format_stats(entity_config.entity_name))
+        coordinator.forget_entity_queries(entity_config.entity_name)
+    return extracted_entity
+
+
+def print_worker_stats():
+    """
+    Print the Snowflake connection and statement totals of a pool worker process.
+    """
+    print(format_connection_pool_stats())
+    print(get_query_coordinator().format_stats())
+
+
+class ExtractedEntity:
+    """
+    An entity that has been extracted from Salesforce to S3 and is ready to load into Snowflake.
+    """
+
+    def __init__(self, entity_config: SalesforceEntityConfig, load_plan: EntityLoadPlan, filenames: list[str],
+                 watermark_tracker: WatermarkTracker = None):
+        """
+        Parameters
+        ----------
+        entity_config : SalesforceEntityConfig
+            The configuration of the entity.
+        load_plan : EntityLoadPlan
+            The load plan of the entity.
+        filenames : list[str]
+            The keys of the files staged in S3, which are also their paths relative to the Snowflake stage.
+        watermark_tracker : WatermarkTracker
+            For incremental loads, the tracker that recorded the highest watermark value extracted.
+        """
+        self.entity_config = entity_config
+        self.load_plan = load_plan
+        self.filenames = filenames
+        self.watermark_tracker = watermark_tracker
+        self.byte_count = None  # the total size of the files, set once they have all been written
+        self.rows_loaded = None  # set once the files have been copied into Snowflake
+
+
+def extract_salesforce_entity(entity_config: SalesforceEntityConfig) -> ExtractedEntity:
+    checkpoint = get_entity_checkpoint(entity_config.entity_name)
+    if checkpoint.extracted:
+        return get_checkpointed_entity(entity_config, checkpoint)
+
+    with StageMetrics(entity_config.entity_name, 'extract') as stage_metrics:
+        salesforce_entity_name = entity_config.entity_name
+        print(f'Currently processing {salesforce_entity_name}')
 
         # connect to salesforce
+        start_time = time.perf_counter()
+        sf = get_salesforce()
+        print(f'{salesforce_entity_name} Salesforce connection ready in {time.perf_counter() - start_time:.2f} sec')
+
+        # the SOQL, COPY INTO select list and MERGE statement, worked out once and shared by every stage
+        load_plan = get_entity_load_plan(entity_config, sf)
+
+        watermark_column = None
+        high_water_mark = None
+        watermark_tracker = None
+        if entity_config.is_incremental:
+            # spelt as described, as the tracker reads it from the rows Salesforce returns
+            watermark_column = load_plan.watermark_column
+            if entity_config.full_refresh:
+                print(f'Full refresh of {salesforce_entity_name} requested, ignoring its high water mark')
+            else:
+                high_water_mark = get_high_water_mark(salesforce_entity_name)
+                print(f'Extracting {salesforce_entity_name} rows with {watermark_column} >= {high_water_mark}')
+            watermark_tracker = WatermarkTracker(watermark_column)
+            # the rows already written by an interrupted run count towards the next high water mark
+            watermark_tracker.max_value = checkpoint.watermark_max_value
+
+        # Parquet files are typed, so the Salesforce type of each extracted field is needed to build their schema
+        field_types = None
+        if entity_config.staging_format == StagingFormats.PARQUET:
+            field_types = load_plan.field_types
+
+        if entity_config.pk_chunk_size is not None:
+            # extract ID ranges concurrently, each to its own file
+            filenames = pull_salesforce_entity_chunks_to_s3(salesforce_entity_name, entity_config.pk_chunk_size,
+                                                            entity_config.extract_engine, watermark_column,
+                                                            high_water_mark, watermark_tracker,
+                                                            entity_config.staging_format, field_types, sf,
+                                                            load_plan, stage_metrics, checkpoint)
+        elif entity_config.extract_engine == ExtractEngines.REST:
+            filenames = write_salesforce_pages_to_s3(entity_config, load_plan, watermark_column, high_water_mark,
+                                                     watermark_tracker, field_types, sf, stage_metrics, checkpoint)
+        else:
+            row_generator = pull_salesforce_entity(salesforce_entity_name, entity_config.extract_engine,
+                                                   watermark_column, high_water_mark, sf=sf, load_plan=load_plan)
+            if watermark_tracker is not None:
+                row_generator = watermark_tracker.track(row_generator)
+
+            # write to s3 and get the filenames which are then specified in Snowflake COPY INTO
+            filenames = write_target_rows_s3(row_generator, salesforce_entity_name, entity_config.staging_format,
+                                             field_types, stage_metrics=stage_metrics)
+
+        extracted_entity = ExtractedEntity(entity_config, load_plan, filenames, watermark_tracker)
+        extracted_entity.byte_count = stage_metrics.bytes_compressed
+        checkpoint.update(extracted=True, filenames=filenames, byte_count=extracted_entity.byte_count,
+                          watermark_max_value=watermark_tracker.max_value if watermark_tracker is not None else None)
+        return extracted_entity
 
-    salesforce_entity_name = sf_entity_name
-    print(f'Currently processing {salesforce_entity_name}')
 
-    # truncate loading tables
-    truncate_snowflaketable(salesforce_entity_name)
+def write_salesforce_pages_to_s3(entity_config: SalesforceEntityConfig, load_plan: EntityLoadPlan, watermark_column,
+                                 high_water_mark, watermark_tracker: WatermarkTracker, field_types, sf,
+                                 stage_metrics: StageMetrics, checkpoint: EntityCheckpoint) -> list[str]:
+    """
+    Extract an entity with the REST engine in one piece, checkpointing the files written and the page and row the
+    query has got to as each file is finished, and continuing from the checkpoint of an interrupted run.
 
-    row_generator = pull_salesforce_entity(salesforce_entity_name)
+    Returns
+    -------
+    list[str]
+        The keys of every file of the entity, including those written by an interrupted run.
+    """
+    salesforce_entity_name = entity_config.entity_name
+    previous_filenames = list(checkpoint.filenames)
+    if len(previous_filenames) > 0 and checkpoint.page_url is None:
+        # the last file ended on the first page, which has no query locator to continue from
+        print(f'{salesforce_entity_name} cannot be continued from its checkpoint, extracting it again')
+        restart_extraction(salesforce_entity_name, checkpoint, watermark_tracker)
+        previous_filenames = []
+    page_position = PagePosition(checkpoint.page_url, checkpoint.page_row_offset)
+    if page_position.page_url is not None:
+        print(f'Continuing {salesforce_entity_name} after {len(previous_filenames)} file(s), from '
+              f'{page_position.page_url} row {page_position.row_offset}')
 
-    # write to s3 and get the filename which is then specified in Snowflake COPY INTO
-    filename = write_target_rows_yield_json_s3(row_generator, salesforce_entity_name)
+    written_filenames = []
 
-    copyinto_snowflake(salesforce_entity_name, filename)
+    def checkpoint_file(filename):
+        written_filenames.append(filename)
+        checkpoint.update(filenames=previous_filenames + written_filenames, page_url=page_position.page_url,
+                          page_row_offset=page_position.row_offset,
+                          watermark_max_value=watermark_tracker.max_value if watermark_tracker is not None else None)
 
-    # question for later - which is more efficient - should this be one loop or two (one at present)?
-    # Option 1. Pull Entity, Write Entity to S3, Write S3 file to Snowflake
-    # Option 2. Pull Entity, Write Entity to S3, Pull next Entity, Write Next Entity to S3 (then loop to Snowflake)
+    row_generator = pull_salesforce_entity(salesforce_entity_name, entity_config.extract_engine, watermark_column,
+                                           high_water_mark, sf=sf, load_plan=load_plan, page_position=page_position)
+    if watermark_tracker is not None:
+        row_generator = watermark_tracker.track(row_generator)
+    try:
+        # write to s3 and get the filenames which are then specified in Snowflake COPY INTO
+        filenames = write_target_rows_s3(row_generator, salesforce_entity_name, entity_config.staging_format,
+                                         field_types, stage_metrics=stage_metrics, on_file_written=checkpoint_file)
+    except (SalesforceMalformedRequest, SalesforceResourceNotFound) as e:
+        if len(previous_filenames) == 0:
+            raise
+        # typically INVALID_QUERY_LOCATOR, as the query locator of the interrupted run has expired
+        print(f'Continuing {salesforce_entity_name} from its checkpoint failed ({e!r}), extracting it again')
+        restart_extraction(salesforce_entity_name, checkpoint, watermark_tracker)
+        return write_salesforce_pages_to_s3(entity_config, load_plan, watermark_column, high_water_mark,
+                                            watermark_tracker, field_types, sf, stage_metrics, checkpoint)
+    return previous_filenames + filenames
+
+
+def restart_extraction(salesforce_entity_name: str, checkpoint: EntityCheckpoint,
+                       watermark_tracker: WatermarkTracker = None):
+    """
+    Discard the files of a partial extraction that cannot be continued, so the entity is extracted from the start.
+    """
+    if len(checkpoint.filenames) > 0:
+        release_staged_files(salesforce_entity_name, checkpoint.filenames)
+    checkpoint.reset_extraction()
+    if watermark_tracker is not None:
+        watermark_tracker.max_value = None
+
+
+def get_checkpointed_entity(entity_config: SalesforceEntityConfig, checkpoint: EntityCheckpoint) -> ExtractedEntity:
+    """
+    Get an entity that was extracted by an interrupted run, from its checkpoint.
+    """
+    print(f'{entity_config.entity_name} was extracted by the interrupted run ({len(checkpoint.filenames)} file(s))')
+    load_plan = get_entity_load_plan(entity_config, get_salesforce())
+    watermark_tracker = None
+    if entity_config.is_incremental:
+        watermark_tracker = WatermarkTracker(load_plan.watermark_column)
+        watermark_tracker.max_value = checkpoint.watermark_max_value
+    extracted_entity = ExtractedEntity(entity_config, load_plan, checkpoint.filenames, watermark_tracker)
+    extracted_entity.byte_count = checkpoint.byte_count
+    extracted_entity.rows_loaded = checkpoint.rows_loaded
+    return extracted_entity
+
+
+def copy_salesforce_entity(extracted_entity: ExtractedEntity) -> ExtractedEntity:
+    if extracted_entity.entity_config.load_path == LoadPaths.STAGE:
+        return extracted_entity  # the merge reads the staged files itself, so there is no loading table to fill
+    checkpoint = get_entity_checkpoint(extracted_entity.load_plan.entity_name)
+    if checkpoint.copied:
+        print(f'{extracted_entity.load_plan.entity_name} was copied into Snowflake by the interrupted run')
+        return extracted_entity
+
+    with StageMetrics(extracted_entity.load_plan.entity_name, 'copy') as stage_metrics:
+        # truncate loading tables
+        truncate_snowflaketable(extracted_entity.load_plan.entity_name, stage_metrics)
+        extracted_entity.rows_loaded = copyinto_snowflake(extracted_entity.load_plan, extracted_entity.filenames,
+                                                          extracted_entity.entity_config.staging_format,
+                                                          stage_metrics)
+    checkpoint.update(copied=True, rows_loaded=extracted_entity.rows_loaded)
+    return extracted_entity
+
+
+def merge_salesforce_entity(extracted_entity: ExtractedEntity) -> ExtractedEntity:
+    checkpoint = get_entity_checkpoint(extracted_entity.load_plan.entity_name)
+    if checkpoint.merged:
+        print(f'{extracted_entity.load_plan.entity_name} was merged into Snowflake by the interrupted run')
+        return extracted_entity
 
     # new code in here to move data from loading into proper schema
-    mergeinto_snowflake(salesforce_entity_name)
+    if extracted_entity.entity_config.load_path == LoadPaths.STAGE:
+        # recorded under its own stage name, so RUN_METRICS_WAREHOUSE_USAGE can compare the cost of the two paths
+        with StageMetrics(extracted_entity.load_plan.entity_name, 'merge_from_stage') as stage_metrics:
+            if len(extracted_entity.filenames) > 0:
+                extracted_entity.rows_loaded = mergeinto_snowflake(extracted_entity.load_plan, stage_metrics,
+                                                                   extracted_entity.filenames,
+                                                                   extracted_entity.entity_config.staging_format)
+            else:
+                extracted_entity.rows_loaded = 0
+    else:
+        with StageMetrics(extracted_entity.load_plan.entity_name, 'merge') as stage_metrics:
+            mergeinto_snowflake(extracted_entity.load_plan, stage_metrics)
+
+    if extracted_entity.entity_config.capture_deletes:
+        # after the merge, so the rows are in the model table to be marked
+        with StageMetrics(extracted_entity.load_plan.entity_name, 'deletes') as stage_metrics:
+            try:
+                capture_salesforce_deletes(extracted_entity.load_plan, stage_metrics=stage_metrics)
+            except SalesforceExpiredSession:
+                # the session can expire during a long extraction and merge, before getDeleted is called
+                print(f'Salesforce session expired while capturing the deletes of '
+                      f'{extracted_entity.load_plan.entity_name}, logging in again')
+                renew_salesforce_session()
+                capture_salesforce_deletes(extracted_entity.load_plan, stage_metrics=stage_metrics)
+
+    # only advance the high water mark once the merge has succeeded, so a failed run is re-extracted next time
+    watermark_tracker = extracted_entity.watermark_tracker
+    if watermark_tracker is not None and watermark_tracker.max_value is not None:
+        set_high_water_mark(extracted_entity.load_plan.entity_name, watermark_tracker.watermark_column,
+                            watermark_tracker.max_value)
+
+    # the files are only released once merged, so an entity that fails before then can be loaded from them again
+    release_staged_files(extracted_entity.load_plan.entity_name, extracted_entity.filenames)
+    checkpoint.update(merged=True, rows_loaded=extracted_entity.rows_loaded)
+    return extracted_entity
+
+
+def extract_salesforce_entity_with_renewal(entity_config: SalesforceEntityConfig) -> ExtractedEntity:
+    try:
+        return extract_salesforce_entity(entity_config)
+    except SalesforceExpiredSession:
+        print(f'Salesforce session expired while extracting {entity_config.entity_name}, logging in again')
+        renew_salesforce_session()
+        discard_failed_stage_metrics(entity_config.entity_name)
+        return extract_salesforce_entity(entity_config)
+
+
+def main_pipeline(entity_configs: list[SalesforceEntityConfig], extract_workers: int):
+    """
+    Process every entity as a pipeline of extract (Salesforce to S3), COPY and MERGE stages, so that e.g. one entity
+    is being extracted while another is being copied into Snowflake, rather than each entity running every step in
+    turn.  Everything runs on threads in this process, sharing one Salesforce session and one Snowflake connection.
+
+    Parameters
+    ----------
+    entity_configs : list[SalesforceEntityConfig]
+        The entities to process.
+    extract_workers : int
+        The number of entities extracted at once.
+
+    Raises
+    ------
+    RuntimeError
+        If any entity failed, once every other entity has been processed.
+    """
+    snowflake_workers = get_snowflake_max_concurrency()
+    pipeline = Pipeline([PipelineStage('extract', extract_salesforce_entity_with_renewal, extract_workers),
+                         PipelineStage('copy', copy_salesforce_entity, snowflake_workers),
+                         PipelineStage('merge', merge_salesforce_entity, snowflake_workers)])
+    pipeline.run(entity_configs)
+    print(pipeline.format_stats())
+    print(format_connection_pool_stats())
+    print(get_query_coordinator().format_stats())
+    if len(pipeline.failures) > 0:
+        failed_entities = [f'{getattr(item, "entity_config", item).entity_name} ({stage_name})'
+                           for item, stage_name, _ in pipeline.failures]
+        raise RuntimeError(f'Processing failed for {", ".join(failed_entities)}')
+
 
+def get_snowflake_max_concurrency() -> int:
+    """
+    Get the maximum number of concurrent Snowflake statements per stage, from the SnowflakeMaxConcurrency parameter.
+    """
+    return app_env.get_int_env_var_value(app_env.EnvironmentVariableNames.SNOWFLAKEMAXCONCURRENCY, 2)
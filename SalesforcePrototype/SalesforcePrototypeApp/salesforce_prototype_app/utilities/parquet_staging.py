@@ -0,0 +1,98 @@
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrow is only needed for entities staged as Parquet
+    pyarrow = None
+
+PARQUET_ROWS_PER_BATCH = 50000
+
+# Salesforce field types (from describe) that have a natural Arrow type - every other type is written as a string.
+# Dates and times are also left as strings, in the ISO 8601 format returned by Salesforce, and are converted by
+# Snowflake when they are loaded into DATE / TIMESTAMP columns.
+SALESFORCE_ARROW_TYPE_NAMES = {
+    'boolean': 'bool_',
+    'int': 'int64',
+    'long': 'int64',
+    'double': 'float64',
+    'currency': 'float64',
+    'percent': 'float64'
+}
+
+
+def get_arrow_schema(field_types: dict[str, str]):
+    """
+    Get the Arrow schema for the rows of an entity.
+
+    Parameters
+    ----------
+    field_types : dict[str, str]
+        The Salesforce field names and their Salesforce data types, in the order they are selected.
+
+    Returns
+    -------
+    pyarrow.Schema
+        The schema, with one nullable column per field.
+    """
+    if pyarrow is None:
+        raise ValueError('pyarrow must be installed to stage files as Parquet.')
+    return pyarrow.schema([(field_name, getattr(pyarrow, SALESFORCE_ARROW_TYPE_NAMES.get(field_type, 'string'))())
+                           for field_name, field_type in field_types.items()])
+
+
+def iterate_record_batches(row_generator, schema, rows_per_batch: int = PARQUET_ROWS_PER_BATCH):
+    """
+    Group rows into Arrow record batches.
+
+    Parameters
+    ----------
+    row_generator : Iterator[dict]
+        The rows extracted from Salesforce.
+    schema : pyarrow.Schema
+        The schema of the rows.
+    rows_per_batch : int
+        The maximum number of rows in each batch (and therefore in each Parquet row group).
+
+    Returns
+    -------
+    Iterator[pyarrow.RecordBatch]
+        A generator that yields one record batch at a time.
+    """
+    rows = []
+    for row in row_generator:
+        rows.append(row)
+        if len(rows) >= rows_per_batch:
+            yield get_record_batch(rows, schema)
+            rows = []
+    if len(rows) > 0:
+        yield get_record_batch(rows, schema)
+
+
+def get_record_batch(rows: list[dict], schema):
+    arrays = []
+    for field in schema:
+        values = [row.get(field.name) for row in rows]
+        try:
+            arrays.append(pyarrow.array(values, type=field.type))
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+            # the BULK engine returns every value as a string, e.g. 'true' or '42', so convert it
+            arrays.append(pyarrow.array(values, type=pyarrow.string()).cast(field.type))
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_parquet(row_generator, schema, file_object) -> tuple[int, int]:
+    """
+    Write rows to a (write-only) file object as Snappy-compressed Parquet, one row group per record batch.
+
+    Returns
+    -------
+    tuple[int, int]
+        The number of rows written and their size in memory (before encoding and compression) in bytes.
+    """
+    row_count = 0
+    bytes_raw = 0
+    with pyarrow.parquet.ParquetWriter(file_object, schema, compression='snappy') as writer:
+        for record_batch in iterate_record_batches(row_generator, schema):
+            writer.write_batch(record_batch)
+            row_count += record_batch.num_rows
+            bytes_raw += record_batch.nbytes
+    return row_count, bytes_raw
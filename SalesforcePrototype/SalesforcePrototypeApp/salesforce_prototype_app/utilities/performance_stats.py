@@ -0,0 +1,50 @@
+import time
+
+try:
+    import resource
+except ImportError:  # resource is only available on Unix, e.g. not when debugging on Windows
+    resource = None
+
+
+def get_peak_rss_mib() -> float:
+    """
+    Get the peak resident set size (RSS) of the current process.
+
+    The value is the high water mark for the lifetime of the process, so when one worker process handles several
+    entities the value reported for an entity is the peak across that entity and the entities before it.
+
+    Returns
+    -------
+    float
+        The peak RSS in MiB, or None if it cannot be determined on the current platform.
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is reported in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def format_extract_stats(salesforce_entity_name: str, row_count: int, start_time: float) -> str:
+    """
+    Format the throughput and memory statistics for the extraction of one Salesforce entity.
+
+    Parameters
+    ----------
+    salesforce_entity_name : str
+        The name of the Salesforce entity that was extracted.
+    row_count : int
+        The number of rows extracted.
+    start_time : float
+        The value of time.perf_counter() when the extraction started.
+
+    Returns
+    -------
+    str
+        The statistics as a single line of text.
+    """
+    elapsed_seconds = time.perf_counter() - start_time
+    rows_per_second = row_count / elapsed_seconds if elapsed_seconds > 0 else 0
+    peak_rss_mib = get_peak_rss_mib()
+    peak_rss_text = f'{peak_rss_mib:.0f} MiB' if peak_rss_mib is not None else 'n/a'
+    return f'{salesforce_entity_name}: {row_count} rows in {elapsed_seconds:.1f} sec ' \
+           f'({rows_per_second:.0f} rows/sec), peak RSS {peak_rss_text}'
@@ -0,0 +1,122 @@
+import queue
+import threading
+import time
+
+PIPELINE_DEFAULT_QUEUE_SIZE = 2
+
+_END_OF_ITEMS = object()  # put on a stage's queue once per worker when there are no more items
+
+
+class PipelineStage:
+    """
+    One stage of a pipeline - a function applied to every item by a fixed number of worker threads.
+    """
+
+    def __init__(self, name: str, function, workers: int = 1):
+        """
+        Parameters
+        ----------
+        name : str
+            The name of the stage, used when reporting.
+        function : Callable
+            Called with each item; its return value is passed to the next stage.
+        workers : int
+            The number of threads running the stage, i.e. how many items it processes at once.
+        """
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.item_count = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, busy_seconds: float):
+        with self._lock:
+            self.item_count += 1
+            self.busy_seconds += busy_seconds
+
+
+class Pipeline:
+    """
+    Runs items through a sequence of stages, with each stage working on a different item at the same time - e.g. while
+    one entity is being loaded into Snowflake, the next is being extracted from Salesforce.
+
+    The queues between stages are bounded, so a fast stage waits for a slow one rather than piling up results in
+    memory.  An item whose stage raises an exception is not passed to the later stages, but the other items carry on.
+    """
+
+    def __init__(self, stages: list[PipelineStage], queue_size: int = PIPELINE_DEFAULT_QUEUE_SIZE):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.failures = []  # (item, stage name, exception)
+        self.wall_seconds = 0.0
+        self._failures_lock = threading.Lock()
+
+    def run(self, items) -> list:
+        """
+        Run every item through every stage.
+
+        Returns
+        -------
+        list
+            The results of the last stage, in the order they completed, for the items that did not fail.
+        """
+        start_time = time.perf_counter()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages] + [queue.Queue()]
+        remaining_workers = [stage.workers for stage in self.stages]
+        remaining_lock = threading.Lock()
+
+        def run_worker(stage_number: int):
+            stage = self.stages[stage_number]
+            while True:
+                item = queues[stage_number].get()
+                if item is _END_OF_ITEMS:
+                    break
+                stage_start_time = time.perf_counter()
+                try:
+                    result = stage.function(item)
+                except Exception as e:
+                    with self._failures_lock:
+                        self.failures.append((item, stage.name, e))
+                    print(f'Pipeline stage {stage.name} failed: {e!r}')
+                    continue
+                finally:
+                    stage.record(time.perf_counter() - stage_start_time)
+                queues[stage_number + 1].put(result)
+            # the last worker of a stage to finish tells every worker of the next stage that there are no more items
+            with remaining_lock:
+                remaining_workers[stage_number] -= 1
+                is_last_worker = remaining_workers[stage_number] == 0
+            if is_last_worker and stage_number + 1 < len(self.stages):
+                for _ in range(self.stages[stage_number + 1].workers):
+                    queues[stage_number + 1].put(_END_OF_ITEMS)
+
+        threads = [threading.Thread(target=run_worker, args=(stage_number,), name=f'{stage.name}-{n}', daemon=True)
+                   for stage_number, stage in enumerate(self.stages) for n in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+        for item in items:
+            queues[0].put(item)
+        for _ in range(self.stages[0].workers):
+            queues[0].put(_END_OF_ITEMS)
+        for thread in threads:
+            thread.join()
+        self.wall_seconds = time.perf_counter() - start_time
+
+        results = []
+        while not queues[-1].empty():
+            results.append(queues[-1].get())
+        return results
+
+    def format_stats(self) -> str:
+        """
+        Describe how busy each stage was - the time its workers spent processing items, as a percentage of the time
+        they were available.  A stage with low utilisation spent most of the run waiting on the stages around it.
+        """
+        lines = [f'Pipeline completed in {self.wall_seconds:.1f} sec']
+        for stage in self.stages:
+            available_seconds = self.wall_seconds * stage.workers
+            utilisation = 100 * stage.busy_seconds / available_seconds if available_seconds > 0 else 0.0
+            lines.append(f'  {stage.name:<10} {stage.item_count} items, {stage.workers} workers, '
+                         f'busy {stage.busy_seconds:.1f} sec, utilisation {utilisation:.0f}%')
+        return '\n'.join(lines)
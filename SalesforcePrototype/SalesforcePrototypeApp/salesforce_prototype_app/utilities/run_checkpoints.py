@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+import salesforce_prototype_app.utilities.app_environment as app_env
+from salesforce_prototype_app.utilities.get_connections import get_aws_client
+
+# alongside the local_only/config.ini used outside AWS
+LOCAL_CHECKPOINTS_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'local_only/checkpoints')
+S3_CHECKPOINTS_PREFIX = 'checkpoints'
+
+_run_id = None  # the run checkpoints are saved under, set before the pool workers are started so they inherit it
+_resume = False
+_checkpoints = {}  # entity name -> EntityCheckpoint, loaded once per process
+_checkpoints_lock = threading.Lock()
+
+
+class EntityCheckpoint:
+    """
+    How far one entity has got in a run - which stages are done and, for an extraction that is not, the files
+    already written and where to continue from - saved after each step so an interrupted run can be resumed with
+    --resume <run-id>.  Use get_entity_checkpoint() to get one, rather than creating it directly.
+    """
+
+    def __init__(self, run_id: str, entity_name: str, state: dict = None):
+        """
+        Parameters
+        ----------
+        run_id : str
+            The run the checkpoint belongs to.  If None, the checkpoint is not saved.
+        entity_name : str
+            The name of the Salesforce entity.
+        state : dict
+            The saved state of the checkpoint, or None for an entity that has not been started.
+        """
+        state = state if state is not None else {}
+        self.run_id = run_id
+        self.entity_name = entity_name
+        self.extracted = state.get('extracted', False)
+        self.copied = state.get('copied', False)
+        self.merged = state.get('merged', False)
+        # the keys of the staged files - every file once extracted, otherwise the files of the finished part
+        self.filenames = state.get('filenames', [])
+        self.rows_loaded = state.get('rows_loaded')
+        self.byte_count = state.get('byte_count')
+        self.watermark_max_value = state.get('watermark_max_value')
+        # a PK chunked extraction continues with the same ID ranges, skipping the chunks already written
+        self.id_ranges = [tuple(id_range) for id_range in state['id_ranges']] \
+            if state.get('id_ranges') is not None else None
+        self.chunk_filenames = {int(chunk_number): filenames
+                                for chunk_number, filenames in state.get('chunk_filenames', {}).items()}
+        # a paged REST extraction continues from the page (query locator URL) and row the last file ended at
+        self.page_url = state.get('page_url')
+        self.page_row_offset = state.get('page_row_offset', 0)
+        self._lock = threading.Lock()
+
+    def to_dict(self) -> dict:
+        return {'extracted': self.extracted, 'copied': self.copied, 'merged': self.merged,
+                'filenames': self.filenames, 'rows_loaded': self.rows_loaded, 'byte_count': self.byte_count,
+                'watermark_max_value': self.watermark_max_value, 'id_ranges': self.id_ranges,
+                'chunk_filenames': self.chunk_filenames, 'page_url': self.page_url,
+                'page_row_offset': self.page_row_offset}
+
+    def update(self, **values):
+        """
+        Set some of the attributes of the checkpoint and save it.  It can be updated from several threads, e.g. one
+        per PK chunk.
+        """
+        with self._lock:
+            for name, value in values.items():
+                setattr(self, name, value)
+            self.save()
+
+    def add_chunk(self, chunk_number: int, filenames: list[str], watermark_max_value: str = None):
+        """
+        Record a finished PK chunk and save the checkpoint.
+        """
+        with self._lock:
+            self.chunk_filenames[chunk_number] = filenames
+            if watermark_max_value is not None:
+                self.watermark_max_value = watermark_max_value
+            self.save()
+
+    def reset_extraction(self):
+        """
+        Forget a partial extraction, e.g. because its query locator has expired, so the entity is extracted again.
+        """
+        self.update(filenames=[], watermark_max_value=None, id_ranges=None, chunk_filenames={}, page_url=None,
+                    page_row_offset=0)
+
+    def save(self):
+        if self.run_id is None:
+            return
+        body = json.dumps(self.to_dict())
+        bucket = get_checkpoints_bucket_name()
+        if len(bucket) > 0:
+            get_aws_client('s3').put_object(Bucket=bucket, Key=get_checkpoint_key(self.run_id, self.entity_name),
+                                            Body=body.encode('utf-8'))
+            return
+
+        path = os.path.join(LOCAL_CHECKPOINTS_PATH, get_checkpoint_key(self.run_id, self.entity_name))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='UTF8') as f:
+            f.write(body)
+
+
+def get_checkpoints_bucket_name() -> str:
+    return app_env.get_env_var_value(app_env.EnvironmentVariableNames.AWS_S3_BUCKET_NAME)
+
+
+def get_checkpoint_key(run_id: str, entity_name: str) -> str:
+    """
+    Get the S3 key (or the path relative to local_only/checkpoints) of the checkpoint of an entity in a run.
+    """
+    return f'{S3_CHECKPOINTS_PREFIX}/{run_id}/{entity_name}.json'
+
+
+def set_checkpoint_run(run_id: str, resume: bool = False):
+    """
+    Set the run that checkpoints are saved under and, if resume is True, loaded from.  Call this before starting pool
+    workers, so they inherit it.
+    """
+    global _run_id, _resume
+    _run_id = run_id
+    _resume = resume
+
+
+def load_checkpoint_state(run_id: str, entity_name: str) -> dict:
+    """
+    Load the saved state of an entity's checkpoint, persisted in S3 when CRUK_AWS_S3_BUCKET_NAME is set and on local
+    disk otherwise.
+
+    Returns
+    -------
+    dict
+        The state, or None if the entity was not started in the run.
+    """
+    bucket = get_checkpoints_bucket_name()
+    if len(bucket) > 0:
+        s3 = get_aws_client('s3')
+        try:
+            response = s3.get_object(Bucket=bucket, Key=get_checkpoint_key(run_id, entity_name))
+        except s3.exceptions.NoSuchKey:
+            return None
+        return json.loads(response['Body'].read())
+
+    path = os.path.join(LOCAL_CHECKPOINTS_PATH, get_checkpoint_key(run_id, entity_name))
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='UTF8') as f:
+        return json.load(f)
+
+
+def get_entity_checkpoint(entity_name: str) -> EntityCheckpoint:
+    """
+    Get the checkpoint of an entity in the current run, loading it the first time it is needed in this process if the
+    run is being resumed.
+    """
+    with _checkpoints_lock:
+        checkpoint = _checkpoints.get(entity_name)
+        if checkpoint is None:
+            state = load_checkpoint_state(_run_id, entity_name) if _resume and _run_id is not None else None
+            checkpoint = EntityCheckpoint(_run_id, entity_name, state)
+            if state is not None:
+                print(f'Resuming {entity_name} from its checkpoint: extracted={checkpoint.extracted}, '
+                      f'copied={checkpoint.copied}, merged={checkpoint.merged}, {len(checkpoint.filenames)} file(s), '
+                      f'{len(checkpoint.chunk_filenames)} chunk(s)')
+            _checkpoints[entity_name] = checkpoint
+        return checkpoint
@@ -0,0 +1,132 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from salesforce_prototype_app.utilities.snowflake_connection_pool import get_snowflake_connection
+
+RUN_METRICS_TABLE_NAME = 'DEV_AG_SALESFORCE.SALESFORCE_LOAD.RUN_METRICS'
+RUN_METRICS_COLUMN_NAMES = ['RUN_ID', 'ENTITY_NAME', 'STAGE_NAME', 'STARTED_AT', 'DURATION_SECONDS', 'SUCCEEDED',
+                            'ROW_COUNT', 'BYTES_RAW', 'BYTES_COMPRESSED', 'WORKER_ID', 'QUERY_IDS']
+
+_stage_metrics = []  # the StageMetrics finished in this process and not yet taken
+_stage_metrics_lock = threading.Lock()
+
+
+def new_run_id() -> str:
+    """
+    Get a unique id for an ELT run, starting with the time it started so that run ids sort in order.
+    """
+    return f'{datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")}-{uuid.uuid4().hex[:8]}'
+
+
+class StageMetrics:
+    """
+    The measurements of one stage (extract, copy or merge) of one entity, i.e. one row of the RUN_METRICS table.
+
+    Use it as a context manager around the stage - the duration and whether the stage succeeded are recorded when the
+    block is left, and the metrics are kept in this process until take_stage_metrics() is called.  The counts can be
+    added to from several threads, e.g. one per PK chunk.
+    """
+
+    def __init__(self, entity_name: str, stage_name: str):
+        """
+        Parameters
+        ----------
+        entity_name : str
+            The name of the Salesforce entity.
+        stage_name : str
+            The name of the stage, e.g. extract.
+        """
+        self.entity_name = entity_name
+        self.stage_name = stage_name
+        self.started_at = datetime.now(timezone.utc)
+        self.seconds = None
+        self.succeeded = None
+        self.row_count = None
+        self.bytes_raw = None
+        self.bytes_compressed = None
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}'
+        self.query_ids = []
+        self._start_time = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds = time.perf_counter() - self._start_time
+        self.succeeded = exc_type is None
+        with _stage_metrics_lock:
+            _stage_metrics.append(self)
+
+    def __getstate__(self):
+        # pool workers return their metrics to the main process, but a lock cannot be pickled
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add_rows(self, row_count: int, bytes_raw: int = None, bytes_compressed: int = None):
+        """
+        Add to the number of rows (and optionally bytes) the stage has processed.
+        """
+        with self._lock:
+            self.row_count = (self.row_count or 0) + row_count
+            if bytes_raw is not None:
+                self.bytes_raw = (self.bytes_raw or 0) + bytes_raw
+            if bytes_compressed is not None:
+                self.bytes_compressed = (self.bytes_compressed or 0) + bytes_compressed
+
+    def add_query_id(self, query_id: str):
+        with self._lock:
+            self.query_ids.append(query_id)
+
+    def to_row(self, run_id: str) -> tuple:
+        return (run_id, self.entity_name, self.stage_name, self.started_at.isoformat(), self.seconds, self.succeeded,
+                self.row_count, self.bytes_raw, self.bytes_compressed, self.worker_id, ','.join(self.query_ids))
+
+
+def take_stage_metrics() -> list[StageMetrics]:
+    """
+    Get the metrics of the stages finished in this process since the last call, e.g. to return them from a pool
+    worker to the main process.
+    """
+    with _stage_metrics_lock:
+        stage_metrics = list(_stage_metrics)
+        _stage_metrics.clear()
+        return stage_metrics
+
+
+def discard_failed_stage_metrics(entity_name: str):
+    """
+    Forget the metrics of an entity's failed stages that have not been taken yet, e.g. before the entity is retried,
+    so RUN_METRICS only has the retry's row for each stage rather than counting the rows of both attempts.  The
+    stages that succeeded are kept, as the retry skips them (see run_checkpoints).
+    """
+    with _stage_metrics_lock:
+        _stage_metrics[:] = [metrics for metrics in _stage_metrics
+                             if metrics.entity_name != entity_name or metrics.succeeded]
+
+
+def write_run_metrics(run_id: str, stage_metrics: list[StageMetrics]):
+    """
+    Write the metrics of a run to the RUN_METRICS table, as a single batched INSERT.
+
+    A failure is reported rather than raised, so that it cannot fail a run whose data has already been loaded.
+    """
+    if len(stage_metrics) == 0:
+        return
+    sql = f"INSERT INTO {RUN_METRICS_TABLE_NAME} ({', '.join(RUN_METRICS_COLUMN_NAMES)})" \
+          f" VALUES ({', '.join(['%s'] * len(RUN_METRICS_COLUMN_NAMES))})"
+    try:
+        cursor = get_snowflake_connection().cursor()
+        # the connector rewrites executemany of an INSERT ... VALUES into one multi-row INSERT
+        cursor.executemany(sql, [metrics.to_row(run_id) for metrics in stage_metrics])
+        print(f'{len(stage_metrics)} run metrics written to {RUN_METRICS_TABLE_NAME} for run {run_id}')
+    except Exception as e:
+        print(f'Writing run metrics for run {run_id} failed: {e!r}')
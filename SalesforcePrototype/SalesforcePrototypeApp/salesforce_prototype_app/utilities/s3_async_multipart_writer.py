@@ -0,0 +1,172 @@
+import asyncio
+import time
+import aiohttp
+import salesforce_prototype_app.utilities.app_environment as app_env
+from salesforce_prototype_app.utilities.s3_multipart_writer import S3_MIN_PART_SIZE_MB, S3_DEFAULT_PART_SIZE_MB, \
+    S3_DEFAULT_MAX_CONCURRENCY
+
+S3_PART_UPLOAD_ATTEMPTS = 3
+S3_PRESIGNED_URL_EXPIRY_SECONDS = 3600
+
+
+class AsyncS3MultipartWriter:
+    """
+    The asyncio equivalent of S3MultipartWriter - an S3 multipart upload written to while data is being extracted.
+
+    Each part is uploaded by an aiohttp PUT to a presigned upload_part URL, so uploads are in flight on the event loop
+    rather than occupying a thread each.  Only creating and completing the upload (one request each) are made with the
+    blocking boto3 client, on the loop's default executor.
+
+    The parts in flight are limited by upload_slots, which can be shared by every writer so that memory use is bounded
+    across all the entities being extracted at once, not just per file.  Use it as an async context manager - the
+    upload is completed on leaving the block normally and aborted if an error occurs.
+    """
+
+    def __init__(self, s3_client, http_session: aiohttp.ClientSession, bucket: str, key: str,
+                 part_size_mb: int = None, upload_slots: asyncio.Semaphore = None):
+        """
+        Parameters
+        ----------
+        s3_client : S3.Client
+            The boto3 S3 client used to start and complete the upload and to presign the part URLs.
+        http_session : aiohttp.ClientSession
+            The session used to upload the parts.
+        bucket : str
+            The name of the S3 bucket.
+        key : str
+            The key of the object to create.
+        part_size_mb : int
+            The size of each part in MiB, minimum 5.  Defaults to CRUK_AWS_S3_UPLOAD_PART_SIZE_MB, or 8 if not set.
+        upload_slots : asyncio.Semaphore
+            Limits the number of parts uploaded at once.  Defaults to a semaphore for this writer only, sized by
+            CRUK_AWS_S3_UPLOAD_MAX_CONCURRENCY, or 4 if not set.
+        """
+        if part_size_mb is None:
+            part_size_mb = app_env.get_int_env_var_value(app_env.EnvironmentVariableNames.AWS_S3_UPLOAD_PART_SIZE_MB,
+                                                         S3_DEFAULT_PART_SIZE_MB)
+        if upload_slots is None:
+            upload_slots = asyncio.Semaphore(app_env.get_int_env_var_value(
+                app_env.EnvironmentVariableNames.AWS_S3_UPLOAD_MAX_CONCURRENCY, S3_DEFAULT_MAX_CONCURRENCY))
+        self.s3_client = s3_client
+        self.http_session = http_session
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size_mb, S3_MIN_PART_SIZE_MB) * 1024 * 1024
+        self.bytes_written = 0
+        self.start_time = time.perf_counter()
+        self.first_part_time = None
+        self.closed = False
+        self._buffer = bytearray()
+        self._parts = []
+        self._tasks = []
+        self._slots = upload_slots
+        self._upload_id = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.close()
+        else:
+            await self.abort()
+
+    async def start(self):
+        """
+        Start the multipart upload.
+        """
+        response = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.key))
+        self._upload_id = response['UploadId']
+
+    def tell(self) -> int:
+        return self.bytes_written
+
+    async def write(self, data: bytes) -> int:
+        """
+        Buffer data, starting the upload of a part each time the buffer reaches the part size.  Waits while the
+        maximum number of parts are already being uploaded.
+        """
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            await self._upload_part(part)
+        return len(data)
+
+    async def close(self):
+        """
+        Upload the remaining buffered data as the last part, then complete the multipart upload.
+        """
+        if self.closed:
+            return
+        try:
+            # an upload needs at least one part, even if the object is empty
+            if len(self._buffer) > 0 or len(self._tasks) == 0:
+                await self._upload_part(bytes(self._buffer))
+                self._buffer = bytearray()
+            await asyncio.gather(*self._tasks)
+            self._parts.sort(key=lambda part: part['PartNumber'])
+            await asyncio.get_running_loop().run_in_executor(
+                None, lambda: self.s3_client.complete_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                                                       UploadId=self._upload_id,
+                                                                       MultipartUpload={'Parts': self._parts}))
+            self.closed = True
+        except Exception:
+            await self.abort()
+            raise
+
+    async def abort(self):
+        """
+        Abort the multipart upload, discarding any parts already uploaded.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._upload_id is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                None, lambda: self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                                                    UploadId=self._upload_id))
+
+    @property
+    def time_to_first_byte(self) -> float:
+        """
+        The number of seconds from creating the writer until the first part started uploading, or None.
+        """
+        return self.first_part_time - self.start_time if self.first_part_time is not None else None
+
+    async def _upload_part(self, part: bytes):
+        # fail fast (rather than buffering more data) if an earlier part has already failed
+        for task in self._tasks:
+            if task.done() and task.exception() is not None:
+                raise task.exception()
+        await self._slots.acquire()
+        if self.first_part_time is None:
+            self.first_part_time = time.perf_counter()
+        part_number = len(self._tasks) + 1
+        self._tasks.append(asyncio.create_task(self._upload_part_in_background(part_number, part)))
+
+    async def _upload_part_in_background(self, part_number: int, part: bytes):
+        try:
+            url = self.s3_client.generate_presigned_url(
+                'upload_part', Params={'Bucket': self.bucket, 'Key': self.key, 'UploadId': self._upload_id,
+                                       'PartNumber': part_number},
+                ExpiresIn=S3_PRESIGNED_URL_EXPIRY_SECONDS)
+            # boto3 retries failed requests itself, aiohttp does not
+            for attempt in range(1, S3_PART_UPLOAD_ATTEMPTS + 1):
+                try:
+                    async with self.http_session.put(url, data=part) as response:
+                        response.raise_for_status()
+                        self._parts.append({'PartNumber': part_number, 'ETag': response.headers['ETag']})
+                        return
+                except aiohttp.ClientError:
+                    if attempt == S3_PART_UPLOAD_ATTEMPTS:
+                        raise
+                    await asyncio.sleep(attempt)
+        finally:
+            self._slots.release()
@@ -0,0 +1,149 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import salesforce_prototype_app.utilities.app_environment as app_env
+
+S3_MIN_PART_SIZE_MB = 5  # S3 rejects multipart uploads where any part except the last is smaller than 5 MiB
+S3_DEFAULT_PART_SIZE_MB = 8
+S3_DEFAULT_MAX_CONCURRENCY = 4
+
+
+class S3MultipartWriter:
+    """
+    A write-only binary file object that uploads to S3 as a multipart upload while it is being written.
+
+    Data is buffered in memory until a part is full, then the part is uploaded on a background thread while writing
+    continues.  At most max_concurrency parts are uploaded at once - write() blocks when that limit is reached - so
+    memory use is bounded by roughly (max_concurrency + 1) * part size, however much data is written.
+
+    The upload is completed by close() (or leaving a with block normally) and aborted if an error occurs, so a
+    partially written object never appears in the bucket.
+    """
+
+    def __init__(self, s3_client, bucket: str, key: str, part_size_mb: int = None, max_concurrency: int = None):
+        """
+        Start a multipart upload.
+
+        Parameters
+        ----------
+        s3_client : S3.Client
+            The boto3 S3 client used to upload the parts.
+        bucket : str
+            The name of the S3 bucket.
+        key : str
+            The key of the object to create.
+        part_size_mb : int
+            The size of each part in MiB, minimum 5.  Defaults to CRUK_AWS_S3_UPLOAD_PART_SIZE_MB, or 8 if not set.
+        max_concurrency : int
+            The maximum number of parts uploaded at once.  Defaults to CRUK_AWS_S3_UPLOAD_MAX_CONCURRENCY, or 4 if
+            not set.
+        """
+        if part_size_mb is None:
+            part_size_mb = app_env.get_int_env_var_value(app_env.EnvironmentVariableNames.AWS_S3_UPLOAD_PART_SIZE_MB,
+                                                         S3_DEFAULT_PART_SIZE_MB)
+        if max_concurrency is None:
+            max_concurrency = app_env.get_int_env_var_value(
+                app_env.EnvironmentVariableNames.AWS_S3_UPLOAD_MAX_CONCURRENCY, S3_DEFAULT_MAX_CONCURRENCY)
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size_mb, S3_MIN_PART_SIZE_MB) * 1024 * 1024
+        self.bytes_written = 0
+        self.start_time = time.perf_counter()
+        self.first_part_time = None
+        self.closed = False
+        self._buffer = bytearray()
+        self._parts = []
+        self._futures = []
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        response = s3_client.create_multipart_upload(Bucket=bucket, Key=key)
+        self._upload_id = response['UploadId']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.bytes_written
+
+    def flush(self):
+        pass
+
+    def write(self, data) -> int:
+        """
+        Buffer data, uploading a part each time the buffer reaches the part size.
+        """
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._upload_part(part)
+        return len(data)
+
+    def close(self):
+        """
+        Upload the remaining buffered data as the last part, then complete the multipart upload.
+        """
+        if self.closed:
+            return
+        try:
+            # an upload needs at least one part, even if the object is empty
+            if len(self._buffer) > 0 or len(self._futures) == 0:
+                self._upload_part(bytes(self._buffer))
+                self._buffer = bytearray()
+            for future in self._futures:
+                future.result()
+            self._executor.shutdown()
+            self._parts.sort(key=lambda part: part['PartNumber'])
+            self.s3_client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                                     MultipartUpload={'Parts': self._parts})
+            self.closed = True
+        except Exception:
+            self.abort()
+            raise
+
+    def abort(self):
+        """
+        Abort the multipart upload, discarding any parts already uploaded.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self._executor.shutdown(cancel_futures=True)
+        self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+
+    @property
+    def time_to_first_byte(self) -> float:
+        """
+        The number of seconds from creating the writer until the first part started uploading, or None.
+        """
+        return self.first_part_time - self.start_time if self.first_part_time is not None else None
+
+    def _upload_part(self, part: bytes):
+        # fail fast (rather than buffering more data) if an earlier part has already failed
+        for future in self._futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+        self._slots.acquire()
+        if self.first_part_time is None:
+            self.first_part_time = time.perf_counter()
+        part_number = len(self._futures) + 1
+        self._futures.append(self._executor.submit(self._upload_part_in_background, part_number, part))
+
+    def _upload_part_in_background(self, part_number: int, part: bytes):
+        try:
+            response = self.s3_client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                                  PartNumber=part_number, Body=part)
+            self._parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+        finally:
+            self._slots.release()
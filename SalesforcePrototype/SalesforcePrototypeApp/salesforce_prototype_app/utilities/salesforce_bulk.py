@@ -0,0 +1,146 @@
+import csv
+import io
+import queue
+import threading
+import time
+from simple_salesforce.exceptions import SalesforceExpiredSession
+
+BULK_RESULTS_MAX_RECORDS = 50000
+BULK_POLL_INITIAL_SECONDS = 1
+BULK_POLL_MAX_SECONDS = 10
+BULK_PREFETCH_PAGES = 2
+
+
+def query_salesforce_bulk(sf, soql):
+    """
+    Run a SOQL query using the Salesforce Bulk API 2.0 and yield the rows.
+
+    Parameters
+    ----------
+    sf : Salesforce
+        A connection to Salesforce.
+    soql : str
+        The SOQL query to run.
+
+    Returns
+    -------
+    Iterator[dict]
+        A generator that yields a dictionary for each row.
+    """
+    yield from query_bulk_api(sf.session, sf.base_url, sf.session_id, soql)
+
+
+def query_bulk_api(session, base_url: str, session_id: str, soql: str):
+    """
+    Submit a Bulk API 2.0 query job, wait for it to complete, then yield the rows from the result set.
+
+    The result set is paged using the Sforce-Locator header.  Each locator is only known once the previous page has
+    been received, so the pages are requested one after another, but the next page is downloaded on a background
+    thread while the rows of the current page are being parsed and yielded.
+
+    Parameters
+    ----------
+    session : requests.Session
+        The HTTP session used to call Salesforce.
+    base_url : str
+        The base URL of the Salesforce REST API, e.g. https://xyz.my.salesforce.com/services/data/v52.0/
+    session_id : str
+        The Salesforce session ID (access token).
+    soql : str
+        The SOQL query to run.
+
+    Returns
+    -------
+    Iterator[dict]
+        A generator that yields a dictionary for each row.  Empty CSV values are returned as None.
+    """
+    headers = {'Authorization': 'Bearer ' + session_id, 'Content-Type': 'application/json'}
+    job_id = create_bulk_query_job(session, base_url, headers, soql)
+    wait_for_bulk_query_job(session, base_url, headers, job_id)
+
+    pages = queue.Queue(maxsize=BULK_PREFETCH_PAGES)
+    downloader = threading.Thread(target=download_bulk_query_results,
+                                  args=(session, base_url, headers, job_id, pages), daemon=True)
+    downloader.start()
+    while True:
+        page = pages.get()
+        if page is None:
+            break
+        if isinstance(page, Exception):
+            raise page
+        for row in csv.DictReader(io.StringIO(page)):
+            yield {name: (value if value != '' else None) for name, value in row.items()}
+    downloader.join()
+
+
+def raise_for_salesforce_status(response, resource_name: str = 'jobs/query'):
+    # raise an invalid session (INVALID_SESSION_ID) as simple_salesforce does, so it is handled as for the REST engine
+    if response.status_code == 401:
+        raise SalesforceExpiredSession(response.url, response.status_code, resource_name, response.content)
+    response.raise_for_status()
+
+
+def create_bulk_query_job(session, base_url: str, headers: dict, soql: str) -> str:
+    """
+    Create a Bulk API 2.0 query job.
+
+    Returns
+    -------
+    str
+        The ID of the job.
+    """
+    body = {'operation': 'query', 'query': soql, 'contentType': 'CSV', 'columnDelimiter': 'COMMA', 'lineEnding': 'LF'}
+    response = session.post(f'{base_url}jobs/query', json=body, headers=headers)
+    raise_for_salesforce_status(response)
+    job_id = response.json()['id']
+    print(f'Bulk API query job {job_id} created')
+    return job_id
+
+
+def wait_for_bulk_query_job(session, base_url: str, headers: dict, job_id: str):
+    """
+    Poll a Bulk API 2.0 query job until it has finished, backing off between polls.
+
+    Raises
+    ------
+    RuntimeError
+        If the job fails or is aborted.
+    """
+    poll_seconds = BULK_POLL_INITIAL_SECONDS
+    while True:
+        response = session.get(f'{base_url}jobs/query/{job_id}', headers=headers)
+        raise_for_salesforce_status(response)
+        job = response.json()
+        state = job['state']
+        if state == 'JobComplete':
+            print(f'Bulk API query job {job_id} complete, {job.get("numberRecordsProcessed")} records')
+            return
+        if state in ('Failed', 'Aborted'):
+            raise RuntimeError(f'Bulk API query job {job_id} ended with state {state}: {job.get("errorMessage")}')
+        time.sleep(poll_seconds)
+        poll_seconds = min(poll_seconds * 2, BULK_POLL_MAX_SECONDS)
+
+
+def download_bulk_query_results(session, base_url: str, headers: dict, job_id: str, pages: queue.Queue):
+    """
+    Download every page of the results of a Bulk API 2.0 query job onto a queue.
+
+    The queue is bounded, so the download stays at most BULK_PREFETCH_PAGES pages ahead of the consumer.  None is put
+    on the queue after the last page, or an exception if a download fails.
+    """
+    try:
+        locator = None
+        while True:
+            params = {'maxRecords': BULK_RESULTS_MAX_RECORDS}
+            if locator is not None:
+                params['locator'] = locator
+            response = session.get(f'{base_url}jobs/query/{job_id}/results', params=params, headers=headers)
+            raise_for_salesforce_status(response)
+            response.encoding = 'utf-8'
+            pages.put(response.text)
+            locator = response.headers.get('Sforce-Locator')
+            if locator is None or locator == 'null':
+                break
+        pages.put(None)
+    except Exception as ex:
+        pages.put(ex)
@@ -0,0 +1,83 @@
+from salesforce_prototype_app.utilities.get_connections import get_salesforce
+from salesforce_prototype_app.utilities.entity_load_plan import EntityLoadPlan
+from salesforce_prototype_app.utilities.run_metrics import StageMetrics
+from salesforce_prototype_app.utilities.salesforce_poc import write_target_rows_s3
+from salesforce_prototype_app.utilities.snowflake_query_coordinator import get_query_coordinator
+from salesforce_prototype_app.utilities.snowflake_watermark import get_deletes_high_water_mark, \
+    set_deletes_high_water_mark
+from salesforce_prototype_app.utilities.staging_files import release_staged_files
+from salesforce_prototype_app.utilities.tracing import span
+from datetime import datetime, timedelta, timezone
+
+# getDeleted only accepts a start date within the last 30 days
+# https://developer.salesforce.com/docs/atlas.en-us.api_rest.meta/api_rest/resources_getdeleted.htm
+GET_DELETED_MAX_DAYS = 29
+
+
+def capture_salesforce_deletes(load_plan: EntityLoadPlan, sf=None, stage_metrics: StageMetrics = None) -> int:
+    """
+    Mark the rows of an entity's model table that have been deleted in Salesforce since the last capture as deleted.
+
+    The Ids deleted since the deletes high water mark are read with the getDeleted resource, which only returns the
+    Ids and deletion dates, rather than a queryAll of IsDeleted rows, which would scan the whole entity.  They are
+    staged as one JSON file and applied with a single UPDATE, so the model table is never anti-joined in full.
+
+    Parameters
+    ----------
+    load_plan : EntityLoadPlan
+        The load plan of the entity.
+    sf : Salesforce
+        A connection to Salesforce.  If None, the connection of this process is used.
+    stage_metrics : StageMetrics
+        If specified, the number of rows marked as deleted and the query id of the UPDATE are added to it.
+
+    Returns
+    -------
+    int
+        The number of rows marked as deleted.
+    """
+    salesforce_entity_name = load_plan.entity_name
+    if sf is None:
+        sf = get_salesforce()
+
+    now = datetime.now(timezone.utc)
+    earliest_start = now - timedelta(days=GET_DELETED_MAX_DAYS)
+    start = get_deletes_high_water_mark(salesforce_entity_name)
+    if start is None or start < earliest_start:
+        if start is not None:
+            print(f'WARNING: the deletes of {salesforce_entity_name} were last captured up to {start.isoformat()}, '
+                  f'before the earliest date getDeleted accepts - deletes before {earliest_start.isoformat()} '
+                  f'are not captured')
+        start = earliest_start
+
+    with span('capture_salesforce_deletes', entity=salesforce_entity_name) as trace:
+        result = getattr(sf, salesforce_entity_name).deleted(start, now)
+        if result['earliestDateAvailable'] is not None and \
+                datetime.strptime(result['earliestDateAvailable'], '%Y-%m-%dT%H:%M:%S.%f%z') > start:
+            print(f'WARNING: {salesforce_entity_name} deletes are only available from '
+                  f'{result["earliestDateAvailable"]} - earlier deletes are not captured')
+        deleted_rows = [{'Id': record['id'], 'DeletedDate': record['deletedDate']}
+                        for record in result['deletedRecords']]
+        trace.set_attribute('deleted', len(deleted_rows))
+
+        rows_deleted = 0
+        if len(deleted_rows) > 0:
+            filenames = write_target_rows_s3(deleted_rows, salesforce_entity_name, file_suffix='_deleted')
+            query = get_query_coordinator().execute(load_plan.get_soft_delete_sql(filenames),
+                                                    entity_name=salesforce_entity_name, stage_name='deletes')
+            # the result of an UPDATE is one row holding the number of rows updated and the number multi-joined
+            rows_deleted = query.cursor.fetchone()[0]
+            trace.set_attribute('query_id', query.query_id)
+            if stage_metrics is not None:
+                stage_metrics.add_query_id(query.query_id)
+            release_staged_files(salesforce_entity_name, filenames)
+        trace.set_attribute('rows', rows_deleted)
+    if stage_metrics is not None:
+        stage_metrics.add_rows(rows_deleted)
+
+    # latestDateCovered is the end of the last whole minute Salesforce has processed deletes for, so the next capture
+    # starts from there rather than from now
+    set_deletes_high_water_mark(salesforce_entity_name, result['latestDateCovered'])
+    print(f'{rows_deleted} row(s) of {salesforce_entity_name} marked as deleted ({len(deleted_rows)} deleted in '
+          f'Salesforce since {start.isoformat()})')
+    return rows_deleted
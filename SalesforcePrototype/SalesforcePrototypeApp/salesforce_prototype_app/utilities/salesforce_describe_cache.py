@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+from email.utils import formatdate
+import salesforce_prototype_app.utilities.app_environment as app_env
+from salesforce_prototype_app.utilities.get_connections import get_salesforce, get_aws_client
+from salesforce_prototype_app.utilities.salesforce_bulk import raise_for_salesforce_status
+
+# alongside the local_only/config.ini used outside AWS
+LOCAL_DESCRIBE_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'local_only/describe_cache')
+S3_DESCRIBE_CACHE_PREFIX = 'describe_cache'
+
+_describe_cache = {}  # sobject name -> describe metadata, revalidated once per process
+_describe_cache_lock = threading.Lock()
+
+
+def get_sobject_describe(salesforce_entity_name: str, sf=None) -> dict:
+    """
+    Get the describe metadata of a Salesforce sobject (its fields, their types, etc.).
+
+    The metadata is cached in memory and persisted between runs, in S3 when CRUK_AWS_S3_BUCKET_NAME is set and on local
+    disk otherwise.  The first time an sobject is needed in a process, the persisted copy is revalidated with an
+    If-Modified-Since request, so it is only downloaded again if the sobject has changed.
+
+    Parameters
+    ----------
+    salesforce_entity_name : str
+        The name of the Salesforce sobject, e.g. Contact.
+    sf : Salesforce
+        A connection to Salesforce.  If None, a new connection is made if the metadata needs revalidating.
+
+    Returns
+    -------
+    dict
+        The describe metadata, as returned by the sobject describe REST resource.
+    """
+    with _describe_cache_lock:
+        describe = _describe_cache.get(salesforce_entity_name)
+        if describe is not None:
+            return describe
+
+        if sf is None:
+            sf = get_salesforce()
+        cached = load_persisted_describe(salesforce_entity_name)
+        headers = {'Authorization': 'Bearer ' + sf.session_id}
+        if cached is not None:
+            headers['If-Modified-Since'] = cached['last_modified']
+        url = f'{sf.base_url}sobjects/{salesforce_entity_name}/describe/'
+        response = sf.session.get(url, headers=headers)
+        if response.status_code == 304:
+            describe = cached['describe']
+        else:
+            raise_for_salesforce_status(response, f'sobjects/{salesforce_entity_name}/describe')
+            describe = response.json()
+            last_modified = response.headers.get('Last-Modified', formatdate(usegmt=True))
+            save_persisted_describe(salesforce_entity_name, {'last_modified': last_modified, 'describe': describe})
+            print(f'{salesforce_entity_name} describe metadata downloaded')
+
+        _describe_cache[salesforce_entity_name] = describe
+        return describe
+
+
+def get_describe_cache_bucket_name() -> str:
+    return app_env.get_env_var_value(app_env.EnvironmentVariableNames.AWS_S3_BUCKET_NAME)
+
+
+def load_persisted_describe(salesforce_entity_name: str) -> dict:
+    bucket = get_describe_cache_bucket_name()
+    if len(bucket) > 0:
+        s3 = get_aws_client('s3')
+        try:
+            response = s3.get_object(Bucket=bucket, Key=f'{S3_DESCRIBE_CACHE_PREFIX}/{salesforce_entity_name}.json')
+        except s3.exceptions.NoSuchKey:
+            return None
+        return json.loads(response['Body'].read())
+
+    path = os.path.join(LOCAL_DESCRIBE_CACHE_PATH, f'{salesforce_entity_name}.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='UTF8') as f:
+        return json.load(f)
+
+
+def save_persisted_describe(salesforce_entity_name: str, cached: dict):
+    bucket = get_describe_cache_bucket_name()
+    if len(bucket) > 0:
+        get_aws_client('s3').put_object(Bucket=bucket, Key=f'{S3_DESCRIBE_CACHE_PREFIX}/{salesforce_entity_name}.json',
+                                        Body=json.dumps(cached).encode('utf-8'))
+        return
+
+    os.makedirs(LOCAL_DESCRIBE_CACHE_PATH, exist_ok=True)
+    with open(os.path.join(LOCAL_DESCRIBE_CACHE_PATH, f'{salesforce_entity_name}.json'), 'w', encoding='UTF8') as f:
+        json.dump(cached, f)
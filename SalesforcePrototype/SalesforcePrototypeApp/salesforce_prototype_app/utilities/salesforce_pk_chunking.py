@@ -0,0 +1,81 @@
+import math
+
+# Salesforce IDs are base 62 numbers using these characters, which are in ASCII order, so two IDs of the same length
+# compare the same way as strings (as in SOQL) and as numbers
+SALESFORCE_ID_CHARACTERS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+SALESFORCE_ID_LENGTH = 15
+
+
+def salesforce_id_to_int(salesforce_id: str) -> int:
+    """
+    Convert a Salesforce ID to a number.  Only the case-sensitive 15 character part of an 18 character ID is used.
+    """
+    value = 0
+    for character in salesforce_id[:SALESFORCE_ID_LENGTH]:
+        value = value * 62 + SALESFORCE_ID_CHARACTERS.index(character)
+    return value
+
+
+def int_to_salesforce_id(value: int) -> str:
+    """
+    Convert a number to a 15 character Salesforce ID.
+    """
+    characters = []
+    for _ in range(SALESFORCE_ID_LENGTH):
+        value, remainder = divmod(value, 62)
+        characters.append(SALESFORCE_ID_CHARACTERS[remainder])
+    return ''.join(reversed(characters))
+
+
+def get_pk_chunk_ranges(sf, salesforce_entity_name: str, chunk_size: int, where_clause: str = None) -> list[tuple]:
+    """
+    Split a Salesforce entity into ranges of IDs (primary keys) so that the ranges can be extracted concurrently.
+
+    Only three small queries are run - the row count and the lowest and highest IDs.  The ID range between the lowest
+    and highest IDs is then split evenly, so the number of rows in each range is approximately (not exactly)
+    chunk_size, depending on how evenly the IDs were allocated.
+
+    Parameters
+    ----------
+    sf : Salesforce
+        A connection to Salesforce.
+    salesforce_entity_name : str
+        The name of the Salesforce entity.
+    chunk_size : int
+        The target number of rows in each range.
+    where_clause : str
+        An optional SOQL condition (without WHERE) restricting the rows to extract, e.g. for incremental loads.
+
+    Returns
+    -------
+    list[tuple]
+        A list of (start_id, end_id) tuples.  start_id is inclusive and end_id is exclusive.  The start_id of the first
+        range and the end_id of the last range are None, so no rows can be missed at either end.
+    """
+    soql_where = f' WHERE {where_clause}' if where_clause is not None else ''
+    row_count = sf.query(f'SELECT COUNT() FROM {salesforce_entity_name}{soql_where}')['totalSize']
+    chunk_count = math.ceil(row_count / chunk_size)
+    if chunk_count <= 1:
+        return [(None, None)]
+
+    first_id = sf.query(f'SELECT Id FROM {salesforce_entity_name}{soql_where} ORDER BY Id ASC LIMIT 1')['records'][0]['Id']
+    last_id = sf.query(f'SELECT Id FROM {salesforce_entity_name}{soql_where} ORDER BY Id DESC LIMIT 1')['records'][0]['Id']
+    first_value = salesforce_id_to_int(first_id)
+    last_value = salesforce_id_to_int(last_id)
+    step = math.ceil((last_value - first_value + 1) / chunk_count)
+    boundaries = [int_to_salesforce_id(first_value + step * n) for n in range(1, chunk_count)]
+    print(f'{salesforce_entity_name}: {row_count} rows split into {chunk_count} ID ranges')
+    return list(zip([None] + boundaries, boundaries + [None]))
+
+
+def get_pk_chunk_where_clause(id_range: tuple) -> str:
+    """
+    Get the SOQL condition (without WHERE) that selects the rows in an ID range, or None if the range is unbounded.
+    """
+    start_id, end_id = id_range
+    conditions = []
+    if start_id is not None:
+        conditions.append(f"Id >= '{start_id}'")
+    if end_id is not None:
+        conditions.append(f"Id < '{end_id}'")
+    return ' AND '.join(conditions) if len(conditions) > 0 else None
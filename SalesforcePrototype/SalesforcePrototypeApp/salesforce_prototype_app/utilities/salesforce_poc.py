@@ -1,10 +1,23 @@
 from salesforce_prototype_app.utilities.get_connections import get_salesforce, get_aws_client
 import salesforce_prototype_app.utilities.app_environment as app_env
 from salesforce_prototype_app.utilities.get_fieldnames import dict_of_lists
+from salesforce_prototype_app.utilities.json_encoders import get_row_encoder
+from salesforce_prototype_app.utilities.performance_stats import format_extract_stats
+from salesforce_prototype_app.utilities.salesforce_bulk import query_salesforce_bulk
+from salesforce_prototype_app.utilities.salesforce_pk_chunking import get_pk_chunk_ranges, get_pk_chunk_where_clause
+from salesforce_prototype_app.utilities.s3_multipart_writer import S3MultipartWriter
+from salesforce_prototype_app.utilities.parquet_staging import get_arrow_schema, write_parquet
+from salesforce_prototype_app.utilities.snowflake_config import ExtractEngines, StagingFormats
+from salesforce_prototype_app.utilities.staging_files import STAGING_BUCKET_NAME, get_staging_key
+from salesforce_prototype_app.utilities.tracing import span
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import gzip
-import json
-import os
+import itertools
+import time
+
+STAGING_FILE_DEFAULT_MAX_SIZE_MB = 200
+
 
 def salesforce_poc():
 
@@ -18,53 +31,355 @@ def salesforce_poc():
         print(row)
 
 
-def pull_salesforce_entity(salesforce_entity_name):
+def pull_salesforce_entity(salesforce_entity_name, extract_engine=ExtractEngines.REST, watermark_column=None,
+                           high_water_mark=None, id_range=None, sf=None, load_plan=None, page_position=None):
 
-    sf = get_salesforce()
-    objects = sf.describe()
+    if sf is None:
+        sf = get_salesforce()
 
- #   valid_contact_fields = ["Id", "AccountId", "Salutation", "FirstName", "LastName"]
-    valid_contact_fields = dict_of_lists(salesforce_entity_name)
+    if load_plan is not None:
+        valid_contact_fields_sql = load_plan.soql
+    else:
+     #   valid_contact_fields = ["Id", "AccountId", "Salutation", "FirstName", "LastName"]
+        valid_contact_fields = get_extract_field_names(salesforce_entity_name, watermark_column)
 
-    e= ', '.join(valid_contact_fields)
-    # valid_contact_fields_sql = f"SELECT {e} FROM Contact"
-    valid_contact_fields_sql = f"SELECT {e} FROM {salesforce_entity_name}"
+        e= ', '.join(valid_contact_fields)
+        # valid_contact_fields_sql = f"SELECT {e} FROM Contact"
+        valid_contact_fields_sql = f"SELECT {e} FROM {salesforce_entity_name}"
+    where_clauses = [clause for clause in (get_watermark_where_clause(watermark_column, high_water_mark),
+                                           get_pk_chunk_where_clause(id_range) if id_range is not None else None)
+                     if clause is not None]
+    if len(where_clauses) > 0:
+        valid_contact_fields_sql += " WHERE " + " AND ".join(where_clauses)
 
-    results = sf.query_all(valid_contact_fields_sql)
+    if extract_engine == ExtractEngines.BULK:
+        query_rows = query_salesforce_bulk
+    elif page_position is not None:
+        # the REST engine records (and can continue from) the page and row it has got to
+        def query_rows(sf, soql):
+            return query_salesforce_pages(sf, soql, page_position)
+    else:
+        query_rows = query_salesforce_pages
 
+    print(f"Yield for {salesforce_entity_name} has begun ({extract_engine.name} engine)")
+    start_time = time.perf_counter()
+    row_count = 0
+    # not attached, as the generator is suspended (and the span is not current) while each row is being written
+    with span('pull_salesforce_entity', attach=False, entity=salesforce_entity_name,
+              engine=extract_engine.name) as trace:
+        # salesforce_ms is the time spent waiting on Salesforce, rather than on writing the rows
+        for row in trace.time_iterator(query_rows(sf, valid_contact_fields_sql), 'salesforce_ms'):
+            row_count += 1
+            yield row
+        trace.set_attribute('rows', row_count)
 
-    rows = results['records']
-    for row in rows:
-        del row['attributes']
-    for row in rows:
+    print(format_extract_stats(salesforce_entity_name, row_count, start_time))
+
+
+def get_extract_field_names(salesforce_entity_name, watermark_column=None):
+    """
+    Get the names of the Salesforce fields to extract for an entity.
+    """
+    field_names = dict_of_lists(salesforce_entity_name)
+    # the watermark column is needed to work out the next high water mark, even if it is not loaded into Snowflake
+    if watermark_column is not None and watermark_column not in field_names:
+        field_names = field_names + [watermark_column]
+    return field_names
+
+
+def get_watermark_where_clause(watermark_column, high_water_mark):
+    """
+    Get the SOQL condition (without WHERE) that selects the rows at or after the high water mark, or None if there is
+    no high water mark.
+    """
+    if high_water_mark is None:
+        return None
+    return f"{watermark_column} >= {high_water_mark}"
+
+
+def pull_salesforce_entity_chunks_to_s3(salesforce_entity_name, pk_chunk_size, extract_engine=ExtractEngines.REST,
+                                        watermark_column=None, high_water_mark=None, watermark_tracker=None,
+                                        staging_format=StagingFormats.JSON, field_types=None, sf=None,
+                                        load_plan=None, stage_metrics=None, checkpoint=None):
+    """
+    Extract an entity as ranges of IDs (PK chunks) on concurrent threads, writing each chunk to its own file in S3.
+
+    Threads are used rather than processes because the extraction is dominated by waiting on Salesforce and S3, and
+    because the pool worker processes that call this function are not allowed to start processes of their own.
+
+    Parameters
+    ----------
+    salesforce_entity_name : str
+        The name of the Salesforce entity.
+    pk_chunk_size : int
+        The target number of rows in each chunk.
+    extract_engine : ExtractEngines
+        The engine used to extract each chunk.
+    watermark_column : str
+        For incremental loads, the Salesforce field used as the high water mark.
+    high_water_mark : str
+        For incremental loads, the high water mark as a SOQL datetime literal.
+    watermark_tracker : WatermarkTracker
+        For incremental loads, the tracker that records the highest watermark value across all chunks.
+    staging_format : StagingFormats
+        The format of the files written to S3.
+    field_types : dict[str, str]
+        For Parquet files, the names and Salesforce data types of the fields being extracted.
+    sf : Salesforce
+        A connection to Salesforce, shared by every chunk.  If None, a new connection is made.
+    load_plan : EntityLoadPlan
+        The load plan of the entity, whose SOQL is used to extract each chunk.
+    stage_metrics : StageMetrics
+        If specified, the rows and bytes written by every chunk are added to it.
+    checkpoint : EntityCheckpoint
+        If specified, the ID ranges and each finished chunk are recorded in it, and the chunks it already records
+        (from an interrupted run) are not extracted again.
+
+    Returns
+    -------
+    list[str]
+        The keys of the files written to S3, one or more per chunk.
+    """
+    if sf is None:
+        sf = get_salesforce()
+    if checkpoint is not None and checkpoint.id_ranges is not None:
+        # the same ranges as the interrupted run, as new rows could move the boundaries of freshly worked out ones
+        id_ranges = checkpoint.id_ranges
+    else:
+        id_ranges = get_pk_chunk_ranges(sf, salesforce_entity_name, pk_chunk_size,
+                                        get_watermark_where_clause(watermark_column, high_water_mark))
+        if checkpoint is not None:
+            checkpoint.update(id_ranges=id_ranges)
+    finished_chunk_filenames = dict(checkpoint.chunk_filenames) if checkpoint is not None else {}
+    chunk_numbers = [chunk_number for chunk_number in range(1, len(id_ranges) + 1)
+                     if chunk_number not in finished_chunk_filenames]
+    max_workers = max(1, min(len(chunk_numbers), get_extract_max_concurrency()))
+
+    def extract_chunk(chunk_number):
+        row_generator = pull_salesforce_entity(salesforce_entity_name, extract_engine, watermark_column,
+                                               high_water_mark, id_ranges[chunk_number - 1], sf, load_plan)
+        if watermark_tracker is not None:
+            row_generator = watermark_tracker.track(row_generator)
+        filenames = write_target_rows_s3(row_generator, salesforce_entity_name, staging_format, field_types,
+                                         f'_chunk{chunk_number:04d}', stage_metrics=stage_metrics)
+        if checkpoint is not None:
+            checkpoint.add_chunk(chunk_number, filenames,
+                                 watermark_tracker.max_value if watermark_tracker is not None else None)
+        return chunk_number, filenames
+
+    if len(finished_chunk_filenames) > 0:
+        print(f'{len(finished_chunk_filenames)} of {len(id_ranges)} chunks of {salesforce_entity_name} were extracted '
+              f'by the interrupted run')
+    print(f'Extracting {len(chunk_numbers)} chunks of {salesforce_entity_name} with {max_workers} threads')
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        finished_chunk_filenames.update(executor.map(extract_chunk, chunk_numbers))
+    return [filename for chunk_number in sorted(finished_chunk_filenames)
+            for filename in finished_chunk_filenames[chunk_number]]
+
+
+def get_extract_max_concurrency() -> int:
+    """
+    Get the maximum number of concurrent extraction threads per entity, from the ExtractMaxConcurrency parameter.
+    """
+    return app_env.get_int_env_var_value(app_env.EnvironmentVariableNames.EXTRACTMAXCONCURRENCY, 4)
+
+
+class PagePosition:
+    """
+    How far a paged REST query has got - the URL of the current page (None for the first) and the number of its rows
+    yielded - so that an interrupted extraction can continue from the last row it wrote.
+    """
+
+    def __init__(self, page_url: str = None, row_offset: int = 0):
+        self.page_url = page_url
+        self.row_offset = row_offset
+
+
+def query_salesforce_pages(sf, soql, page_position: PagePosition = None):
+    """
+    Run a SOQL query and yield the rows one page at a time.
+
+    Unlike sf.query_all(), only the current page of results is held in memory - the next page is requested (via
+    nextRecordsUrl) once every row in the current page has been yielded, so memory use is bounded by the page size
+    rather than by the size of the entity.
+
+    Parameters
+    ----------
+    sf : Salesforce
+        A connection to Salesforce.
+    soql : str
+        The SOQL query to run.
+    page_position : PagePosition
+        If specified, it is kept up to date as rows are yielded.  If it already has a page URL, the query continues
+        from that page and row rather than starting again - the page URL holds a query locator, which Salesforce
+        expires after about 15 minutes of inactivity.
+
+    Returns
+    -------
+    Iterator[dict]
+        A generator that yields a dictionary for each row, without the Salesforce 'attributes' entry.
+    """
+    if page_position is None:
+        results = sf.query(soql)
+        while True:
+            for row in results['records']:
+                del row['attributes']
+                yield row
+            if results['done']:
+                break
+            results = sf.query_more(results['nextRecordsUrl'], identifier_is_url=True)
+        return
+
+    if page_position.page_url is not None:
+        results = sf.query_more(page_position.page_url, identifier_is_url=True)
+    else:
+        results = sf.query(soql)
+        page_position.row_offset = 0
+    while True:
+        # the position is moved on before each row is yielded, so while the consumer is writing a row it includes it
+        for row_offset, row in enumerate(results['records'][page_position.row_offset:],
+                                         start=page_position.row_offset + 1):
+            del row['attributes']
+            page_position.row_offset = row_offset
+            yield row
+        if results['done']:
+            break
+        page_position.page_url = results['nextRecordsUrl']
+        page_position.row_offset = 0
+        results = sf.query_more(page_position.page_url, identifier_is_url=True)
+
+
+def write_target_rows_s3(row_generator, salesforce_entity_name, staging_format=StagingFormats.JSON, field_types=None,
+                         file_suffix='', max_file_size_mb=None, stage_metrics=None, on_file_written=None):
+    """
+    Write rows to one or more files in S3 in the specified staging format.
+
+    A new file is started each time the current file reaches max_file_size_mb (compressed), so a large entity is
+    staged as several files that Snowflake can load in parallel, rather than one file loaded by a single thread.
+
+    Parameters
+    ----------
+    row_generator : Iterator[dict]
+        The rows extracted from Salesforce.
+    salesforce_entity_name : str
+        The name of the Salesforce entity.
+    staging_format : StagingFormats
+        JSON (gzip-compressed NDJSON) or PARQUET.
+    field_types : dict[str, str]
+        For Parquet files, the names and Salesforce data types of the fields in the rows.
+    file_suffix : str
+        Appended to the filenames, to keep the names of files written concurrently for the same entity unique.
+    max_file_size_mb : int
+        The size in MiB at which a new file is started.  Defaults to CRUK_AWS_S3_STAGING_FILE_MAX_SIZE_MB, or 200 if
+        not set.
+    stage_metrics : StageMetrics
+        If specified, the rows and bytes (before and after compression) written to each file are added to it.
+    on_file_written : Callable[[str], None]
+        If specified, called with the key of each file once it has been written, before the next row is read - e.g.
+        to checkpoint the extraction.
+
+    Returns
+    -------
+    list[str]
+        The keys of the files written to S3 (under an entity/date prefix), in the order they were written.  At least
+        one file is always written, even if there are no rows.
+    """
+    if max_file_size_mb is None:
+        max_file_size_mb = app_env.get_int_env_var_value(
+            app_env.EnvironmentVariableNames.AWS_S3_STAGING_FILE_MAX_SIZE_MB, STAGING_FILE_DEFAULT_MAX_SIZE_MB)
+    max_file_bytes = max_file_size_mb * 1024 * 1024
+
+    row_iterator = iter(row_generator)
+    filenames = []
+    while True:
+        # look ahead one row, so a file is only started if there is something to put in it
+        first_rows = list(itertools.islice(row_iterator, 1))
+        if len(first_rows) == 0 and len(filenames) > 0:
+            break
+        file_rows = itertools.chain(first_rows, row_iterator)
+        part_suffix = f'{file_suffix}_{len(filenames) + 1:04d}'
+        if staging_format == StagingFormats.PARQUET:
+            filename = write_target_rows_parquet_s3(file_rows, salesforce_entity_name, field_types, part_suffix,
+                                                    max_file_bytes, stage_metrics)
+        else:
+            filename = write_target_rows_yield_json_s3(file_rows, salesforce_entity_name, part_suffix, max_file_bytes,
+                                                       stage_metrics)
+        filenames.append(filename)
+        if on_file_written is not None:
+            on_file_written(filename)
+        if len(first_rows) == 0:
+            break
+    return filenames
+
+
+def iterate_rows_until_size(row_generator, file_object, max_file_bytes=None):
+    """
+    Yield rows until the file they are being written to reaches max_file_bytes, leaving the rest in row_generator.
+    """
+    for row in row_generator:
         yield row
+        if max_file_bytes is not None and file_object.tell() >= max_file_bytes:
+            return
 
-    print(f"Yield for {salesforce_entity_name} has begun")
 
-def write_target_rows_yield_json_s3(row_generator, salesforce_entity_name):
+def write_target_rows_yield_json_s3(row_generator, salesforce_entity_name, file_suffix='', max_file_bytes=None,
+                                    stage_metrics=None):
     dt = datetime.now()
     formatted_date = datetime.strftime(dt, '%Y%m%d%H%M%S')
     #filename = f'Contact_{formatted_date}.json.gz'
-    filename = f'{salesforce_entity_name}_{formatted_date}.json.gz'
+    # file_suffix keeps the names of files written concurrently for the same entity (e.g. PK chunks) unique
+    filename = f'{salesforce_entity_name}_{formatted_date}{file_suffix}.json.gz'
+
+    s3 = get_aws_client('s3')
+    bucket = STAGING_BUCKET_NAME
+    # the entity/date prefix keeps each day's files together, and COPY INTO loads the exact keys
+    key = get_staging_key(salesforce_entity_name, filename)
 
+    # rows are compressed and uploaded as they are extracted - nothing is written to local disk
+    # each row is serialised once, as one line of newline-delimited JSON
+    encode_row = get_row_encoder()
+    row_count = 0
+    with span('write_target_rows_yield_json_s3', entity=salesforce_entity_name, file=filename) as trace:
+        with S3MultipartWriter(s3, bucket, key) as s3_file:
+            with gzip.GzipFile(fileobj=s3_file, mode='wb') as f:
+                # the compressed size is checked, as that is what Snowflake splits its loading work by
+                for row_values in iterate_rows_until_size(row_generator, s3_file, max_file_bytes):
+                    f.write(encode_row(row_values))
+                    row_count += 1
+        trace.set_attribute('rows', row_count)
+        trace.set_attribute('bytes_raw', f.size)
+        trace.set_attribute('bytes_compressed', s3_file.bytes_written)
+    if stage_metrics is not None:
+        # GzipFile.size is the number of bytes written before compression
+        stage_metrics.add_rows(row_count, f.size, s3_file.bytes_written)
 
-    with gzip.open(filename, mode='wt', encoding='UTF8', newline='') as f:
-        for idx, row_values in enumerate(row_generator, 1):
-            json.dump(json.dumps(row_values, default=str), f)
-            f.write("\n")
+    ttfb_text = f'{s3_file.time_to_first_byte:.1f} sec' if s3_file.time_to_first_byte is not None else 'n/a'
+    print(f'{filename} uploaded ({s3_file.bytes_written} bytes, time to first byte {ttfb_text}, '
+          f'total {time.perf_counter() - s3_file.start_time:.1f} sec)')
+
+    return key
+
+
+def write_target_rows_parquet_s3(row_generator, salesforce_entity_name, field_types, file_suffix='',
+                                 max_file_bytes=None, stage_metrics=None):
+    formatted_date = datetime.strftime(datetime.now(), '%Y%m%d%H%M%S')
+    filename = f'{salesforce_entity_name}_{formatted_date}{file_suffix}.parquet'
 
     s3 = get_aws_client('s3')
-    bucket = 'ageorge-dev-salesforce-prototype'
-    prefix = f'{salesforce_entity_name}'
-    key = f'{prefix}/{filename}'
-    s3.upload_file(Filename=filename, Bucket=bucket, Key=key)
-
-    print(f'{filename} uploaded')
-    # remove the file if created locally (if created via AWS it gets removed when the container is destroyed at the end
-    # of the ELT so not actions required?
-    if app_env.is_running_in_aws():
-        pass
-    else:
-        os.remove(filename)
+    bucket = STAGING_BUCKET_NAME
+    key = get_staging_key(salesforce_entity_name, filename)
+
+    # the column types come from the entity's fields, so Snowflake does not have to parse every row
+    schema = get_arrow_schema(field_types)
+    with S3MultipartWriter(s3, bucket, key) as s3_file:
+        # the size only grows as each row group is written, so a file can exceed max_file_bytes by up to a row group
+        row_count, bytes_raw = write_parquet(iterate_rows_until_size(row_generator, s3_file, max_file_bytes), schema,
+                                             s3_file)
+    if stage_metrics is not None:
+        stage_metrics.add_rows(row_count, bytes_raw, s3_file.bytes_written)
+
+    ttfb_text = f'{s3_file.time_to_first_byte:.1f} sec' if s3_file.time_to_first_byte is not None else 'n/a'
+    print(f'{filename} uploaded ({s3_file.bytes_written} bytes, time to first byte {ttfb_text}, '
+          f'total {time.perf_counter() - s3_file.start_time:.1f} sec)')
 
-    return filename
+    return key
@@ -0,0 +1,162 @@
+import json
+import os
+import time
+from enum import Enum
+import salesforce_prototype_app.utilities.app_environment as app_env
+# imported as a module (not from ... import) because get_connections also imports this module
+import salesforce_prototype_app.utilities.get_connections as get_connections
+
+# Salesforce does not say when an access token expires - it lasts for the session timeout of the connected app's
+# profile (two hours by default), extended while it is in use - so a cached token is checked with one API call before
+# it is reused, and this age (the longest session timeout Salesforce allows) only skips tokens that cannot be valid
+SALESFORCE_TOKEN_DEFAULT_MAX_AGE_SECONDS = 24 * 60 * 60
+# alongside the local_only/config.ini used outside AWS
+LOCAL_TOKEN_FILE_DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                             'local_only/salesforce_token.json')
+
+
+class SalesforceTokenStores(Enum):
+    """
+    The supported places to cache the Salesforce access token between runs.
+    """
+    NONE = 1,
+    FILE = 2,
+    SSM = 3,
+    SECRETS_MANAGER = 4
+
+
+class SalesforceToken:
+    """
+    A Salesforce access token (session id) and the instance it was issued for.
+    """
+
+    def __init__(self, session_id: str, instance: str, issued_at: float = None):
+        """
+        Parameters
+        ----------
+        session_id : str
+            The access token.
+        instance : str
+            The Salesforce instance the token was issued for, e.g. mydomain.my.salesforce.com
+        issued_at : float
+            When the token was issued, in seconds since the epoch.  Defaults to now.
+        """
+        self.session_id = session_id
+        self.instance = instance
+        self.issued_at = issued_at if issued_at is not None else time.time()
+
+    def is_expired(self, max_age_seconds: int) -> bool:
+        return time.time() - self.issued_at >= max_age_seconds
+
+    def to_json(self) -> str:
+        return json.dumps({'session_id': self.session_id, 'instance': self.instance, 'issued_at': self.issued_at})
+
+    @staticmethod
+    def from_json(token_json: str):
+        token = json.loads(token_json)
+        return SalesforceToken(token['session_id'], token['instance'], token['issued_at'])
+
+
+class LocalFileTokenStore:
+    """
+    Caches the Salesforce access token in a local file, for development outside AWS.
+    """
+
+    def __init__(self, path: str = LOCAL_TOKEN_FILE_DEFAULT_PATH):
+        self.path = path
+
+    def load(self) -> SalesforceToken:
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, encoding='UTF8') as f:
+            return SalesforceToken.from_json(f.read())
+
+    def save(self, token: SalesforceToken):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # the token grants access to Salesforce, so only the current user may read the file
+        with open(os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w', encoding='UTF8') as f:
+            f.write(token.to_json())
+
+
+class SsmTokenStore:
+    """
+    Caches the Salesforce access token in a Systems Manager Parameter Store SecureString parameter.
+    """
+
+    def __init__(self, parameter_name: str):
+        self.parameter_name = parameter_name
+
+    def load(self) -> SalesforceToken:
+        client = get_connections.get_aws_client('ssm')
+        try:
+            response = client.get_parameter(Name=self.parameter_name, WithDecryption=True)
+        except client.exceptions.ParameterNotFound:
+            return None
+        return SalesforceToken.from_json(response['Parameter']['Value'])
+
+    def save(self, token: SalesforceToken):
+        client = get_connections.get_aws_client('ssm')
+        client.put_parameter(Name=self.parameter_name, Value=token.to_json(), Type='SecureString', Overwrite=True)
+
+
+class SecretsManagerTokenStore:
+    """
+    Caches the Salesforce access token in a Secrets Manager secret, which must already exist.
+    """
+
+    def __init__(self, secret_name: str):
+        self.secret_name = secret_name
+
+    def load(self) -> SalesforceToken:
+        # read directly rather than through secrets_provider, as the token changes more often than the cache TTL
+        client = get_connections.get_aws_client('secretsmanager')
+        try:
+            response = client.get_secret_value(SecretId=self.secret_name)
+        except client.exceptions.ResourceNotFoundException:
+            return None
+        return SalesforceToken.from_json(response['SecretString'])
+
+    def save(self, token: SalesforceToken):
+        client = get_connections.get_aws_client('secretsmanager')
+        client.put_secret_value(SecretId=self.secret_name, SecretString=token.to_json())
+
+
+def get_salesforce_token_store():
+    """
+    Get the store used to cache the Salesforce access token between runs.
+
+    The store is read from CRUK_SALESFORCE_TOKEN_STORE (NONE, FILE, SSM or SECRETS_MANAGER) and the name of the file,
+    parameter or secret from CRUK_SALESFORCE_TOKEN_STORE_NAME.  If the store is not set, SSM is used in AWS when
+    CRUK_SALESFORCE_TOKEN_STORE_NAME is set, and a local file is used outside AWS.
+
+    Returns
+    -------
+    LocalFileTokenStore | SsmTokenStore | SecretsManagerTokenStore
+        The token store, or None if tokens are not cached.
+    """
+    store_name = app_env.get_env_var_value(app_env.EnvironmentVariableNames.SALESFORCE_TOKEN_STORE_NAME)
+    token_store = app_env.get_env_var_value(app_env.EnvironmentVariableNames.SALESFORCE_TOKEN_STORE).upper()
+    if len(token_store) == 0:
+        if app_env.is_running_in_aws():
+            token_store = SalesforceTokenStores.SSM.name if len(store_name) > 0 else SalesforceTokenStores.NONE.name
+        else:
+            token_store = SalesforceTokenStores.FILE.name
+    token_store_values = [e.name for e in SalesforceTokenStores]
+    if token_store not in token_store_values:
+        raise ValueError(token_store + ' is not a valid Salesforce token store.')
+
+    token_store = SalesforceTokenStores[token_store]
+    if token_store == SalesforceTokenStores.FILE:
+        return LocalFileTokenStore(store_name) if len(store_name) > 0 else LocalFileTokenStore()
+    if token_store in (SalesforceTokenStores.SSM, SalesforceTokenStores.SECRETS_MANAGER) and len(store_name) == 0:
+        raise ValueError(f'CRUK_SALESFORCE_TOKEN_STORE_NAME must be set to use the {token_store.name} token store.')
+    if token_store == SalesforceTokenStores.SSM:
+        return SsmTokenStore(store_name)
+    if token_store == SalesforceTokenStores.SECRETS_MANAGER:
+        return SecretsManagerTokenStore(store_name)
+    return None
+
+
+def get_salesforce_token_max_age_seconds() -> int:
+    return app_env.get_int_env_var_value(app_env.EnvironmentVariableNames.SALESFORCE_TOKEN_MAX_AGE_SECONDS,
+                                         SALESFORCE_TOKEN_DEFAULT_MAX_AGE_SECONDS)
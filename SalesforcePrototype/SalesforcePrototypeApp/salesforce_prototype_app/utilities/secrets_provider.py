@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from aws_secretsmanager_caching import SecretCache, SecretCacheConfig
+import salesforce_prototype_app.utilities.app_environment as app_env
+# imported as a module (not from ... import) because get_connections also imports this module
+import salesforce_prototype_app.utilities.get_connections as get_connections
+
+SECRET_CACHE_DEFAULT_TTL_SECONDS = 3600
+
+_secret_caches = {}  # process id -> SecretCache, as a boto3 client must not be shared with a forked process
+_secret_caches_lock = threading.Lock()
+# secret name -> (secret string, time read), read once by the main process and passed to the pool workers
+_prefetched_secrets = {}
+
+
+def get_secret_cache() -> SecretCache:
+    """
+    Get the Secrets Manager cache of the current process, creating it if necessary.
+
+    Secrets are looked up by name (so no list_secrets call is needed) and are kept for
+    CRUK_SECRETS_CACHE_TTL_SECONDS (default one hour) before being read from Secrets Manager again.
+    """
+    with _secret_caches_lock:
+        secret_cache = _secret_caches.get(os.getpid())
+        if secret_cache is None:
+            secret_cache = SecretCache(config=SecretCacheConfig(secret_refresh_interval=get_secret_cache_ttl_seconds()),
+                                       client=get_connections.get_aws_client('secretsmanager'))
+            _secret_caches[os.getpid()] = secret_cache
+        return secret_cache
+
+
+def get_secret_cache_ttl_seconds() -> int:
+    return app_env.get_int_env_var_value(app_env.EnvironmentVariableNames.SECRETS_CACHE_TTL_SECONDS,
+                                         SECRET_CACHE_DEFAULT_TTL_SECONDS)
+
+
+def refresh_secrets():
+    """
+    Discard every cached secret in the current process, so they are read from Secrets Manager when next used.
+
+    Call this when authentication fails, in case the credentials have been rotated since they were cached.
+    """
+    with _secret_caches_lock:
+        _secret_caches.pop(os.getpid(), None)
+        _prefetched_secrets.clear()
+
+
+def get_secret_string(secret_name: str, force_refresh: bool = False) -> str:
+    """
+    Get the value of a secret from the cache, reading it from Secrets Manager if it is not cached or has expired.
+
+    Parameters
+    ----------
+    secret_name : str
+        The name (or ARN) of the secret.
+    force_refresh : bool
+        If True, the cached secrets are discarded first.
+
+    Returns
+    -------
+    str
+        The secret string.
+    """
+    if force_refresh:
+        refresh_secrets()
+    prefetched_secret = _prefetched_secrets.get(secret_name)
+    if prefetched_secret is not None and time.time() - prefetched_secret[1] < get_secret_cache_ttl_seconds():
+        return prefetched_secret[0]
+    return get_secret_cache().get_secret_string(secret_name)
+
+
+def get_secret_dict(secret_name: str, force_refresh: bool = False) -> dict:
+    """
+    Get the value of a secret that is stored as a JSON object.
+    """
+    return json.loads(get_secret_string(secret_name, force_refresh))
+
+
+def prefetch_secrets(secret_names: list[str]) -> dict:
+    """
+    Read several secrets concurrently, e.g. at startup so that the first logins do not wait on them.
+
+    The secrets are kept for this process, and returned so they can be passed to pool worker processes with
+    init_prefetched_secrets() - the SecretCache is per process, so a worker would otherwise read every secret again.
+
+    Returns
+    -------
+    dict
+        The secrets read, to pass to init_prefetched_secrets().
+    """
+    secret_cache = get_secret_cache()
+    read_time = time.time()
+    with ThreadPoolExecutor(max_workers=max(len(secret_names), 1)) as executor:
+        secret_strings = list(executor.map(secret_cache.get_secret_string, secret_names))
+    secrets = {secret_name: (secret_string, read_time)
+               for secret_name, secret_string in zip(secret_names, secret_strings)}
+    init_prefetched_secrets(secrets)
+    return secrets
+
+
+def init_prefetched_secrets(secrets: dict):
+    """
+    Use secrets read by another process, e.g. the main process, until they are older than the cache TTL.  This is
+    called by the initializer of the multiprocessing pool in main.py.
+
+    Parameters
+    ----------
+    secrets : dict
+        The secrets returned by prefetch_secrets().
+    """
+    _prefetched_secrets.update(secrets)
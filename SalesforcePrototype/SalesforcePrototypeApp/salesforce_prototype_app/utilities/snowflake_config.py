@@ -1,21 +1,162 @@
-from salesforce_prototype_app.utilities.rsa_tools import get_user_secret_from_aws, get_snowflake_rsa_keys_connection
+from salesforce_prototype_app.utilities.snowflake_connection_pool import get_snowflake_connection
+from enum import Enum
 
 
+class ExtractEngines(Enum):
+    """
+    The supported ways of extracting rows from Salesforce.
+    """
+    REST = 1,
+    BULK = 2
+
+
+class LoadTypes(Enum):
+    """
+    The supported ways of loading an entity - every row, or only the rows changed since the last run.
+    """
+    FULL = 1,
+    INCREMENTAL = 2
+
+
+class StagingFormats(Enum):
+    """
+    The supported formats of the files staged in S3 for loading into Snowflake.
+    """
+    JSON = 1,
+    PARQUET = 2
+
+
+class LoadPaths(Enum):
+    """
+    The supported ways of getting staged files into the model table.
+    """
+    LOADING_TABLE = 1,  # TRUNCATE and COPY INTO the SALESFORCE_LOAD table, then MERGE from it - useful for debugging
+    STAGE = 2  # a single MERGE that selects from the staged files
+
+
+class SalesforceEntityConfig:
+    """
+    The configuration of one Salesforce entity, as read from the SALESFORCE_LOAD.CONFIG table in Snowflake.
+    """
+
+    def __init__(self, entity_name: str, extract_engine: ExtractEngines | str = ExtractEngines.REST,
+                 load_type: LoadTypes | str = LoadTypes.FULL, watermark_column: str = 'SystemModstamp',
+                 full_refresh: bool = False, pk_chunk_size: int = None,
+                 staging_format: StagingFormats | str = StagingFormats.JSON, select_columns: list[str] | str = None,
+                 primary_key_column: str = 'Id', load_path: LoadPaths | str = LoadPaths.LOADING_TABLE,
+                 capture_deletes: bool = False):
+        """
+        Create the configuration of one Salesforce entity.
+
+        Parameters
+        ----------
+        entity_name : str
+            The name of the entity in Salesforce, e.g. Contact.
+        extract_engine : ExtractEngines
+            The engine used to extract the entity from Salesforce, REST (the default) or BULK.
+        load_type : LoadTypes
+            FULL (the default) to extract every row, or INCREMENTAL to extract only the rows where watermark_column
+            is at or after the high water mark recorded by the previous run.
+        watermark_column : str
+            The Salesforce field used as the high water mark for incremental loads, e.g. SystemModstamp or
+            LastModifiedDate.
+        full_refresh : bool
+            True to extract every row of an INCREMENTAL entity in this run, ignoring (but still advancing) the high
+            water mark.
+        pk_chunk_size : int
+            If specified, the entity is split into ranges of IDs of approximately this many rows, which are extracted
+            concurrently, each to its own file.  If None (the default) the entity is extracted in one piece.
+        staging_format : StagingFormats
+            The format of the files staged in S3, JSON (the default, gzip-compressed NDJSON) or PARQUET.
+        select_columns : list[str]
+            The Salesforce fields loaded into Snowflake, as a list or a comma-separated string.  If None, the
+            fields listed in get_fieldnames are used.
+        primary_key_column : str
+            The Salesforce field that uniquely identifies each row, used to MERGE into the model table.
+        load_path : LoadPaths
+            LOADING_TABLE (the default) to COPY the staged files into the loading table and MERGE from there, or STAGE
+            to MERGE directly from the staged files, saving the TRUNCATE and COPY INTO.
+        capture_deletes : bool
+            True to mark the rows of the model table that have been deleted in Salesforce since the last run as
+            deleted (IS_DELETED), using the Salesforce getDeleted resource.
+        """
+        self.entity_name = entity_name
+        if type(extract_engine) is str:
+            engine_values = [e.name for e in ExtractEngines]
+            if extract_engine not in engine_values:
+                raise ValueError(extract_engine + ' is not a valid extract engine.')
+            extract_engine = ExtractEngines[extract_engine]
+        self.extract_engine = extract_engine
+        if type(load_type) is str:
+            load_type_values = [e.name for e in LoadTypes]
+            if load_type not in load_type_values:
+                raise ValueError(load_type + ' is not a valid load type.')
+            load_type = LoadTypes[load_type]
+        self.load_type = load_type
+        self.watermark_column = watermark_column
+        self.full_refresh = full_refresh
+        self.pk_chunk_size = pk_chunk_size
+        if type(staging_format) is str:
+            staging_format_values = [e.name for e in StagingFormats]
+            if staging_format not in staging_format_values:
+                raise ValueError(staging_format + ' is not a valid staging format.')
+            staging_format = StagingFormats[staging_format]
+        self.staging_format = staging_format
+        if type(select_columns) is str:
+            select_columns = [column.strip() for column in select_columns.split(',') if len(column.strip()) > 0]
+        self.select_columns = select_columns
+        self.primary_key_column = primary_key_column
+        if type(load_path) is str:
+            load_path_values = [e.name for e in LoadPaths]
+            if load_path not in load_path_values:
+                raise ValueError(load_path + ' is not a valid load path.')
+            load_path = LoadPaths[load_path]
+        self.load_path = load_path
+        self.capture_deletes = capture_deletes
+
+    @property
+    def is_incremental(self) -> bool:
+        """
+        Is the entity loaded incrementally, i.e. is a high water mark recorded for it?
+        """
+        return self.load_type == LoadTypes.INCREMENTAL
+
 
 def get_valid_salesforce_entities():
-    secret_dict = get_user_secret_from_aws()
-    # connect to snowflake as service user and read Snowflake version
-    con = get_snowflake_rsa_keys_connection(secret_dict)
+    con = get_snowflake_connection()
     cursor = con.cursor()
     sql_query = f"SELECT ENTITY_NAME FROM DEV_AG_SALESFORCE.SALESFORCE_LOAD.CONFIG WHERE PROCESS_FLAG ='Y'"
     cursor.execute(sql_query)
     valid_entities = cursor.fetchall()
 
 
-    con.close()
    # print(column_names)
     # print(valid_entities[0])
     # return valid_entities[0]
     return valid_entities
 
 
+def get_salesforce_entity_configs() -> list[SalesforceEntityConfig]:
+    """
+    Get the configuration of each Salesforce entity that is flagged for processing in the SALESFORCE_LOAD.CONFIG table.
+
+    Returns
+    -------
+    list[SalesforceEntityConfig]
+        The configuration of each entity to process.
+    """
+    con = get_snowflake_connection()
+    cursor = con.cursor()
+    sql_query = "SELECT ENTITY_NAME, UPPER(COALESCE(EXTRACT_ENGINE, 'REST')), UPPER(COALESCE(LOAD_TYPE, 'FULL')), " \
+                "COALESCE(WATERMARK_COLUMN, 'SystemModstamp'), PK_CHUNK_SIZE, UPPER(COALESCE(STAGING_FORMAT, 'JSON')), " \
+                "SELECT_COLUMNS, COALESCE(PRIMARY_KEY_COLUMN, 'Id'), UPPER(COALESCE(LOAD_PATH, 'LOADING_TABLE')), " \
+                "COALESCE(CAPTURE_DELETES, FALSE) " \
+                "FROM DEV_AG_SALESFORCE.SALESFORCE_LOAD.CONFIG WHERE PROCESS_FLAG ='Y'"
+    cursor.execute(sql_query)
+    entity_configs = [SalesforceEntityConfig(entity_name, extract_engine, load_type, watermark_column,
+                                             pk_chunk_size=pk_chunk_size, staging_format=staging_format,
+                                             select_columns=select_columns, primary_key_column=primary_key_column,
+                                             load_path=load_path, capture_deletes=capture_deletes)
+                      for entity_name, extract_engine, load_type, watermark_column, pk_chunk_size, staging_format,
+                      select_columns, primary_key_column, load_path, capture_deletes in cursor.fetchall()]
+    return entity_configs
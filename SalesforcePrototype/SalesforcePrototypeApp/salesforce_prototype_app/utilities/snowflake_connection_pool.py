@@ -0,0 +1,124 @@
+import multiprocessing.util
+import os
+import threading
+import time
+import snowflake.connector
+from salesforce_prototype_app.utilities.rsa_tools import get_user_secret_from_aws, get_snowflake_rsa_keys_connection, \
+    SNOWFLAKE_USE_ROLE_NAME, SNOWFLAKE_WAREHOUSE
+
+# a connection that has been idle for longer than this is checked with a round trip to Snowflake before it is reused
+SNOWFLAKE_IDLE_CHECK_SECONDS = 60
+
+_connections = {}  # (process id, role, warehouse, database) -> [connection, time last handed out]
+_connections_lock = threading.Lock()
+_metrics = {}  # process id -> metrics, as a forked worker process starts with a copy of its parent's
+_finalizer_pids = set()
+
+
+def get_snowflake_connection(role: str = SNOWFLAKE_USE_ROLE_NAME, warehouse: str = SNOWFLAKE_WAREHOUSE,
+                             database: str = None):
+    """
+    Get a warm connection to Snowflake for the current process, logging in (with the service user's RSA key) only if
+    there is no healthy connection already open for the same role, warehouse and database.
+
+    Connections are kept per process, so pool worker processes never share a socket with their parent.  They are
+    closed when the process exits, so callers must not close them.
+
+    Parameters
+    ----------
+    role : str
+        The Snowflake role to use.
+    warehouse : str
+        The Snowflake warehouse to use.
+    database : str
+        The Snowflake database to use, or None if every object is referenced by its fully qualified name.
+
+    Returns
+    -------
+    snowflake.connector.SnowflakeConnection
+        An open connection.
+    """
+    key = (os.getpid(), role, warehouse, database)
+    with _connections_lock:
+        metrics = get_process_metrics()
+        entry = _connections.get(key)
+        if entry is not None:
+            if is_connection_healthy(entry[0], time.monotonic() - entry[1]):
+                entry[1] = time.monotonic()
+                metrics['reuses'] += 1
+                return entry[0]
+            metrics['reconnects'] += 1
+            close_connection(entry[0])
+            del _connections[key]
+
+        if key[0] not in _finalizer_pids:
+            # unlike atexit, multiprocessing finalizers also run when a pool worker process exits
+            multiprocessing.util.Finalize(None, close_snowflake_connections, exitpriority=10)
+            _finalizer_pids.add(key[0])
+        start_time = time.perf_counter()
+        try:
+            con = get_snowflake_rsa_keys_connection(get_user_secret_from_aws(), role, warehouse, database)
+        except snowflake.connector.errors.DatabaseError:
+            # the key pair may have been rotated since the secret was cached, so read it again and retry once
+            con = get_snowflake_rsa_keys_connection(get_user_secret_from_aws(force_refresh=True), role, warehouse,
+                                                    database)
+        metrics['logins'] += 1
+        metrics['login_seconds'] += time.perf_counter() - start_time
+        _connections[key] = [con, time.monotonic()]
+        return con
+
+
+def get_process_metrics() -> dict:
+    return _metrics.setdefault(os.getpid(), {'logins': 0, 'login_seconds': 0.0, 'reuses': 0, 'reconnects': 0})
+
+
+def is_connection_healthy(con, idle_seconds: float) -> bool:
+    if con.is_closed():
+        return False
+    if idle_seconds < SNOWFLAKE_IDLE_CHECK_SECONDS:
+        return True
+    try:
+        con.cursor().execute('SELECT 1').fetchone()
+        return True
+    except snowflake.connector.errors.Error:
+        return False
+
+
+def close_connection(con):
+    try:
+        con.close()
+    except snowflake.connector.errors.Error:
+        pass  # the connection is being discarded, so a failure to log out cleanly does not matter
+
+
+def close_snowflake_connections():
+    """
+    Close every connection opened by the current process.
+    """
+    with _connections_lock:
+        for key in [key for key in _connections if key[0] == os.getpid()]:
+            close_connection(_connections.pop(key)[0])
+
+
+def get_connection_pool_metrics() -> dict:
+    """
+    Get the connection pool metrics of the current process.
+
+    Returns
+    -------
+    dict
+        open_connections, logins (the number of times a connection was opened), login_seconds (the total time spent
+        logging in), reuses (the number of times a warm connection was handed out) and reconnects (the number of
+        unhealthy connections that were replaced).
+    """
+    with _connections_lock:
+        open_connections = len([key for key in _connections if key[0] == os.getpid()])
+        return dict(get_process_metrics(), open_connections=open_connections)
+
+
+def format_connection_pool_stats() -> str:
+    metrics = get_connection_pool_metrics()
+    average_login_seconds = metrics['login_seconds'] / metrics['logins'] if metrics['logins'] > 0 else 0.0
+    return f"Snowflake connections: {metrics['open_connections']} open, {metrics['logins']} logins " \
+           f"(average {average_login_seconds:.2f} sec), {metrics['reuses']} reuses, " \
+           f"{metrics['reconnects']} reconnects"
@@ -1,37 +1,41 @@
-from salesforce_prototype_app.utilities.rsa_tools import get_user_secret_from_aws, get_snowflake_rsa_keys_connection
-from salesforce_prototype_app.utilities.get_fieldnames import dict_of_lists
-
-
-def mergeinto_snowflake(salesforce_entity_name):
-    secret_dict = get_user_secret_from_aws()
-    # connect to snowflake as service user and read Snowflake version
-    con = get_snowflake_rsa_keys_connection(secret_dict)
-    cursor = con.cursor()
-
-    print(f'Merging {salesforce_entity_name} into Snowflake')
-
-    column_names = dict_of_lists(salesforce_entity_name)
-    snowflake_when_matched = ''
-    snowflake_when_notmatched = ''
-    snowflake_values = ''
-    for x, col_name in enumerate(column_names):
-
-        snowflake_when_matched += f'd.{col_name} = s.{col_name}, '
-        snowflake_when_notmatched += f'{col_name}, '
-        snowflake_values += f's.{col_name}, '
-
-    snowflake_when_matched = snowflake_when_matched[:-2]
-    snowflake_when_notmatched = snowflake_when_notmatched[:-2]
-    snowflake_values = snowflake_values[:-2]
-
-#TODO code reliant on primary key being called "ID" - this should be passed as a variable/lookup/list etc
-
-    sql = f"MERGE INTO DEV_AG_SALESFORCE.SALESFORCE_MODEL.SALESFORCE_{salesforce_entity_name} d" \
-          f" USING DEV_AG_SALESFORCE.SALESFORCE_LOAD.SALESFORCE_{salesforce_entity_name} s ON d.ID = s.ID " \
-          f"WHEN MATCHED THEN UPDATE SET {snowflake_when_matched} " \
-          f"WHEN NOT MATCHED THEN INSERT ({snowflake_when_notmatched} )" \
-          f"VALUES ({snowflake_values});"
-
-    cursor.execute(sql)
-
-    print(f'{salesforce_entity_name} has been merged into Snowflake')
+from salesforce_prototype_app.utilities.snowflake_query_coordinator import get_query_coordinator
+from salesforce_prototype_app.utilities.entity_load_plan import EntityLoadPlan
+from salesforce_prototype_app.utilities.snowflake_config import StagingFormats
+from salesforce_prototype_app.utilities.run_metrics import StageMetrics
+from salesforce_prototype_app.utilities.tracing import span
+
+
+def mergeinto_snowflake(load_plan: EntityLoadPlan, stage_metrics: StageMetrics = None, filenames: list[str] = None,
+                        staging_format=StagingFormats.JSON) -> int:
+    """
+    Merge an entity into its model table, from the loading table or, if filenames are given, directly from those
+    staged files.
+
+    Returns
+    -------
+    int
+        The number of rows inserted or updated.
+    """
+    salesforce_entity_name = load_plan.entity_name
+
+    if filenames is None:
+        print(f'Merging {salesforce_entity_name} into Snowflake')
+        # the MERGE statement (matching on the entity's configured primary key) is built once, with the load plan
+        merge_sql = load_plan.merge_sql
+    else:
+        print(f'Merging {len(filenames)} {staging_format.name} file(s) of {salesforce_entity_name} into Snowflake')
+        merge_sql = load_plan.get_stage_merge_sql(filenames, staging_format)
+
+    with span('mergeinto_snowflake', entity=salesforce_entity_name, from_stage=filenames is not None) as trace:
+        # submitted asynchronously, so other entities' statements share the session while this one runs
+        query = get_query_coordinator().execute(merge_sql, entity_name=salesforce_entity_name, stage_name='merge')
+        # the result of a MERGE is one row holding the number of rows inserted and the number updated
+        rows_merged = sum(query.cursor.fetchone() or ())
+        trace.set_attribute('query_id', query.query_id)
+        trace.set_attribute('rows', rows_merged)
+    if stage_metrics is not None:
+        stage_metrics.add_query_id(query.query_id)
+        stage_metrics.add_rows(rows_merged)
+
+    print(f'{salesforce_entity_name} has been merged into Snowflake ({rows_merged} rows inserted or changed)')
+    return rows_merged
@@ -0,0 +1,196 @@
+import os
+import threading
+import time
+from salesforce_prototype_app.utilities.snowflake_connection_pool import get_snowflake_connection
+
+QUERY_POLL_INITIAL_SECONDS = 0.1
+QUERY_POLL_MAX_SECONDS = 2
+
+_coordinators = {}  # process id -> SnowflakeQueryCoordinator, as a connection must not be shared with a forked process
+_coordinators_lock = threading.Lock()
+
+
+class SnowflakeQuery:
+    """
+    A statement submitted to Snowflake with execute_async, and its outcome once it has finished.
+    """
+
+    def __init__(self, query_id: str, connection, sql: str, entity_name: str = None, stage_name: str = None):
+        """
+        Parameters
+        ----------
+        query_id : str
+            The Snowflake query id.
+        connection : SnowflakeConnection
+            The connection the statement was submitted on, which is used to poll its status.
+        sql : str
+            The statement.
+        entity_name : str
+            The name of the Salesforce entity the statement is for, used when reporting.
+        stage_name : str
+            The ELT stage the statement is part of, e.g. copy, used when reporting.
+        """
+        self.query_id = query_id
+        self.connection = connection
+        self.sql = sql
+        self.entity_name = entity_name
+        self.stage_name = stage_name
+        self.status = 'RUNNING'
+        self.error = None
+        self.cursor = None  # holds the results once the statement has succeeded
+        self.submitted_time = time.perf_counter()
+        self.finished_time = None
+
+    @property
+    def is_done(self) -> bool:
+        return self.finished_time is not None
+
+    @property
+    def seconds(self) -> float:
+        """
+        The time from submitting the statement until it was seen to have finished, including time spent queued.
+        """
+        return (self.finished_time if self.finished_time is not None else time.perf_counter()) - self.submitted_time
+
+
+class SnowflakeQueryCoordinator:
+    """
+    Runs statements with the connector's asynchronous query support, so one session can have statements for many
+    entities in flight at once - each statement is submitted with execute_async and its query id is polled until it
+    finishes, rather than a connection being blocked for the length of the statement.
+
+    Every statement is recorded, so their status, errors and timings can be reported centrally for the run.  Once an
+    entity's statements have been reported they can be forgotten, so a long-lived worker only keeps their counts.
+    """
+
+    def __init__(self):
+        self.queries = []
+        self.forgotten_count = 0
+        self.forgotten_failed_count = 0
+        self._lock = threading.Lock()
+
+    def submit(self, sql: str, params=None, entity_name: str = None, stage_name: str = None) -> SnowflakeQuery:
+        """
+        Submit a statement without waiting for it to finish.
+
+        Returns
+        -------
+        SnowflakeQuery
+            The submitted statement, to pass to wait() or wait_all().
+        """
+        connection = get_snowflake_connection()
+        cursor = connection.cursor()
+        cursor.execute_async(sql, params)
+        query = SnowflakeQuery(cursor.sfqid, connection, sql, entity_name, stage_name)
+        with self._lock:
+            self.queries.append(query)
+        return query
+
+    def wait(self, query: SnowflakeQuery) -> SnowflakeQuery:
+        """
+        Wait for a statement to finish, polling its status with a backoff.
+
+        Returns
+        -------
+        SnowflakeQuery
+            The statement, whose cursor holds its results.
+
+        Raises
+        ------
+        snowflake.connector.errors.ProgrammingError
+            If the statement failed.
+        """
+        poll_seconds = QUERY_POLL_INITIAL_SECONDS
+        while not self.poll(query):
+            time.sleep(poll_seconds)
+            poll_seconds = min(poll_seconds * 2, QUERY_POLL_MAX_SECONDS)
+        if query.error is not None:
+            raise query.error
+        return query
+
+    def wait_all(self, queries: list[SnowflakeQuery]) -> list[SnowflakeQuery]:
+        """
+        Wait for several statements to finish, polling them all from this thread.  Unlike wait(), a failed statement
+        does not raise an exception - check the status and error of each statement.
+        """
+        poll_seconds = QUERY_POLL_INITIAL_SECONDS
+        while not all([self.poll(query) for query in queries]):
+            time.sleep(poll_seconds)
+            poll_seconds = min(poll_seconds * 2, QUERY_POLL_MAX_SECONDS)
+        return queries
+
+    def execute(self, sql: str, params=None, entity_name: str = None, stage_name: str = None) -> SnowflakeQuery:
+        """
+        Submit a statement and wait for it to finish.  Statements run this way from several threads are all in
+        flight on the same session at once.
+        """
+        return self.wait(self.submit(sql, params, entity_name, stage_name))
+
+    @staticmethod
+    def poll(query: SnowflakeQuery) -> bool:
+        """
+        Check whether a statement has finished, recording its outcome if it has.
+        """
+        if query.is_done:
+            return True
+        try:
+            status = query.connection.get_query_status_throw_if_error(query.query_id)
+        except Exception as e:
+            query.status = 'FAILED'
+            query.error = e
+            query.finished_time = time.perf_counter()
+            print(f'Snowflake query {query.query_id} ({query.entity_name} {query.stage_name}) failed: {e!r}')
+            return True
+        if query.connection.is_still_running(status):
+            return False
+        query.status = status.name
+        query.cursor = query.connection.cursor()
+        query.cursor.get_results_from_sfqid(query.query_id)
+        query.finished_time = time.perf_counter()
+        return True
+
+    def forget_entity_queries(self, entity_name: str):
+        """
+        Stop recording the finished statements of an entity, once they have been reported.  They are still counted by
+        format_stats().
+        """
+        with self._lock:
+            forgotten = [query for query in self.queries if query.entity_name == entity_name and query.is_done]
+            self.queries = [query for query in self.queries if query.entity_name != entity_name or not query.is_done]
+            self.forgotten_count += len(forgotten)
+            self.forgotten_failed_count += len([query for query in forgotten if query.error is not None])
+
+    def format_stats(self, entity_name: str = None) -> str:
+        """
+        Describe the statements run by this process - their entity, stage, query id, status and time taken.
+
+        Parameters
+        ----------
+        entity_name : str
+            If specified, only the statements of this entity are described.  Otherwise the statements already
+            forgotten are included in the counts.
+        """
+        with self._lock:
+            queries = [query for query in self.queries if entity_name is None or query.entity_name == entity_name]
+            submitted_count = len(queries) + (self.forgotten_count if entity_name is None else 0)
+            failed_count = len([query for query in queries if query.error is not None]) \
+                + (self.forgotten_failed_count if entity_name is None else 0)
+        lines = [f'Snowflake queries (pid {os.getpid()}{", " + entity_name if entity_name is not None else ""}): '
+                 f'{submitted_count} submitted, {failed_count} failed']
+        for query in queries:
+            lines.append(f'  {query.entity_name or "":<30} {query.stage_name or "":<8} {query.query_id} '
+                         f'{query.status:<10} {query.seconds:.1f} sec'
+                         + (f' {query.error!r}' if query.error is not None else ''))
+        return '\n'.join(lines)
+
+
+def get_query_coordinator() -> SnowflakeQueryCoordinator:
+    """
+    Get the query coordinator of the current process, creating it if necessary.
+    """
+    with _coordinators_lock:
+        coordinator = _coordinators.get(os.getpid())
+        if coordinator is None:
+            coordinator = SnowflakeQueryCoordinator()
+            _coordinators[os.getpid()] = coordinator
+        return coordinator
@@ -0,0 +1,147 @@
+from salesforce_prototype_app.utilities.snowflake_connection_pool import get_snowflake_connection
+from datetime import datetime, timezone
+import threading
+
+
+class WatermarkTracker:
+    """
+    Tracks the highest value of the watermark column in the rows extracted for an entity.
+    """
+
+    def __init__(self, watermark_column: str):
+        """
+        Create a tracker for the specified watermark column.
+
+        Parameters
+        ----------
+        watermark_column : str
+            The Salesforce field used as the high water mark, e.g. SystemModstamp.
+        """
+        self.watermark_column = watermark_column
+        self.max_value = None
+        self.lock = threading.Lock()
+
+    def track(self, row_generator):
+        """
+        Pass rows through unchanged, recording the highest watermark value seen.
+
+        Salesforce returns datetimes in a fixed-width UTC format, so the values can be compared as strings.  The same
+        tracker can track several row generators on different threads (e.g. PK chunks of one entity).  The highest
+        value is recorded as it rises (which, after the first rows, is rare), so it covers every row yielded so far,
+        e.g. for a checkpoint.
+
+        Parameters
+        ----------
+        row_generator : Iterator[dict]
+            The rows extracted from Salesforce.
+
+        Returns
+        -------
+        Iterator[dict]
+            The same rows.
+        """
+        max_value = None
+        for row in row_generator:
+            value = row.get(self.watermark_column)
+            if value is not None and (max_value is None or value > max_value):
+                max_value = value
+                with self.lock:
+                    if self.max_value is None or max_value > self.max_value:
+                        self.max_value = max_value
+            yield row
+
+
+def get_high_water_mark(salesforce_entity_name: str) -> str:
+    """
+    Get the high water mark recorded for an entity by the last successful incremental load.
+
+    Parameters
+    ----------
+    salesforce_entity_name : str
+        The name of the Salesforce entity.
+
+    Returns
+    -------
+    str
+        The high water mark formatted as a SOQL datetime literal, or None if no high water mark has been recorded.
+    """
+    con = get_snowflake_connection()
+    cursor = con.cursor()
+    sql = "SELECT HIGH_WATER_MARK FROM DEV_AG_SALESFORCE.SALESFORCE_LOAD.WATERMARK " \
+          "WHERE ENTITY_NAME = %(entity_name)s"
+    cursor.execute(sql, {'entity_name': salesforce_entity_name})
+    row = cursor.fetchone()
+    if row is None or row[0] is None:
+        return None
+    # SOQL datetime literals are unquoted; whole seconds are used so the next load starts at (not after) the mark
+    return row[0].astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def set_high_water_mark(salesforce_entity_name: str, watermark_column: str, high_water_mark: str):
+    """
+    Record the high water mark for an entity.  This should only be called once the MERGE for the entity has succeeded.
+
+    Parameters
+    ----------
+    salesforce_entity_name : str
+        The name of the Salesforce entity.
+    watermark_column : str
+        The Salesforce field used as the high water mark, e.g. SystemModstamp.
+    high_water_mark : str
+        The highest value of the watermark column in the rows that were loaded, as returned by Salesforce,
+        e.g. 2023-01-31T17:45:12.000+0000
+    """
+    mark = datetime.strptime(high_water_mark, '%Y-%m-%dT%H:%M:%S.%f%z')
+    con = get_snowflake_connection()
+    cursor = con.cursor()
+    sql = "MERGE INTO DEV_AG_SALESFORCE.SALESFORCE_LOAD.WATERMARK d" \
+          " USING (SELECT %(entity_name)s AS ENTITY_NAME, %(watermark_column)s AS WATERMARK_COLUMN," \
+          " %(high_water_mark)s::TIMESTAMP_TZ AS HIGH_WATER_MARK) s ON d.ENTITY_NAME = s.ENTITY_NAME" \
+          " WHEN MATCHED THEN UPDATE SET d.WATERMARK_COLUMN = s.WATERMARK_COLUMN," \
+          " d.HIGH_WATER_MARK = s.HIGH_WATER_MARK, d.UPDATED_AT = CURRENT_TIMESTAMP()" \
+          " WHEN NOT MATCHED THEN INSERT (ENTITY_NAME, WATERMARK_COLUMN, HIGH_WATER_MARK, UPDATED_AT)" \
+          " VALUES (s.ENTITY_NAME, s.WATERMARK_COLUMN, s.HIGH_WATER_MARK, CURRENT_TIMESTAMP());"
+    cursor.execute(sql, {'entity_name': salesforce_entity_name, 'watermark_column': watermark_column,
+                         'high_water_mark': mark.isoformat()})
+    print(f'{salesforce_entity_name} high water mark set to {high_water_mark}')
+
+
+def get_deletes_high_water_mark(salesforce_entity_name: str) -> datetime:
+    """
+    Get the time up to which the deletes of an entity have been captured, or None if they never have been.
+    """
+    con = get_snowflake_connection()
+    cursor = con.cursor()
+    sql = "SELECT DELETES_HIGH_WATER_MARK FROM DEV_AG_SALESFORCE.SALESFORCE_LOAD.WATERMARK " \
+          "WHERE ENTITY_NAME = %(entity_name)s"
+    cursor.execute(sql, {'entity_name': salesforce_entity_name})
+    row = cursor.fetchone()
+    if row is None or row[0] is None:
+        return None
+    return row[0].astimezone(timezone.utc)
+
+
+def set_deletes_high_water_mark(salesforce_entity_name: str, deletes_high_water_mark: str):
+    """
+    Record the time up to which the deletes of an entity have been captured.  This should only be called once the
+    deletes have been applied to the model table.
+
+    Parameters
+    ----------
+    salesforce_entity_name : str
+        The name of the Salesforce entity.
+    deletes_high_water_mark : str
+        The latestDateCovered returned by the Salesforce getDeleted resource, e.g. 2023-01-31T17:45:00.000+0000
+    """
+    mark = datetime.strptime(deletes_high_water_mark, '%Y-%m-%dT%H:%M:%S.%f%z')
+    con = get_snowflake_connection()
+    cursor = con.cursor()
+    sql = "MERGE INTO DEV_AG_SALESFORCE.SALESFORCE_LOAD.WATERMARK d" \
+          " USING (SELECT %(entity_name)s AS ENTITY_NAME," \
+          " %(deletes_high_water_mark)s::TIMESTAMP_TZ AS DELETES_HIGH_WATER_MARK) s ON d.ENTITY_NAME = s.ENTITY_NAME" \
+          " WHEN MATCHED THEN UPDATE SET d.DELETES_HIGH_WATER_MARK = s.DELETES_HIGH_WATER_MARK," \
+          " d.UPDATED_AT = CURRENT_TIMESTAMP()" \
+          " WHEN NOT MATCHED THEN INSERT (ENTITY_NAME, DELETES_HIGH_WATER_MARK, UPDATED_AT)" \
+          " VALUES (s.ENTITY_NAME, s.DELETES_HIGH_WATER_MARK, CURRENT_TIMESTAMP());"
+    cursor.execute(sql, {'entity_name': salesforce_entity_name, 'deletes_high_water_mark': mark.isoformat()})
+    print(f'{salesforce_entity_name} deletes high water mark set to {deletes_high_water_mark}')
@@ -0,0 +1,57 @@
+from datetime import datetime
+import salesforce_prototype_app.utilities.app_environment as app_env
+from salesforce_prototype_app.utilities.get_connections import get_aws_client
+
+# the bucket behind @SALESFORCE_LOAD.S3_STAGE (see migration 004)
+STAGING_BUCKET_NAME = 'ageorge-dev-salesforce-prototype'
+ARCHIVE_PREFIX = 'archive'
+S3_DELETE_OBJECTS_MAX_KEYS = 1000
+
+
+def get_staging_key(salesforce_entity_name: str, filename: str) -> str:
+    """
+    Get the S3 key (which is also the path relative to the stage) of a staging file, under an entity/date prefix,
+    e.g. Contact/2023/01/31/Contact_20230131174512_0001.json.gz
+    """
+    return f'{salesforce_entity_name}/{datetime.now().strftime("%Y/%m/%d")}/{filename}'
+
+
+def is_delete_data_files() -> bool:
+    """
+    Should staging files be deleted once they have been loaded (CRUK_DELETE_DATA_FILES = Y), rather than archived?
+    """
+    return app_env.get_env_var_value(app_env.EnvironmentVariableNames.DELETE_DATA_FILES).upper() == 'Y'
+
+
+def release_staged_files(salesforce_entity_name: str, keys: list[str]):
+    """
+    Delete or archive the staging files of an entity once they have been loaded into Snowflake.
+
+    Files are deleted if CRUK_DELETE_DATA_FILES is Y, otherwise they are moved under the archive/ prefix, where they
+    are kept until the bucket's lifecycle rule expires them.  Either way the entity prefixes only hold files that
+    have not been loaded.  A failure is reported rather than raised, as the data has already been loaded.
+
+    Parameters
+    ----------
+    salesforce_entity_name : str
+        The name of the Salesforce entity, used when reporting.
+    keys : list[str]
+        The S3 keys of the files.
+    """
+    s3 = get_aws_client('s3')
+    try:
+        if not is_delete_data_files():
+            for key in keys:
+                s3.copy_object(Bucket=STAGING_BUCKET_NAME, Key=f'{ARCHIVE_PREFIX}/{key}',
+                               CopySource={'Bucket': STAGING_BUCKET_NAME, 'Key': key})
+        for start in range(0, len(keys), S3_DELETE_OBJECTS_MAX_KEYS):
+            response = s3.delete_objects(Bucket=STAGING_BUCKET_NAME, Delete={
+                'Objects': [{'Key': key} for key in keys[start:start + S3_DELETE_OBJECTS_MAX_KEYS]], 'Quiet': True})
+            if len(response.get('Errors', [])) > 0:
+                raise RuntimeError(f'{len(response["Errors"])} file(s) could not be deleted, e.g. '
+                                   f'{response["Errors"][0]["Key"]}: {response["Errors"][0]["Message"]}')
+    except Exception as e:
+        print(f'Releasing the staging files of {salesforce_entity_name} failed: {e!r}')
+        return
+    print(f'{len(keys)} staging file(s) of {salesforce_entity_name} '
+          f'{"deleted" if is_delete_data_files() else "archived"}')
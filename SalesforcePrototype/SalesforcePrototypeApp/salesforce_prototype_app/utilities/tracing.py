@@ -0,0 +1,203 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from enum import Enum
+import salesforce_prototype_app.utilities.app_environment as app_env
+
+# alongside the local_only/config.ini used outside AWS
+LOCAL_TRACE_FILE_DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'local_only/traces.jsonl')
+EMF_DEFAULT_NAMESPACE = 'SalesforcePrototype'
+# span attributes published as CloudWatch metrics, and their units - every other attribute is only logged
+EMF_METRIC_UNITS = {
+    'duration_ms': 'Milliseconds',
+    'rows': 'Count',
+    'bytes_raw': 'Bytes',
+    'bytes_compressed': 'Bytes',
+    'salesforce_ms': 'Milliseconds'
+}
+EMF_DIMENSION_NAMES = ['span_name', 'entity']
+
+
+class TracingExporters(Enum):
+    """
+    The supported places to export tracing spans to.
+    """
+    NONE = 1,
+    FILE = 2,  # one JSON object per line in a local file, for development
+    EMF = 3  # CloudWatch Embedded Metric Format lines on stdout, which the awslogs driver sends to CloudWatch Logs
+
+
+_exporter = None  # resolved from CRUK_TRACING_EXPORTER the first time a span is started
+_exporter_lock = threading.Lock()
+_trace_id = uuid.uuid4().hex
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """
+    A timed operation, e.g. extracting an entity, with attributes such as the number of rows.  Use span() to start
+    one, rather than creating it directly.
+    """
+
+    is_recording = True
+
+    def __init__(self, name: str, attributes: dict, attach: bool):
+        parent = _current_span.get()
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.status = 'ok'
+        self._attach = attach
+        self._token = None
+        self._start_time = None
+        self._start_perf_counter = None
+
+    def __enter__(self):
+        self._start_time = time.time()
+        self._start_perf_counter = time.perf_counter()
+        if self._attach:
+            self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration_ms = (time.perf_counter() - self._start_perf_counter) * 1000
+        if self._token is not None:
+            _current_span.reset(self._token)
+        if exc_type is not None:
+            self.status = 'error'
+            self.attributes['error'] = exc_type.__name__
+        export_span({'trace_id': _trace_id, 'span_id': self.span_id, 'parent_id': self.parent_id,
+                     'span_name': self.name, 'start_time': self._start_time, 'duration_ms': duration_ms,
+                     'status': self.status, 'pid': os.getpid(), **self.attributes})
+
+    def set_attribute(self, name: str, value):
+        self.attributes[name] = value
+
+    def add_to_attribute(self, name: str, value):
+        self.attributes[name] = self.attributes.get(name, 0) + value
+
+    def time_iterator(self, iterator, attribute_name: str):
+        """
+        Yield the items of an iterator, adding the milliseconds spent waiting for each one to an attribute - e.g. to
+        separate the time spent paging through Salesforce from the time spent writing the rows.
+        """
+        iterator = iter(iterator)
+        while True:
+            start_perf_counter = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_to_attribute(attribute_name, (time.perf_counter() - start_perf_counter) * 1000)
+                return
+            self.add_to_attribute(attribute_name, (time.perf_counter() - start_perf_counter) * 1000)
+            yield item
+
+
+class NoOpSpan:
+    """
+    The span returned when tracing is disabled, which does nothing, so instrumented code costs almost nothing.
+    """
+
+    is_recording = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def set_attribute(self, name: str, value):
+        pass
+
+    def add_to_attribute(self, name: str, value):
+        pass
+
+    def time_iterator(self, iterator, attribute_name: str):
+        return iterator
+
+
+_NO_OP_SPAN = NoOpSpan()
+
+
+def span(name: str, attach: bool = True, **attributes):
+    """
+    Start a tracing span, to be used as a context manager.
+
+    Parameters
+    ----------
+    name : str
+        The name of the span, e.g. the name of the function it times.
+    attach : bool
+        If True, spans started inside this one (on the same thread or asyncio task) record it as their parent.  Use
+        False for a span inside a generator, which is suspended while its consumer runs.
+    attributes
+        The initial attributes of the span, e.g. entity='Contact'.
+
+    Returns
+    -------
+    Span | NoOpSpan
+        The span, or a span that does nothing if tracing is disabled.
+    """
+    if get_tracing_exporter() == TracingExporters.NONE:
+        return _NO_OP_SPAN
+    return Span(name, attributes, attach)
+
+
+def set_trace_id(trace_id: str):
+    """
+    Set the id recorded with every span, e.g. the run id.  Call this before starting pool workers, so they inherit it.
+    """
+    global _trace_id
+    _trace_id = trace_id
+
+
+def get_tracing_exporter() -> TracingExporters:
+    """
+    Get the exporter from CRUK_TRACING_EXPORTER (NONE, FILE or EMF).  Tracing is disabled if it is not set.
+    """
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            exporter = app_env.get_env_var_value(app_env.EnvironmentVariableNames.TRACING_EXPORTER).upper()
+            if len(exporter) == 0:
+                exporter = TracingExporters.NONE.name
+            exporter_values = [e.name for e in TracingExporters]
+            if exporter not in exporter_values:
+                raise ValueError(exporter + ' is not a valid tracing exporter.')
+            _exporter = TracingExporters[exporter]
+    return _exporter
+
+
+def export_span(span_record: dict):
+    if get_tracing_exporter() == TracingExporters.EMF:
+        print(json.dumps(get_emf_record(span_record), default=str), flush=True)
+    else:
+        path = app_env.get_env_var_value(app_env.EnvironmentVariableNames.TRACING_FILE_PATH)
+        if len(path) == 0:
+            path = LOCAL_TRACE_FILE_DEFAULT_PATH
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # each span is appended with a single write, so the lines of concurrent processes do not interleave
+        with _exporter_lock, open(path, 'a', encoding='UTF8') as f:
+            f.write(json.dumps(span_record, default=str) + '\n')
+
+
+def get_emf_record(span_record: dict) -> dict:
+    """
+    Format a span as a CloudWatch Embedded Metric Format record, publishing its numeric attributes as metrics with
+    the span name and entity as dimensions.
+
+    See https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+    """
+    namespace = app_env.get_env_var_value(app_env.EnvironmentVariableNames.SERVICE_NAME)
+    metrics = [{'Name': name, 'Unit': unit} for name, unit in EMF_METRIC_UNITS.items()
+               if span_record.get(name) is not None]
+    dimension_names = [name for name in EMF_DIMENSION_NAMES if span_record.get(name) is not None]
+    return {'_aws': {'Timestamp': int(span_record['start_time'] * 1000),
+                     'CloudWatchMetrics': [{'Namespace': namespace if len(namespace) > 0 else EMF_DEFAULT_NAMESPACE,
+                                            'Dimensions': [dimension_names],
+                                            'Metrics': metrics}]},
+            **span_record}
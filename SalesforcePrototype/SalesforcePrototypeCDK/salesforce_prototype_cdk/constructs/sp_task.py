@@ -96,6 +96,7 @@ class SalesforcePrototypeTaskConstruct(Construct):
         # additional permissions
         self.grant_role_parameter_access(properties.base_name, exec_role)
         self.grant_role_secrets_access(properties.base_name, exec_role)
+        salesforce_token_parameter_name = self.grant_role_salesforce_token_access(properties.base_name, task_role)
 
         # networking
         vpc = aws_ec2.Vpc.from_lookup(self, 'vpc', vpc_id=properties.vpc_id)
@@ -111,6 +112,7 @@ class SalesforcePrototypeTaskConstruct(Construct):
 
         # add the bucket name and SNS topic name to the task definition environment variables
         properties.task_definition_env_vars['CRUK_AWS_S3_BUCKET_NAME'] = properties.bucket.bucket_name
+        properties.task_definition_env_vars['CRUK_SALESFORCE_TOKEN_STORE_NAME'] = salesforce_token_parameter_name
         if properties.notification_topic is not None and \
                 properties.notification_topic.topic_name is not None \
                 and len(properties.notification_topic.topic_name) > 0 \
@@ -246,6 +248,35 @@ class SalesforcePrototypeTaskConstruct(Construct):
         )
         exec_role.add_to_policy(exec_secrets_manager_policy)
 
+    def grant_role_salesforce_token_access(self, base_name: str, task_role: aws_iam.Role) -> str:
+        """
+        Grant the specified IAM role access to read and write the Systems Manager Parameter Store parameter that
+        caches the Salesforce access token between runs.  The parameter is created by the task code when it first
+        logs in to Salesforce.
+
+        Parameters
+        ----------
+        base_name : str
+            The base name (i.e. prefix) for the Systems Manager Parameter Store parameters.
+        task_role : aws_iam.Role
+            The IAM role to be granted access to the parameter
+
+        Returns
+        -------
+        str
+            The name of the parameter.
+        """
+        parameter_name = f'/{base_name}/salesforce-token'
+        current_account_id = Stack.of(self).account
+        current_region = Stack.of(self).region
+        task_ssm_parameter_policy = aws_iam.PolicyStatement(
+            effect=aws_iam.Effect.ALLOW,
+            actions=['ssm:GetParameter', 'ssm:PutParameter'],
+            resources=[f'arn:aws:ssm:{current_region}:{current_account_id}:parameter{parameter_name}']
+        )
+        task_role.add_to_policy(task_ssm_parameter_policy)
+        return parameter_name
+
     # -------------------- CREATE NETWORK SECURITY GROUP --------------------
 
     def create_security_group(self, vpc: aws_ec2.Vpc):
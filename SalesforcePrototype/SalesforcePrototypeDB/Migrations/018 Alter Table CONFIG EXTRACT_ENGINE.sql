@@ -0,0 +1,12 @@
+-- CICD-VAR: ADMIN_ROLE_NAME
+-- CICD-VAR: IMPLEMENTATION_DB_NAME
+-- CICD-VAR: WAREHOUSE_NAME
+
+BEGIN
+    USE ROLE {ADMIN_ROLE_NAME};
+    USE WAREHOUSE {WAREHOUSE_NAME};
+    USE DATABASE {IMPLEMENTATION_DB_NAME};
+
+    -- REST (sf.query paging) or BULK (Bulk API 2.0 query jobs)
+    ALTER TABLE SALESFORCE_LOAD.CONFIG ADD COLUMN EXTRACT_ENGINE VARCHAR(10) DEFAULT 'REST';
+END;
@@ -0,0 +1,14 @@
+-- CICD-VAR: ADMIN_ROLE_NAME
+-- CICD-VAR: IMPLEMENTATION_DB_NAME
+-- CICD-VAR: WAREHOUSE_NAME
+
+BEGIN
+    USE ROLE {ADMIN_ROLE_NAME};
+    USE WAREHOUSE {WAREHOUSE_NAME};
+    USE DATABASE {IMPLEMENTATION_DB_NAME};
+
+    -- FULL (extract every row) or INCREMENTAL (extract rows changed since the entity's high water mark)
+    ALTER TABLE SALESFORCE_LOAD.CONFIG ADD COLUMN
+        LOAD_TYPE           VARCHAR(20) DEFAULT 'FULL',
+        WATERMARK_COLUMN    VARCHAR(100) DEFAULT 'SystemModstamp';
+END;
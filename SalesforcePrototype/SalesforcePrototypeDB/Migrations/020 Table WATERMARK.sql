@@ -0,0 +1,19 @@
+-- CICD-VAR: ADMIN_ROLE_NAME
+-- CICD-VAR: IMPLEMENTATION_DB_NAME
+-- CICD-VAR: WAREHOUSE_NAME
+
+BEGIN
+    USE ROLE {ADMIN_ROLE_NAME};
+    USE WAREHOUSE {WAREHOUSE_NAME};
+    USE DATABASE {IMPLEMENTATION_DB_NAME};
+
+    CREATE OR REPLACE TABLE SALESFORCE_LOAD.WATERMARK
+    (
+        ENTITY_NAME         VARCHAR(50),
+        WATERMARK_COLUMN    VARCHAR(100),
+        HIGH_WATER_MARK     TIMESTAMP_TZ,
+        UPDATED_AT          TIMESTAMP_TZ
+    );
+
+    GRANT OWNERSHIP ON TABLE SALESFORCE_LOAD.WATERMARK TO ROLE {ADMIN_ROLE_NAME};
+END;
@@ -0,0 +1,13 @@
+-- CICD-VAR: ADMIN_ROLE_NAME
+-- CICD-VAR: IMPLEMENTATION_DB_NAME
+-- CICD-VAR: WAREHOUSE_NAME
+
+BEGIN
+    USE ROLE {ADMIN_ROLE_NAME};
+    USE WAREHOUSE {WAREHOUSE_NAME};
+    USE DATABASE {IMPLEMENTATION_DB_NAME};
+
+    -- NULL extracts the entity in one piece, otherwise the approximate number of rows in each concurrently
+    -- extracted ID range
+    ALTER TABLE SALESFORCE_LOAD.CONFIG ADD COLUMN PK_CHUNK_SIZE INT;
+END;
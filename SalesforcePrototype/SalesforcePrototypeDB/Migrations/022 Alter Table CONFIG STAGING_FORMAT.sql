@@ -0,0 +1,12 @@
+-- CICD-VAR: ADMIN_ROLE_NAME
+-- CICD-VAR: IMPLEMENTATION_DB_NAME
+-- CICD-VAR: WAREHOUSE_NAME
+
+BEGIN
+    USE ROLE {ADMIN_ROLE_NAME};
+    USE WAREHOUSE {WAREHOUSE_NAME};
+    USE DATABASE {IMPLEMENTATION_DB_NAME};
+
+    -- JSON (gzip-compressed NDJSON) or PARQUET - the format of the files staged in S3 for COPY INTO
+    ALTER TABLE SALESFORCE_LOAD.CONFIG ADD COLUMN STAGING_FORMAT VARCHAR(10) DEFAULT 'JSON';
+END;
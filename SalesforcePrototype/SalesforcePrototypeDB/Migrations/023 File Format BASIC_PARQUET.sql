@@ -0,0 +1,17 @@
+-- CICD-VAR: ADMIN_ROLE_NAME
+-- CICD-VAR: IMPLEMENTATION_DB_NAME
+-- CICD-VAR: WAREHOUSE_NAME
+
+BEGIN
+    USE ROLE {ADMIN_ROLE_NAME};
+    USE WAREHOUSE {WAREHOUSE_NAME};
+    USE DATABASE {IMPLEMENTATION_DB_NAME};
+
+    -- the compression (Snappy) is read from the Parquet files themselves
+    CREATE OR REPLACE FILE FORMAT SALESFORCE_LOAD.BASIC_PARQUET
+        TYPE = PARQUET;
+
+    GRANT OWNERSHIP ON FILE FORMAT SALESFORCE_LOAD.BASIC_PARQUET TO ROLE {ADMIN_ROLE_NAME};
+
+    GRANT USAGE ON FILE FORMAT SALESFORCE_LOAD.BASIC_PARQUET TO ROLE {ADMIN_ROLE_NAME};
+END;
@@ -0,0 +1,19 @@
+-- CICD-VAR: ADMIN_ROLE_NAME
+-- CICD-VAR: IMPLEMENTATION_DB_NAME
+-- CICD-VAR: WAREHOUSE_NAME
+
+BEGIN
+    USE ROLE {ADMIN_ROLE_NAME};
+    USE WAREHOUSE {WAREHOUSE_NAME};
+    USE DATABASE {IMPLEMENTATION_DB_NAME};
+
+    -- comma-separated list of the Salesforce fields loaded into Snowflake, in the order of the loading table columns
+    ALTER TABLE SALESFORCE_LOAD.CONFIG ADD COLUMN SELECT_COLUMNS VARCHAR(10000);
+    -- the Salesforce field that uniquely identifies each row, used to MERGE into the model table
+    ALTER TABLE SALESFORCE_LOAD.CONFIG ADD COLUMN PRIMARY_KEY_COLUMN VARCHAR(100) DEFAULT 'Id';
+
+    UPDATE SALESFORCE_LOAD.CONFIG SET SELECT_COLUMNS = 'Id, AccountId, Salutation, FirstName, LastName'
+        WHERE ENTITY_NAME = 'Contact' AND SELECT_COLUMNS IS NULL;
+    UPDATE SALESFORCE_LOAD.CONFIG SET SELECT_COLUMNS = 'Id, Name, Industry, NumberOfEmployees'
+        WHERE ENTITY_NAME = 'Account' AND SELECT_COLUMNS IS NULL;
+END;
@@ -0,0 +1,27 @@
+-- CICD-VAR: ADMIN_ROLE_NAME
+-- CICD-VAR: IMPLEMENTATION_DB_NAME
+-- CICD-VAR: WAREHOUSE_NAME
+
+BEGIN
+    USE ROLE {ADMIN_ROLE_NAME};
+    USE WAREHOUSE {WAREHOUSE_NAME};
+    USE DATABASE {IMPLEMENTATION_DB_NAME};
+
+    -- one row per entity per stage (extract, copy, merge) of each ELT run, written in one batch at the end of the run
+    CREATE OR REPLACE TABLE SALESFORCE_LOAD.RUN_METRICS
+    (
+        RUN_ID              VARCHAR(50),
+        ENTITY_NAME         VARCHAR(50),
+        STAGE_NAME          VARCHAR(20),
+        STARTED_AT          TIMESTAMP_TZ,
+        DURATION_SECONDS    FLOAT,
+        SUCCEEDED           BOOLEAN,
+        ROW_COUNT           NUMBER,
+        BYTES_RAW           NUMBER,
+        BYTES_COMPRESSED    NUMBER,
+        WORKER_ID           VARCHAR(200),
+        QUERY_IDS           VARCHAR(2000)   -- comma-separated Snowflake query ids of the stage's statements
+    );
+
+    GRANT OWNERSHIP ON TABLE SALESFORCE_LOAD.RUN_METRICS TO ROLE {ADMIN_ROLE_NAME};
+END;
@@ -0,0 +1,12 @@
+-- CICD-VAR: ADMIN_ROLE_NAME
+-- CICD-VAR: IMPLEMENTATION_DB_NAME
+-- CICD-VAR: WAREHOUSE_NAME
+
+BEGIN
+    USE ROLE {ADMIN_ROLE_NAME};
+    USE WAREHOUSE {WAREHOUSE_NAME};
+    USE DATABASE {IMPLEMENTATION_DB_NAME};
+
+    -- LOADING_TABLE (TRUNCATE, COPY INTO the loading table, then MERGE) or STAGE (one MERGE from the staged files)
+    ALTER TABLE SALESFORCE_LOAD.CONFIG ADD COLUMN LOAD_PATH VARCHAR(20) DEFAULT 'LOADING_TABLE';
+END;
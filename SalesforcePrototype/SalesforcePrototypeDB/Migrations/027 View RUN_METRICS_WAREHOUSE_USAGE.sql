@@ -0,0 +1,51 @@
+-- CICD-VAR: ADMIN_ROLE_NAME
+-- CICD-VAR: IMPLEMENTATION_DB_NAME
+-- CICD-VAR: WAREHOUSE_NAME
+
+BEGIN
+    USE ROLE {ADMIN_ROLE_NAME};
+    USE WAREHOUSE {WAREHOUSE_NAME};
+    USE DATABASE {IMPLEMENTATION_DB_NAME};
+
+    -- the warehouse time and credits of the Snowflake statements (TRUNCATE, COPY INTO and MERGE) of each entity of each
+    -- run, found from the query ids in RUN_METRICS.  ACCOUNT_USAGE lags by up to a few hours, and statements too short
+    -- to be attributed any credits are missing from QUERY_ATTRIBUTION_HISTORY.
+    CREATE OR REPLACE VIEW SALESFORCE_LOAD.RUN_METRICS_WAREHOUSE_USAGE AS
+    SELECT
+        m.RUN_ID,
+        m.ENTITY_NAME,
+        IFF(BOOLOR_AGG(m.STAGE_NAME = 'merge_from_stage'), 'STAGE', 'LOADING_TABLE') AS LOAD_PATH,
+        MAX(IFF(m.STAGE_NAME IN ('merge', 'merge_from_stage'), m.ROW_COUNT, NULL)) AS ROW_COUNT,
+        COUNT(*) AS QUERY_COUNT,
+        SUM(h.EXECUTION_TIME) / 1000 AS WAREHOUSE_SECONDS,
+        SUM(h.TOTAL_ELAPSED_TIME) / 1000 AS ELAPSED_SECONDS,
+        SUM(h.BYTES_SCANNED) AS BYTES_SCANNED,
+        SUM(a.CREDITS_ATTRIBUTED_COMPUTE) AS CREDITS_COMPUTE,
+        SUM(h.CREDITS_USED_CLOUD_SERVICES) AS CREDITS_CLOUD_SERVICES
+    FROM SALESFORCE_LOAD.RUN_METRICS m,
+        LATERAL SPLIT_TO_TABLE(m.QUERY_IDS, ',') q
+        LEFT JOIN SNOWFLAKE.ACCOUNT_USAGE.QUERY_HISTORY h ON h.QUERY_ID = TRIM(q.VALUE)
+        LEFT JOIN SNOWFLAKE.ACCOUNT_USAGE.QUERY_ATTRIBUTION_HISTORY a ON a.QUERY_ID = TRIM(q.VALUE)
+    WHERE m.STAGE_NAME IN ('copy', 'merge', 'merge_from_stage')
+    GROUP BY m.RUN_ID, m.ENTITY_NAME
+    HAVING BOOLAND_AGG(m.SUCCEEDED);
+
+    -- the two load paths side by side, per entity, averaged over the runs that used each
+    CREATE OR REPLACE VIEW SALESFORCE_LOAD.LOAD_PATH_COMPARISON AS
+    SELECT
+        ENTITY_NAME,
+        LOAD_PATH,
+        COUNT(*) AS RUN_COUNT,
+        AVG(ROW_COUNT) AS AVG_ROW_COUNT,
+        AVG(QUERY_COUNT) AS AVG_QUERY_COUNT,
+        AVG(WAREHOUSE_SECONDS) AS AVG_WAREHOUSE_SECONDS,
+        AVG(ELAPSED_SECONDS) AS AVG_ELAPSED_SECONDS,
+        AVG(CREDITS_COMPUTE + COALESCE(CREDITS_CLOUD_SERVICES, 0)) AS AVG_CREDITS,
+        SUM(CREDITS_COMPUTE + COALESCE(CREDITS_CLOUD_SERVICES, 0)) / NULLIF(SUM(ROW_COUNT), 0) * 1000000
+            AS CREDITS_PER_MILLION_ROWS
+    FROM SALESFORCE_LOAD.RUN_METRICS_WAREHOUSE_USAGE
+    GROUP BY ENTITY_NAME, LOAD_PATH;
+
+    GRANT OWNERSHIP ON VIEW SALESFORCE_LOAD.RUN_METRICS_WAREHOUSE_USAGE TO ROLE {ADMIN_ROLE_NAME} COPY CURRENT GRANTS;
+    GRANT OWNERSHIP ON VIEW SALESFORCE_LOAD.LOAD_PATH_COMPARISON TO ROLE {ADMIN_ROLE_NAME} COPY CURRENT GRANTS;
+END;
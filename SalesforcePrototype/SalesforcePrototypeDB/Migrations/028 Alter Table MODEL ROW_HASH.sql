@@ -0,0 +1,14 @@
+-- CICD-VAR: ADMIN_ROLE_NAME
+-- CICD-VAR: IMPLEMENTATION_DB_NAME
+-- CICD-VAR: WAREHOUSE_NAME
+
+BEGIN
+    USE ROLE {ADMIN_ROLE_NAME};
+    USE WAREHOUSE {WAREHOUSE_NAME};
+    USE DATABASE {IMPLEMENTATION_DB_NAME};
+
+    -- HASH() of the loaded columns of each row, so the MERGE only updates the rows that have changed.  Existing rows
+    -- have no hash, so each is rewritten once by the next MERGE.
+    ALTER TABLE SALESFORCE_MODEL.SALESFORCE_CONTACT ADD COLUMN ROW_HASH NUMBER(19, 0);
+    ALTER TABLE SALESFORCE_MODEL.SALESFORCE_ACCOUNT ADD COLUMN ROW_HASH NUMBER(19, 0);
+END;
@@ -0,0 +1,20 @@
+-- CICD-VAR: ADMIN_ROLE_NAME
+-- CICD-VAR: IMPLEMENTATION_DB_NAME
+-- CICD-VAR: WAREHOUSE_NAME
+
+BEGIN
+    USE ROLE {ADMIN_ROLE_NAME};
+    USE WAREHOUSE {WAREHOUSE_NAME};
+    USE DATABASE {IMPLEMENTATION_DB_NAME};
+
+    -- TRUE to mark the model table rows deleted in Salesforce as deleted, using the getDeleted resource
+    ALTER TABLE SALESFORCE_LOAD.CONFIG ADD COLUMN CAPTURE_DELETES BOOLEAN DEFAULT FALSE;
+    -- the latestDateCovered of the last getDeleted call, where the next capture of the entity's deletes starts
+    ALTER TABLE SALESFORCE_LOAD.WATERMARK ADD COLUMN DELETES_HIGH_WATER_MARK TIMESTAMP_TZ;
+
+    -- deleted rows are kept (soft-deleted), and unmarked if the record is undeleted in Salesforce
+    ALTER TABLE SALESFORCE_MODEL.SALESFORCE_CONTACT ADD COLUMN IS_DELETED BOOLEAN DEFAULT FALSE;
+    ALTER TABLE SALESFORCE_MODEL.SALESFORCE_CONTACT ADD COLUMN DELETED_AT TIMESTAMP_TZ;
+    ALTER TABLE SALESFORCE_MODEL.SALESFORCE_ACCOUNT ADD COLUMN IS_DELETED BOOLEAN DEFAULT FALSE;
+    ALTER TABLE SALESFORCE_MODEL.SALESFORCE_ACCOUNT ADD COLUMN DELETED_AT TIMESTAMP_TZ;
+END;